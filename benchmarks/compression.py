@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# Compares reading a synthetic archive (see synthetic.py) stored uncompressed,
+# gzip-compressed and lzma-compressed: how much space each takes and how
+# quickly its data files are read and parsed.  Reading from local disk the
+# compressed copies only cost CPU, so the time each would take on slower
+# storage, such as a network share, is also estimated from --storage-rate.
+import os, sys, shutil, tempfile, argparse
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pageload.PageLoadTestResults import AssetFactory
+from pageload import Compression
+from synthetic import Generator
+
+parsers = {
+    'headers': 'createHeaders',
+    'pageData': 'createPageData',
+    'requestsData': 'createRequestsData',
+    'utilization': 'createUtilization',
+    'PageSpeedData': 'createPageSpeedData',
+    'summary.csv': 'createRequestSummary',
+    'detail.csv': 'createRequestDetails'
+}
+
+def dataPaths(baseDir):
+    paths = []
+    for testsName in sorted(os.listdir(baseDir)):
+        testsDir = os.path.join(baseDir, testsName)
+        for resultName in sorted(os.listdir(testsDir)):
+            if resultName.isdigit():
+                paths += [path for path in Compression.iterDataPaths( os.path.join(testsDir, resultName) ) if Compression.dataExists(path)]
+    return paths
+
+def storedSize(paths):
+    return sum([os.path.getsize( Compression.findData(path) ) for path in paths])
+
+def readAll(paths):
+    size = 0
+    for path in paths:
+        fp = Compression.openData(path)
+        size += len(fp.read())
+        fp.close()
+    return size
+
+def parseAll(paths):
+    assetFactory = AssetFactory()
+    for path in paths:
+        getattr(assetFactory, parsers[os.path.basename(path)])(path)
+
+def timeBest(function, repeat):
+    best = None
+    for attempt in range(repeat):
+        start = timer()
+        function()
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark reading test results stored with each compression')
+    parser.add_argument('-t', '--tests', type=int, default=2,
+        help='Number of test directories to generate')
+    parser.add_argument('-n', '--results', type=int, default=10,
+        help='Number of results to generate in each test directory')
+    parser.add_argument('--runs', type=int, default=9,
+        help='Number of runs in each generated result')
+    parser.add_argument('-q', '--requests', type=int, default=60,
+        help='Number of requests in each generated first view')
+    parser.add_argument('--level', type=int,
+        help='Compression level to store the files at')
+    parser.add_argument('--storage-rate', type=float, default=50,
+        help='MB/s to estimate reading from slower storage at')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+        help='Number of times to read each copy; the best time is reported')
+    cli = parser.parse_args()
+
+    workDir = tempfile.mkdtemp()
+    try:
+        sourceDir = os.path.join(workDir, 'none')
+        Generator(cli.tests, cli.results, cli.runs, cli.requests).generate(sourceDir)
+        paths = dataPaths(sourceDir)
+        uncompressed = storedSize(paths)
+        print('Generated %d data files, %d KB uncompressed' % (len(paths), uncompressed / 1024))
+
+        print('%-6s %10s %8s %12s %10s %12s %14s' % ('', 'stored KB', 'ratio', 'compress ms', 'read MB/s', 'parse ms', 'at %g MB/s ms' % (cli.storage_rate)))
+        for compression in [None] + Compression.compressions:
+            name = compression or 'none'
+            if not Compression.isAvailable(compression):
+                print('%-6s not available (needs Python 3 or backports.lzma)' % (name))
+                continue
+            baseDir = os.path.join(workDir, name)
+            if compression:
+                shutil.copytree(sourceDir, baseDir)
+            copyPaths = [os.path.join(baseDir, os.path.relpath(path, sourceDir)) for path in paths]
+
+            start = timer()
+            for path in copyPaths:
+                Compression.convert(path, compression, cli.level)
+            compressTime = timer() - start
+
+            stored = storedSize(copyPaths)
+            readTime = timeBest(lambda: readAll(copyPaths), cli.repeat)
+            parseTime = timeBest(lambda: parseAll(copyPaths), cli.repeat)
+            # Parsing on storage that delivers storage-rate MB/s, if reading
+            # and parsing don't overlap
+            slowTime = parseTime + stored / (cli.storage_rate * 1024 * 1024.0)
+            print('%-6s %10d %7.0f%% %12.1f %10.1f %12.1f %14.1f' % (name, stored / 1024, 100.0 * stored / uncompressed,
+                compressTime * 1000, uncompressed / readTime / (1024 * 1024.0), parseTime * 1000, slowTime * 1000))
+    finally:
+        shutil.rmtree(workDir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# A stand-in for a WebPageTest server, for running pageload end to end
+# without one.  It answers runtest.php submissions, reports each test as
+# queued and then running through its xmlUrl, and once the test is done
+# serves its result XML, summary and detail CSVs, raw data and images.  The
+# documents are those synthetic.py writes.
+#
+# Tests are run by a fixed number of agents in the order they were
+# submitted, each run taking the same time, so queue positions and progress
+# behave as they do on a busy WPT server.  Responses can be slowed down,
+# throttled, answered with errors or dropped to see how pageload copes.
+import re, random, socket, threading, argparse
+from time import time, sleep
+from urlparse import urlparse, parse_qs
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from synthetic import Generator, rawData, summaryCsv, detailCsv
+
+rawDataFiles = {
+    'report.txt': 'headers',
+    'IEWPG.txt': 'pageData',
+    'IEWTR.txt': 'requestsData',
+    'progress.csv': 'utilization',
+    'pagespeed.txt': 'PageSpeedData'
+}
+rawDataPattern = re.compile('^(\d+)(_Cached)?_(%s)$' % ('|'.join([re.escape(name) for name in rawDataFiles.keys()])))
+imagePattern = re.compile('^(\d+)_(waterfall|checklist|screenShot)(_Cached)?\.png$')
+
+class FakeTest:
+    def __init__(self, testId, url, runs, views, started, finished):
+        self.__dict__.update(locals())
+
+class Counters:
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.polls = 0
+        self.errors = 0
+        self.dropped = 0
+    def __str__(self):
+        return '%d requests, %d bytes sent, %d tests submitted (%d rejected), %d status polls, %d errors and %d dropped connections injected' % (
+            self.requests, self.bytes, self.submitted, self.rejected, self.polls, self.errors, self.dropped)
+
+class FakeWptServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, agents=4, runTime=1.0, latency=0.0, jitter=0.0, bandwidth=0, errorRate=0.0, dropRate=0.0, rejectRate=0.0, requests=60, imageSize=30000, variants=4, seed=0):
+        HTTPServer.__init__(self, address, FakeWptHandler)
+        settings = dict(locals())
+        del settings['self'], settings['address']
+        self.__dict__.update(settings)
+        self.lock = threading.Lock()
+        self.generator = Generator(requests=requests, seed=seed)
+        self.random = random.Random(seed)
+        self.pools = dict()
+        self.tests = dict()
+        self.agentsFree = [0.0] * max(1, agents)
+        self.counters = Counters()
+        self.image = '\x89PNG\r\n\x1a\n' + ''.join([chr(self.random.randint(0, 255)) for byte in range(imageSize)])
+
+    def getUrl(self):
+        return 'http://%s:%d' % (self.server_address[0], self.server_address[1])
+
+    # The test starts on the first agent to become free and keeps it busy
+    # for all of its runs
+    def submit(self, url, runs):
+        with self.lock:
+            self.counters.submitted += 1
+            if self.random.random() < self.rejectRate:
+                self.counters.rejected += 1
+                return None
+            if url not in self.pools:
+                self.pools[url] = [self.generator.pageLoad(url) for variant in range(self.variants)]
+            views = [self.random.choice(self.pools[url]) for run in range(runs)]
+            agent = self.agentsFree.index(min(self.agentsFree))
+            started = max(time(), self.agentsFree[agent])
+            self.agentsFree[agent] = started + runs * self.runTime
+            testId = '%s_FK_%d' % (self.generator.start.strftime('%y%m%d'), len(self.tests) + 1)
+            self.tests[testId] = FakeTest(testId, url, runs, views, started, self.agentsFree[agent])
+            return self.tests[testId]
+
+    def getTest(self, testId):
+        with self.lock:
+            return self.tests.get(testId)
+
+    # Tests that will start before the given one
+    def behindCount(self, test, now):
+        with self.lock:
+            return len([other for other in self.tests.values() if now < other.started < test.started])
+
+    def count(self, name, amount=1):
+        with self.lock:
+            setattr(self.counters, name, getattr(self.counters, name) + amount)
+
+class FakeWptHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    chunkSize = 16 * 1024
+    # Buffered, so that the status line and headers go out with the body
+    # instead of as small packets held back by Nagle's algorithm
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('')
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        self._handle(self.rfile.read(length))
+
+    def _handle(self, body):
+        server = self.server
+        server.count('requests')
+        sleep(server.latency + random.uniform(0, server.jitter))
+        if random.random() < server.dropRate:
+            server.count('dropped')
+            self.close_connection = 1
+            return
+        if random.random() < server.errorRate:
+            server.count('errors')
+            return self._send(500, 'Internal Server Error', 'text/plain')
+
+        parts = urlparse(self.path)
+        path = [part for part in parts.path.split('/') if part]
+        if parts.path == '/runtest.php':
+            params = parse_qs(parts.query)
+            params.update(parse_qs(body))
+            return self._runTest(params)
+        if len(path) == 2 and path[0] == 'xmlResult':
+            return self._status(path[1])
+        if len(path) == 3 and path[0] in ['result', 'results']:
+            test = server.getTest(path[1])
+            if test is not None and time() >= test.finished:
+                return self._result(test, path[0], path[2])
+        self._send(404, 'Not Found', 'text/plain')
+
+    def _runTest(self, params):
+        url = params.get('url', ['http://www.example.com/'])[0]
+        runs = int(params.get('runs', ['1'])[0])
+        test = self.server.submit(url, runs)
+        if test is None:
+            return self._xml('<?xml version="1.0" encoding="UTF-8"?><response><statusCode>400</statusCode><statusText>Test request rejected</statusText></response>')
+        self._xml( self.server.generator.requestXml(self.server.getUrl(), test.testId) )
+
+    def _status(self, testId):
+        self.server.count('polls')
+        test = self.server.getTest(testId)
+        now = time()
+        if test is None:
+            return self._xml('<?xml version="1.0" encoding="UTF-8"?><response><statusCode>400</statusCode><statusText>Test not found</statusText></response>')
+        if now < test.started:
+            return self._xml('<?xml version="1.0" encoding="UTF-8"?><response><statusCode>101</statusCode><statusText>Waiting behind %(behind)d other tests...</statusText><data><statusCode>101</statusCode><testId>%(id)s</testId><behindCount>%(behind)d</behindCount></data></response>'
+                % {'id': testId, 'behind': self.server.behindCount(test, now)})
+        if now < test.finished:
+            return self._xml('<?xml version="1.0" encoding="UTF-8"?><response><statusCode>100</statusCode><statusText>Test Started</statusText><data><statusCode>100</statusCode><testId>%s</testId><testsExpected>%d</testsExpected><testsCompleted>%d</testsCompleted></data></response>'
+                % (testId, test.runs, int((now - test.started) / self.server.runTime)))
+        self._xml( self.server.generator.responseXml(self.server.getUrl(), testId, test.runs) )
+
+    def _result(self, test, kind, name):
+        if kind == 'result' and name == 'page_data.csv':
+            return self._send(200, summaryCsv(test.views), 'text/csv')
+        if kind == 'result' and name == 'requests.csv':
+            return self._send(200, detailCsv(test.views), 'text/csv')
+        match = rawDataPattern.match(name)
+        if kind == 'results' and match and 1 <= int(match.group(1)) <= test.runs:
+            view = test.views[int(match.group(1)) - 1][1 if match.group(2) else 0]
+            return self._send(200, rawData(view)[ rawDataFiles[match.group(3)] ], 'text/plain')
+        match = imagePattern.match(name)
+        if kind == 'results' and match and 1 <= int(match.group(1)) <= test.runs:
+            return self._send(200, self.server.image, 'image/png')
+        self._send(404, 'Not Found', 'text/plain')
+
+    def _xml(self, body):
+        self._send(200, body, 'text/xml')
+
+    # With a bandwidth limit the body is written a chunk at a time, pausing
+    # after each as long as sending it would have taken
+    def _send(self, status, body, contentType):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            for offset in range(0, len(body), self.chunkSize):
+                chunk = body[offset:offset + self.chunkSize]
+                self.wfile.write(chunk)
+                if self.server.bandwidth:
+                    self.wfile.flush()
+                    sleep(float(len(chunk)) / self.server.bandwidth)
+            self.wfile.flush()
+        except socket.error:
+            self.close_connection = 1
+            return
+        self.server.count('bytes', len(body))
+
+def addServerArguments(parser):
+    parser.add_argument('--agents', type=int, default=4,
+        help='Number of tests the server runs at once; the rest wait in a queue')
+    parser.add_argument('--run-time', type=float, default=1.0,
+        help='Seconds each run of a test takes')
+    parser.add_argument('--latency', type=float, default=0.0,
+        help='Seconds added before every response')
+    parser.add_argument('--jitter', type=float, default=0.0,
+        help='Up to this many more seconds, at random, added before every response')
+    parser.add_argument('--bandwidth', type=int, default=0,
+        help='Bytes per second each response is sent at (0 for no limit)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+        help='Fraction of requests answered with HTTP 500')
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+        help='Fraction of requests whose connection is closed without an answer')
+    parser.add_argument('--reject-rate', type=float, default=0.0,
+        help='Fraction of test submissions rejected')
+    parser.add_argument('--requests', type=int, default=60,
+        help='Number of requests in the first view of each page load')
+    parser.add_argument('--image-size', type=int, default=30000,
+        help='Size in bytes of each image')
+    parser.add_argument('--seed', type=int, default=0,
+        help='Seed for the generated results')
+
+def createServer(cli, address):
+    return FakeWptServer(address, cli.agents, cli.run_time, cli.latency, cli.jitter, cli.bandwidth,
+        cli.error_rate, cli.drop_rate, cli.reject_rate, cli.requests, cli.image_size, seed=cli.seed)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve fake WebPageTest results for pageload run')
+    parser.add_argument('-p', '--port', type=int, default=8765,
+        help='Port to listen on; pass localhost:PORT as wptserver in the tests file')
+    addServerArguments(parser)
+    cli = parser.parse_args()
+
+    server = createServer(cli, ('localhost', cli.port))
+    print('Serving fake WebPageTest results on %s' % (server.getUrl()))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(server.counters)
+
+if __name__ == '__main__':
+    main()
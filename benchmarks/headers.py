@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# Times AssetFactory.createHeaders on synthetic headers files of increasing
+# size.  The time per request should stay flat as the number of requests grows.
+import os, sys, shutil, tempfile, argparse
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pageload.PageLoadTestResults import AssetFactory
+
+def writeHeaders(path, requests):
+    fp = open(path, 'w')
+    fp.write('Request details:\n\n')
+    for index in range(1, requests + 1):
+        fp.write('Request %d:\n' % (index))
+        fp.write('      Action: GET\n      Url: http://example.com/asset/%d.js\n      Host: example.com\n      Result code: 200\n' % (index))
+        fp.write('Request Headers:\n')
+        fp.write('      GET /asset/%d.js HTTP/1.1\n      Host: example.com\n      User-Agent: Mozilla/5.0\n      Accept: */*\n      Accept-Encoding: gzip, deflate\n      Cookie: session="abc\\%d"\n' % (index, index))
+        fp.write('Response Headers:\n')
+        fp.write('      HTTP/1.1 200 OK\n      Content-Type: text/javascript\n      Content-Length: %d\n      Cache-Control: max-age=3600\n      Server: Apache\n\n' % (index * 10))
+    fp.close()
+
+def timeParse(path, repeat):
+    factory = AssetFactory()
+    best = None
+    for attempt in range(repeat):
+        start = timer()
+        factory.createHeaders(path)
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the WPT headers file parser')
+    parser.add_argument('-s', '--sizes', default='100,200,400,800,1600,3200',
+        help='Comma separated numbers of requests per headers file')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+        help='Number of times to parse each file; the best time is reported')
+    parser.add_argument('--max-growth', type=float, default=2.0,
+        help='Fail if the time per request of the largest file exceeds this multiple of the smallest')
+    cli = parser.parse_args()
+
+    sizes = [int(size) for size in cli.sizes.split(',')]
+    directory = tempfile.mkdtemp()
+    try:
+        perRequest = []
+        print('%10s %12s %16s' % ('requests', 'total (ms)', 'per request (us)'))
+        for size in sizes:
+            path = os.path.join(directory, 'headers-%d' % (size))
+            writeHeaders(path, size)
+            elapsed = timeParse(path, cli.repeat)
+            perRequest.append(elapsed / size)
+            print('%10d %12.2f %16.2f' % (size, elapsed * 1000, elapsed / size * 1e6))
+    finally:
+        shutil.rmtree(directory)
+
+    growth = perRequest[-1] / perRequest[0]
+    print('Growth in time per request: %.2fx' % (growth))
+    if growth > cli.max_growth:
+        print('Parsing does not scale linearly')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
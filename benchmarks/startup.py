@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# Times how long pageload takes to start and run cheap commands, against a
+# bare interpreter, and lists the pageload modules each command loads.
+# Commands should only load the modules they use.
+import os, sys, shutil, tempfile, argparse, subprocess
+from timeit import default_timer as timer
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Runs the command line, then reports the pageload modules it loaded on
+# stderr
+script = '''
+import sys
+sys.argv[0] = 'pageload'
+from pageload.Main import Cli
+try:
+    Cli()
+except SystemExit:
+    pass
+sys.stderr.write(' '.join(sorted([name[9:] for name in sys.modules if name.startswith('pageload.') and sys.modules[name]])))
+'''
+
+def timeCommand(arguments, directory, repeat):
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join([root] + [path for path in [environment.get('PYTHONPATH')] if path])
+    best = None
+    modules = None
+    for attempt in range(repeat):
+        start = timer()
+        process = subprocess.Popen(arguments, cwd=directory, env=environment, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (out, err) = process.communicate()
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+        modules = err.decode('utf-8', 'replace').strip().split('\n')[-1]
+    return (best, modules)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pageload start up time')
+    parser.add_argument('-c', '--commands', default='--help;list-filters;ls;cache',
+        help='Semicolon separated command lines to time')
+    parser.add_argument('-r', '--repeat', type=int, default=10,
+        help='Number of times to run each command; the best time is reported')
+    parser.add_argument('--max-overhead', type=float, default=100,
+        help='Fail if any command takes more than this many milliseconds longer than a bare interpreter')
+    cli = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        (baseline, modules) = timeCommand([sys.executable, '-c', 'pass'], directory, cli.repeat)
+        print('%-16s %10s %14s  %s' % ('command', 'time (ms)', 'overhead (ms)', 'modules'))
+        print('%-16s %10.1f %14s' % ('(interpreter)', baseline * 1000, '-'))
+        worst = 0
+        for command in cli.commands.split(';'):
+            (elapsed, modules) = timeCommand([sys.executable, '-c', script] + command.split(), directory, cli.repeat)
+            overhead = (elapsed - baseline) * 1000
+            worst = max(worst, overhead)
+            print('%-16s %10.1f %14.1f  %s' % (command, elapsed * 1000, overhead, modules))
+    finally:
+        shutil.rmtree(directory)
+
+    if worst > cli.max_overhead:
+        print('Start up takes more than %.0f ms' % (cli.max_overhead))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# Times the analysis side of pageload on a synthetic archive (see
+# synthetic.py): discovering test directories, each AssetFactory parser and
+# each filter.  Timings are compared with those stored in baseline.json, which
+# --save rewrites.  Baselines only mean something on the machine and at the
+# scale they were recorded at, so record one before making a change and
+# compare after it.
+import os, sys, json, shutil, tempfile, argparse
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pageload.PageLoadTestDirectory import Factory as PageLoadTestDirectoryFactory
+from pageload.PageLoadTestResults import Factory as PageLoadTestResultsFactory, AssetFactory
+from pageload.ColumnCache import Factory as ColumnCacheFactory
+from pageload.Filter import Factory as FilterFactory
+from synthetic import Generator
+
+defaultBaseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Each benchmark is (name, unit, units, setup, function); setup runs before
+# every timed call of function
+def benchmarks(baseDir, sample):
+    directoryFactory = PageLoadTestDirectoryFactory( PageLoadTestResultsFactory(False) )
+    testsDirs = sorted([os.path.join(baseDir, name) for name in os.listdir(baseDir) if os.path.isdir( os.path.join(baseDir, name, '.pageload') )])
+    results = [result for directory in directoryFactory.discover(baseDir) for result in directory.getTestResults()][:sample]
+    viewDirs = [os.path.join(result.testDir, 'run', str(run), view, 'data') for result in results for run in result.getRunIds() for view in ['firstView', 'repeatView']]
+    runs = sum([result.getRunCount() for result in results])
+
+    def removeManifests():
+        for testsDir in testsDirs:
+            path = os.path.join(testsDir, '.pageload', 'manifest')
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def discover():
+        for directory in directoryFactory.discover(baseDir):
+            directory.getTestResults()
+
+    def parseViews(method, fileName, assetFactory=None):
+        assetFactory = assetFactory or AssetFactory()
+        def parse():
+            for viewDir in viewDirs:
+                getattr(assetFactory, method)( os.path.join(viewDir, fileName) )
+        return parse
+
+    def parseResults(method, fileName):
+        assetFactory = AssetFactory()
+        def parse():
+            for result in results:
+                for row in getattr(assetFactory, method)( os.path.join(result.testDir, fileName) ):
+                    pass
+        return parse
+
+    def runFilter(name):
+        def filterAll():
+            # Results are opened afresh so that nothing parsed by an earlier
+            # call is reused
+            resultsFactory = PageLoadTestResultsFactory(False)
+            for result in results:
+                FilterFactory().create(name).filter( resultsFactory.create(result.testDir, result.getSignature()), result.getRunIds() )
+        return filterAll
+
+    columnCache = ColumnCacheFactory().create()
+    yield ('discover (no manifest)', 'result', len(results), removeManifests, discover)
+    yield ('discover', 'result', len(results), None, discover)
+    yield ('parse headers', 'file', len(viewDirs), None, parseViews('createHeaders', 'headers'))
+    yield ('parse pageData', 'file', len(viewDirs), None, parseViews('createPageData', 'pageData'))
+    yield ('parse requestsData', 'file', len(viewDirs), None, parseViews('createRequestsData', 'requestsData'))
+    yield ('parse requestsData (column cache)', 'file', len(viewDirs), parseViews('createRequestsData', 'requestsData', AssetFactory(columnCache)), parseViews('createRequestsData', 'requestsData', AssetFactory(columnCache)))
+    yield ('parse utilization', 'file', len(viewDirs), None, parseViews('createUtilization', 'utilization'))
+    yield ('parse PageSpeedData', 'file', len(viewDirs), None, parseViews('createPageSpeedData', 'PageSpeedData'))
+    yield ('parse summary.csv', 'file', len(results), None, parseResults('createRequestSummary', 'summary.csv'))
+    yield ('parse detail.csv', 'file', len(results), None, parseResults('createRequestDetails', 'detail.csv'))
+    yield ('stream detail.csv', 'file', len(results), None, parseResults('iterRequestDetails', 'detail.csv'))
+    for name in sorted(FilterFactory.filterMap.keys()):
+        yield ('filter %s' % (name), 'run', runs, None, runFilter(name))
+
+def timeBenchmark(setup, function, repeat):
+    best = None
+    for attempt in range(repeat):
+        if setup is not None:
+            setup()
+        start = timer()
+        function()
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def readBaseline(path, scale):
+    try:
+        fp = open(path)
+        baseline = json.loads( fp.read() )
+        fp.close()
+    except (IOError, ValueError):
+        return None
+    if baseline.get('scale') != scale:
+        print('Not comparing with %s, it was recorded at a different scale: %s' % (path, baseline.get('scale')))
+        return None
+    return baseline['timings']
+
+def writeBaseline(path, scale, timings):
+    fp = open(path + '.tmp', 'w')
+    fp.write( json.dumps({'scale': scale, 'python': sys.version.split()[0], 'timings': timings}, sort_keys=True, indent=4) + '\n' )
+    fp.close()
+    os.rename(path + '.tmp', path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark discovering, parsing and filtering test results')
+    parser.add_argument('-d', '--dir',
+        help='Archive to benchmark instead of a generated one (its column caches are written to)')
+    parser.add_argument('-t', '--tests', type=int, default=2,
+        help='Number of test directories to generate')
+    parser.add_argument('-n', '--results', type=int, default=20,
+        help='Number of results to generate in each test directory')
+    parser.add_argument('--runs', type=int, default=9,
+        help='Number of runs in each generated result')
+    parser.add_argument('-q', '--requests', type=int, default=60,
+        help='Number of requests in each generated first view')
+    parser.add_argument('-s', '--sample', type=int, default=40,
+        help='Number of results to parse and filter')
+    parser.add_argument('-k', '--only',
+        help='Only run the benchmarks whose names contain this')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+        help='Number of times to run each benchmark; the best time is reported')
+    parser.add_argument('-b', '--baseline', default=defaultBaseline,
+        help='File holding the baseline timings')
+    parser.add_argument('--save', action='store_true',
+        help='Store these timings as the new baseline')
+    parser.add_argument('--max-regression', type=float,
+        help='Fail if a benchmark is slower than its baseline by more than this fraction (e.g. 0.25)')
+    cli = parser.parse_args()
+
+    if cli.dir:
+        (baseDir, scale) = (cli.dir, {'dir': os.path.abspath(cli.dir), 'sample': cli.sample})
+    else:
+        baseDir = os.path.join(tempfile.mkdtemp(), 'archive')
+        scale = {'tests': cli.tests, 'results': cli.results, 'runs': cli.runs, 'requests': cli.requests, 'sample': cli.sample}
+        start = timer()
+        Generator(cli.tests, cli.results, cli.runs, cli.requests).generate(baseDir)
+        print('Generated %d results of %d runs in %.1f s' % (cli.tests * cli.results, cli.runs, timer() - start))
+
+    baseline = None if cli.save else readBaseline(cli.baseline, scale)
+    timings = dict()
+    regressions = []
+    try:
+        print('%-36s %10s %14s %10s %8s' % ('benchmark', 'time (ms)', 'per unit (us)', 'baseline', 'change'))
+        for (name, unit, units, setup, function) in benchmarks(baseDir, cli.sample):
+            if cli.only and cli.only not in name:
+                continue
+            elapsed = timeBenchmark(setup, function, cli.repeat)
+            timings[name] = elapsed
+            line = '%-36s %10.1f %9.1f/%-4s' % (name, elapsed * 1000, elapsed / max(units, 1) * 1e6, unit)
+            if baseline and name in baseline:
+                change = elapsed / baseline[name] - 1
+                line += ' %10.1f %+7.0f%%' % (baseline[name] * 1000, change * 100)
+                if cli.max_regression is not None and change > cli.max_regression:
+                    regressions.append(name)
+            print(line)
+    finally:
+        if not cli.dir:
+            shutil.rmtree( os.path.dirname(baseDir) )
+
+    if cli.save:
+        if cli.only:
+            previous = readBaseline(cli.baseline, scale) or dict()
+            previous.update(timings)
+            timings = previous
+        writeBaseline(cli.baseline, scale, timings)
+        print('Saved baseline to %s' % (cli.baseline))
+    if regressions:
+        print('Slower than the baseline: %s' % (', '.join(regressions)))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# Writes a synthetic archive of WPT results in the layout pageload run
+# leaves behind: one directory per test, holding a timestamped directory per
+# result with request.xml, response.xml, parameters.json, summary.csv,
+# detail.csv and run/<n>/<view>/data/{headers,pageData,requestsData,
+# utilization,PageSpeedData}.  The manifest, time series and caches are left
+# for pageload to create, as they would be for results copied in from
+# elsewhere.
+#
+# Generating a distinct page for every view would make large archives slow to
+# write, so each test directory draws its views from a pool of page loads.
+# fakewpt.py serves the same documents over HTTP.
+import os, sys, csv, json, random, argparse
+from StringIO import StringIO
+from datetime import datetime, timedelta
+
+requestColumns = ['Date', 'Time', 'Event Name', 'IP Address', 'Action', 'Host', 'URL', 'Response Code',
+    'Time to Load (ms)', 'Time to First Byte (ms)', 'Start Time (ms)', 'Bytes Out', 'Bytes In', 'Object Size',
+    'Cookie Size (out)', 'Cookie Count(out)', 'Expires', 'Cache Control', 'Content Type', 'Content Encoding',
+    'Transaction Type', 'Socket ID', 'Document ID', 'End Time (ms)', 'Descriptor', 'Lab ID', 'Dialer ID',
+    'Connection Type', 'Cached', 'Event URL', 'Pagetest Build', 'Measurement Type', 'Experimental',
+    'Event GUID', 'Sequence Number', 'Cache Score', 'Static CDN Score', 'GZIP Score', 'Cookie Score',
+    'Keep-Alive Score', 'DOCTYPE Score', 'Minify Score', 'Combine Score', 'Compression Score', 'ETag Score',
+    'Flagged', 'Secure', 'DNS Time', 'Connect Time', 'SSL Time', 'Gzip Total Bytes', 'Gzip Savings',
+    'Minify Total Bytes', 'Minify Savings', 'Image Total Bytes', 'Image Savings', 'Cache Time (sec)',
+    'Real Start Time (ms)', 'Full Time to Load (ms)', 'Optimization Checked', 'CDN Provider', 'DNS Start',
+    'DNS End', 'Connect Start', 'Connect End', 'SSL Negotiation Start', 'SSL Negotiation End', 'Initiator',
+    'Initiator Line', 'Initiator Column']
+
+pageColumns = ['Date', 'Time', 'Event Name', 'URL', 'Load Time (ms)', 'Time to First Byte (ms)', 'unused',
+    'Bytes Out', 'Bytes In', 'DNS Lookups', 'Connections', 'Requests', 'OK Responses', 'Redirects',
+    'Not Modified', 'Not Found', 'Other Responses', 'Error Code', 'Time to Start Render (ms)', 'Segments Transmitted',
+    'Segments Retransmitted', 'Packet Loss (out)', 'Activity Time(ms)', 'Descriptor', 'Lab ID', 'Dialer ID',
+    'Connection Type', 'Cached', 'Event URL', 'Pagetest Build', 'Measurement Type', 'Experimental',
+    'Doc Complete Time (ms)', 'Event GUID', 'Time to DOM Element (ms)', 'Includes Object Data', 'Cache Score',
+    'Static CDN Score', 'One CDN Score', 'GZIP Score', 'Cookie Score', 'Keep-Alive Score', 'DOCTYPE Score',
+    'Minify Score', 'Combine Score', 'Bytes Out (Doc)', 'Bytes In (Doc)', 'DNS Lookups (Doc)', 'Connections (Doc)',
+    'Requests (Doc)', 'OK Responses (Doc)', 'Redirects (Doc)', 'Not Modified (Doc)', 'Not Found (Doc)',
+    'Other Responses (Doc)', 'Compression Score', 'Host', 'IP Address', 'ETag Score', 'Flagged Requests',
+    'Flagged Connections', 'Max Simultaneous Flagged Connections', 'Time to Base Page Complete (ms)',
+    'Base Page Result', 'Gzip Total Bytes', 'Gzip Savings', 'Minify Total Bytes', 'Minify Savings',
+    'Image Total Bytes', 'Image Savings', 'Base Page Redirects', 'Optimization Checked', 'AFT (ms)', 'DOM Elements',
+    'PageSpeed Version', 'Page Title', 'Time to Title', 'Load Event Start', 'Load Event End',
+    'DOM Content Ready Start', 'DOM Content Ready End', 'Visually Complete (ms)', 'Browser Name', 'Browser Version',
+    'Base Page Server Count', 'Base Page Server RTT', 'Base Page CDN', 'Adult Site']
+
+utilizationColumns = ['Offset Time (ms)', 'Bandwidth In (kbps)', 'CPU Utilization (%)', 'Memory Use (KB)']
+
+pageSpeedRules = ['AvoidBadRequests', 'AvoidCssImport', 'AvoidDocumentWrite', 'CombineExternalCss',
+    'CombineExternalJavaScript', 'EnableGzipCompression', 'LeverageBrowserCaching', 'MinifyCss',
+    'MinifyHTML', 'MinifyJavaScript', 'MinimizeRedirects', 'OptimizeImages', 'PutCssInTheDocumentHead',
+    'ServeScaledImages', 'SpecifyACacheValidator', 'SpecifyImageDimensions']
+
+# (content type, file extension, smallest size, largest size, share of requests)
+assetTypes = [
+    ('text/javascript', 'js', 800, 120000, 0.3),
+    ('text/css', 'css', 400, 60000, 0.15),
+    ('image/png', 'png', 200, 90000, 0.25),
+    ('image/jpeg', 'jpg', 2000, 250000, 0.2),
+    ('image/gif', 'gif', 40, 8000, 0.1)
+]
+
+class Generator:
+    def __init__(self, tests=2, results=20, runs=9, requests=60, variants=16, seed=0):
+        self.__dict__.update(locals())
+        self.random = random.Random(seed)
+        self.start = datetime(2011, 1, 3, 9, 0, 0)
+
+    def generate(self, baseDir):
+        for test in range(1, self.tests + 1):
+            name = 'test-%03d' % (test)
+            testsDir = os.path.join(baseDir, name)
+            os.makedirs( os.path.join(testsDir, '.pageload') )
+            url = 'http://www.example%d.com/' % (test)
+            pool = [self.pageLoad(url) for variant in range(self.variants)]
+            for result in range(self.results):
+                when = self.start + timedelta(hours=result, seconds=test)
+                self._writeResult(testsDir, when, '%s_%d_%d' % (when.strftime('%y%m%d'), test, result), url, pool)
+
+    # One page load of each view, as (pageData, requestsData, headers,
+    # utilization, PageSpeedData), with pageData and requestsData as rows
+    def pageLoad(self, url):
+        views = []
+        for cached in [0, 1]:
+            requests = self._requests(url, cached)
+            views.append( (self._page(url, cached, requests), requests, self._headers(requests), self._utilization(requests), self._pageSpeed()) )
+        return views
+
+    def _requests(self, url, cached):
+        rng = self.random
+        hosts = [url[7:-1], 'static.' + url[11:-1], 'cdn.example.net', 'www.google-analytics.com']
+        # Most of the page is cached in the repeat view
+        count = self.requests if not cached else max(1, self.requests // 4)
+        rows = []
+        start = 0
+        for seq in range(count):
+            (contentType, extension, smallest, largest, share) = self._assetType()
+            if seq == 0:
+                (contentType, extension, smallest, largest) = ('text/html', 'html', 8000, 60000)
+            size = rng.randint(smallest, largest)
+            ttfb = rng.randint(20, 400)
+            load = ttfb + size // rng.randint(200, 2000)
+            start += rng.randint(0, 120)
+            host = hosts[0] if seq == 0 else rng.choice(hosts)
+            path = '/' if seq == 0 else '/assets/%d/%x.%s' % (seq, rng.getrandbits(32), extension)
+            row = dict([(column, 0) for column in requestColumns])
+            row.update({
+                'Date': '1/3/2011', 'Time': '9:00:00 AM', 'Event Name': 'Launch', 'IP Address': '10.0.%d.%d' % (seq % 256, hosts.index(host)),
+                'Action': 'GET', 'Host': host, 'URL': path, 'Response Code': 304 if cached and seq else 200,
+                'Time to Load (ms)': load, 'Time to First Byte (ms)': ttfb, 'Start Time (ms)': start,
+                'Bytes Out': rng.randint(300, 900), 'Bytes In': size + 300, 'Object Size': size,
+                'Expires': 'Tue, 03 Jan 2012 09:00:00 GMT', 'Cache Control': 'max-age=31536000', 'Content Type': contentType,
+                'Content Encoding': 'gzip' if extension in ['js', 'css', 'html'] else '', 'Transaction Type': 3,
+                'Socket ID': seq % 6 + 1, 'Document ID': 1, 'End Time (ms)': start + load, 'Descriptor': 'Synthetic',
+                'Lab ID': 'Dulles', 'Connection Type': 'DSL', 'Cached': cached, 'Event URL': url, 'Pagetest Build': '2.6',
+                'Measurement Type': 1, 'Sequence Number': seq + 1, 'Cache Score': rng.choice([-1, 50, 100]),
+                'Static CDN Score': rng.choice([-1, 0, 100]), 'GZIP Score': rng.choice([-1, 100]), 'Keep-Alive Score': 100,
+                'Minify Score': -1, 'Compression Score': -1, 'ETag Score': -1, 'DNS Time': rng.randint(-1, 40),
+                'Connect Time': rng.randint(-1, 60), 'SSL Time': -1, 'Cache Time (sec)': 31536000,
+                'Real Start Time (ms)': start, 'Full Time to Load (ms)': load, 'Optimization Checked': 1,
+                'Initiator': '' if seq == 0 else url
+            })
+            rows.append([row[column] for column in requestColumns])
+        return rows
+
+    def _assetType(self):
+        pick = self.random.random()
+        for assetType in assetTypes:
+            pick -= assetType[4]
+            if pick <= 0:
+                return assetType
+        return assetTypes[-1]
+
+    def _page(self, url, cached, requests):
+        index = dict([(column, position) for (position, column) in enumerate(requestColumns)])
+        loadTime = max([row[index['End Time (ms)']] for row in requests])
+        bytesIn = sum([row[index['Bytes In']] for row in requests])
+        bytesOut = sum([row[index['Bytes Out']] for row in requests])
+        ok = len([row for row in requests if row[index['Response Code']] == 200])
+        row = dict([(column, 0) for column in pageColumns])
+        row.update({
+            'Date': '1/3/2011', 'Time': '9:00:00 AM', 'Event Name': 'Launch', 'URL': url, 'Load Time (ms)': loadTime,
+            'Time to First Byte (ms)': requests[0][index['Time to First Byte (ms)']], 'Bytes Out': bytesOut, 'Bytes In': bytesIn,
+            'DNS Lookups': 4, 'Connections': 12, 'Requests': len(requests), 'OK Responses': ok, 'Not Modified': len(requests) - ok,
+            'Time to Start Render (ms)': loadTime // 2, 'Activity Time(ms)': loadTime, 'Descriptor': 'Synthetic',
+            'Lab ID': 'Dulles', 'Connection Type': 'DSL', 'Cached': cached, 'Event URL': url, 'Pagetest Build': '2.6',
+            'Measurement Type': 1, 'Doc Complete Time (ms)': loadTime, 'Bytes Out (Doc)': bytesOut, 'Bytes In (Doc)': bytesIn,
+            'Requests (Doc)': len(requests), 'OK Responses (Doc)': ok, 'Host': url[7:-1], 'IP Address': '10.0.0.0',
+            'Time to Base Page Complete (ms)': requests[0][index['End Time (ms)']], 'Base Page Result': 0,
+            'DOM Elements': self.random.randint(300, 3000), 'PageSpeed Version': '1.9', 'Page Title': 'Example %s' % (url),
+            'Browser Name': 'Internet Explorer', 'Browser Version': '8.0', 'Base Page CDN': ''
+        })
+        return [row[column] for column in pageColumns]
+
+    def _headers(self, requests):
+        index = dict([(column, position) for (position, column) in enumerate(requestColumns)])
+        lines = ['Request details:', '']
+        for (seq, row) in enumerate(requests):
+            (host, path) = (row[index['Host']], row[index['URL']])
+            lines += [
+                'Request %d:' % (seq + 1),
+                '      Action: GET',
+                '      Url: http://%s%s' % (host, path),
+                '      Host: %s' % (host),
+                '      Result code: %s' % (row[index['Response Code']]),
+                '      Transaction time: %s milliseconds' % (row[index['Time to Load (ms)']]),
+                '      Bytes In (downloaded): %s B' % (row[index['Bytes In']]),
+                'Request Headers:',
+                '      GET %s HTTP/1.1' % (path),
+                '      Accept: */*',
+                '      Referer: %s' % (row[index['Event URL']]),
+                '      Accept-Language: en-us',
+                '      User-Agent: Mozilla/4.0 (compatible; MSIE 8.0; Windows NT 6.1; Trident/4.0; PTST 2.6)',
+                '      Accept-Encoding: gzip, deflate',
+                '      Host: %s' % (host),
+                '      Connection: Keep-Alive',
+                'Response Headers:',
+                '      HTTP/1.1 %s %s' % (row[index['Response Code']], 'OK' if row[index['Response Code']] == 200 else 'Not Modified'),
+                '      Date: Mon, 03 Jan 2011 09:00:00 GMT',
+                '      Server: Apache',
+                '      Cache-Control: max-age=31536000',
+                '      Content-Type: %s' % (row[index['Content Type']]),
+                '      Content-Length: %s' % (row[index['Object Size']]),
+                ''
+            ]
+        return '\n'.join(lines) + '\n'
+
+    def _utilization(self, requests):
+        end = max([row[requestColumns.index('End Time (ms)')] for row in requests])
+        lines = [','.join(utilizationColumns)]
+        for offset in range(0, end + 100, 100):
+            lines.append('%d,%d,%d,%d' % (offset, self.random.randint(0, 5000), self.random.randint(0, 100), self.random.randint(40000, 90000)))
+        return '\r\n'.join(lines) + '\r\n'
+
+    def _pageSpeed(self):
+        return json.dumps([{'name': rule, 'score': self.random.randint(0, 100), 'weight': self.random.randint(1, 3)} for rule in pageSpeedRules])
+
+    def _writeResult(self, testsDir, when, testId, url, pool):
+        resultDir = os.path.join(testsDir, when.strftime('%Y%m%d%H%M%S'))
+        server = 'http://wpt.example.com'
+        config = {'f': 'xml', 'k': 'KEY', 'location': 'Dulles:IE8.DSL', 'runs': self.runs, 'url': url, 'wptserver': 'wpt.example.com'}
+        views = [self.random.choice(pool) for run in range(self.runs)]
+
+        os.makedirs( os.path.join(resultDir, 'run') )
+        self._write(os.path.join(resultDir, 'parameters.json'), json.dumps({'url': url, 'config': config}, sort_keys=True, indent=4))
+        self._write(os.path.join(resultDir, 'request.xml'), self.requestXml(server, testId))
+        self._write(os.path.join(resultDir, 'response.xml'), self.responseXml(server, testId, self.runs))
+        self._write(os.path.join(resultDir, 'summary.csv'), summaryCsv(views))
+        self._write(os.path.join(resultDir, 'detail.csv'), detailCsv(views))
+
+        for (run, (firstView, repeatView)) in enumerate(views, 1):
+            for (viewName, view) in [('firstView', firstView), ('repeatView', repeatView)]:
+                dataDir = os.path.join(resultDir, 'run', str(run), viewName, 'data')
+                os.makedirs(dataDir)
+                os.makedirs( os.path.join(resultDir, 'run', str(run), viewName, 'images') )
+                for (name, contents) in rawData(view).items():
+                    self._write(os.path.join(dataDir, name), contents)
+
+    # What runtest.php answers a submission with
+    def requestXml(self, server, testId):
+        return ('<?xml version="1.0" encoding="UTF-8"?><response><statusCode>200</statusCode><statusText>Ok</statusText><data>'
+            '<testId>%s</testId><ownerKey>%032x</ownerKey><xmlUrl>%s/xmlResult/%s/</xmlUrl><userUrl>%s/result/%s/</userUrl>'
+            '<summaryCSV>%s/result/%s/page_data.csv</summaryCSV><detailCSV>%s/result/%s/requests.csv</detailCSV></data></response>'
+            % (testId, self.random.getrandbits(128), server, testId, server, testId, server, testId, server, testId))
+
+    # response.xml as pageload writes it, pretty printed by minidom
+    def responseXml(self, server, testId, runs):
+        lines = ['<?xml version="1.0" ?>', '<response>', '\t<statusCode>200</statusCode>', '\t<data>', '\t\t<runs>%d</runs>' % (runs)]
+        for run in range(1, runs + 1):
+            lines += ['\t\t<run>', '\t\t\t<id>%d</id>' % (run)]
+            for view in ['firstView', 'repeatView']:
+                lines += ['\t\t\t<%s>' % (view), '\t\t\t\t<images>']
+                for image in ['waterfall', 'checklist', 'screenShot']:
+                    lines.append('\t\t\t\t\t<%s>%s/results/%s/%d_%s%s.png</%s>' % (image, server, testId, run, image, '_Cached' if view == 'repeatView' else '', image))
+                lines += ['\t\t\t\t</images>', '\t\t\t\t<rawData>']
+                for (name, suffix) in [('headers', 'report.txt'), ('pageData', 'IEWPG.txt'), ('requestsData', 'IEWTR.txt'), ('utilization', 'progress.csv'), ('PageSpeedData', 'pagespeed.txt')]:
+                    lines.append('\t\t\t\t\t<%s>%s/results/%s/%d%s_%s</%s>' % (name, server, testId, run, '_Cached' if view == 'repeatView' else '', suffix, name))
+                lines += ['\t\t\t\t</rawData>', '\t\t\t</%s>' % (view)]
+            lines.append('\t\t</run>')
+        lines += ['\t</data>', '</response>']
+        return '\n'.join(lines) + '\n'
+
+    def _write(self, path, contents):
+        fp = open(path, 'w')
+        fp.write(contents)
+        fp.close()
+
+# The files of one view's data directory
+def rawData(view):
+    (page, requests, headers, utilization, pageSpeed) = view
+    return {
+        'pageData': formatTable(pageColumns, [page], '\t'),
+        'requestsData': formatTable(requestColumns, requests, '\t'),
+        'headers': headers,
+        'utilization': utilization,
+        'PageSpeedData': pageSpeed
+    }
+
+# summary.csv and detail.csv of a result whose runs loaded the given
+# (firstView, repeatView) pairs
+def summaryCsv(views):
+    return formatTable(pageColumns + ['Run'], [view[0] + [run] for (run, view) in iterViews(views)])
+
+def detailCsv(views):
+    return formatTable(requestColumns + ['Run'], [request + [run] for (run, view) in iterViews(views) for request in view[1]])
+
+def iterViews(views):
+    for (run, (firstView, repeatView)) in enumerate(views, 1):
+        yield (run, firstView)
+        yield (run, repeatView)
+
+def formatTable(columns, rows, delimiter=','):
+    fp = StringIO()
+    writer = csv.writer(fp, delimiter=delimiter, lineterminator='\r\n', quoting=csv.QUOTE_MINIMAL)
+    writer.writerow(columns)
+    writer.writerows(rows)
+    return fp.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic archive of WPT results')
+    parser.add_argument('dir', metavar='DIRECTORY',
+        help='Directory to create the test directories in; it must not exist yet')
+    parser.add_argument('-t', '--tests', type=int, default=2,
+        help='Number of test directories')
+    parser.add_argument('-n', '--results', type=int, default=20,
+        help='Number of results in each test directory')
+    parser.add_argument('-r', '--runs', type=int, default=9,
+        help='Number of runs in each result')
+    parser.add_argument('-q', '--requests', type=int, default=60,
+        help='Number of requests in a first view')
+    parser.add_argument('--variants', type=int, default=16,
+        help='Number of distinct page loads to draw the views of each test directory from')
+    parser.add_argument('--seed', type=int, default=0,
+        help='Seed for the generated values')
+    cli = parser.parse_args()
+
+    if os.path.exists(cli.dir):
+        print('%s already exists' % (cli.dir))
+        sys.exit(1)
+    Generator(cli.tests, cli.results, cli.runs, cli.requests, cli.variants, cli.seed).generate(cli.dir)
+    print('Wrote %d results of %d runs to %s' % (cli.tests * cli.results, cli.runs, cli.dir))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# Runs tests end to end against a fake WebPageTest server (see fakewpt.py)
+# and measures how quickly pageload submits, polls and downloads them, in
+# tests per minute and bytes per second.  The server's delays, throttling and
+# error injection are set with the same options fakewpt.py takes.
+import os, sys, shutil, logging, tempfile, argparse, threading
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pageload.HttpClient import Factory as HttpClientFactory
+from pageload.Downloader import Factory as DownloaderFactory
+from pageload.PageLoadTest import Factory as PageLoadTestFactory
+from pageload.PageLoadTestResults import Factory as PageLoadTestResultsFactory
+from pageload.PageLoadTestDirectory import Factory as PageLoadTestDirectoryFactory
+from pageload.Scheduler import Factory as SchedulerFactory
+from pageload.Poller import PollPolicy
+from fakewpt import addServerArguments, createServer
+
+def directorySize(path):
+    return sum([os.path.getsize( os.path.join(root, name) ) for (root, dirs, files) in os.walk(path) for name in files])
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark running tests against a fake WebPageTest server')
+    parser.add_argument('-t', '--tests', type=int, default=20,
+        help='Number of tests to run')
+    parser.add_argument('--runs', type=int, default=3,
+        help='Number of runs in each test')
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+        help='Number of finished tests to download concurrently')
+    parser.add_argument('--download-jobs', type=int, default=8,
+        help='Number of files to download concurrently for each test')
+    parser.add_argument('--host-limit', type=int, default=4,
+        help='Maximum number of concurrent downloads from the server')
+    parser.add_argument('--poll-interval', type=float, default=0.5,
+        help='Seconds between status requests while the server gives no estimate')
+    parser.add_argument('--timeout', type=float, default=600,
+        help='Seconds to wait for a test to finish before giving up on it')
+    parser.add_argument('-d', '--results-dir',
+        help='Keep the results in this directory instead of a temporary one')
+    parser.add_argument('--min-tests-per-minute', type=float,
+        help='Fail if fewer tests than this finish per minute')
+    parser.add_argument('-L', '--logging', default='error',
+        help='Level of pageload\'s own logging')
+    addServerArguments(parser)
+    cli = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s')
+    logging.getLogger('pageload').setLevel(getattr(logging, cli.logging.upper(), logging.ERROR))
+
+    server = createServer(cli, ('localhost', 0))
+    serverThread = threading.Thread(target=server.serve_forever)
+    serverThread.daemon = True
+    serverThread.start()
+
+    baseDir = cli.results_dir or tempfile.mkdtemp()
+    try:
+        httpClient = HttpClientFactory().create()
+        downloader = DownloaderFactory().create(httpClient, cli.download_jobs, cli.host_limit)
+        testFactory = PageLoadTestFactory(httpClient, downloader)
+        directory = PageLoadTestDirectoryFactory( PageLoadTestResultsFactory() ).load( os.path.join(baseDir, 'throughput') )
+        wptserver = 'localhost:%d' % (server.server_address[1])
+        pageloads = [testFactory.create(directory, 'http://www.example%d.com/' % (test % 10), {'f': 'xml', 'k': 'KEY', 'runs': cli.runs, 'wptserver': wptserver})
+            for test in range(cli.tests)]
+        pollPolicy = PollPolicy(cli.poll_interval, max(cli.poll_interval, 60), cli.timeout, min(cli.poll_interval, 2))
+
+        start = timer()
+        results = SchedulerFactory().create(pageloads, cli.jobs, pollPolicy).run()
+        elapsed = timer() - start
+        httpClient.close()
+
+        received = sum([stats.bytes for stats in httpClient.getStats().values()])
+        requests = sum([stats.requests for stats in httpClient.getStats().values()])
+        connections = sum([stats.connections for stats in httpClient.getStats().values()])
+        failed = sum([len([download for download in pageload.downloads if download.error]) for pageload in pageloads])
+        # The shortest time the server could have taken to run every test
+        serverTime = cli.tests * cli.runs * cli.run_time / max(cli.agents, 1)
+
+        print('Finished %d of %d tests in %.1f s (the server needed at least %.1f s to run them)' % (len(results), cli.tests, elapsed, serverTime))
+        print('%.1f tests per minute' % (len(results) * 60 / elapsed))
+        print('%.0f KB/s received, %d KB in %d requests over %d connections' % (received / elapsed / 1024, received / 1024, requests, connections))
+        print('%d KB stored, %d files could not be downloaded' % (directorySize(directory.getDirectory()) / 1024, failed))
+        print('Server: %s' % (server.counters))
+    finally:
+        server.shutdown()
+        if not cli.results_dir:
+            shutil.rmtree(baseDir)
+
+    if cli.min_tests_per_minute is not None and len(results) * 60 / elapsed < cli.min_tests_per_minute:
+        print('Fewer than %.1f tests finished per minute' % (cli.min_tests_per_minute))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
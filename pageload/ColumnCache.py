@@ -0,0 +1,119 @@
+import os, sys, mmap, struct, marshal, logging
+from array import array
+from pageload.Compression import findData
+
+class Factory:
+    def create(self):
+        return ColumnCache()
+
+# Keeps a binary, column-oriented copy of a parsed table next to the file it
+# was parsed from (requestsData -> .requestsData.columns).  Integer and float
+# columns are stored as packed arrays, anything else as a marshalled list.
+# The copy records the size and modification time of its source and is
+# ignored as soon as either changes.  If the source is stored compressed, it
+# is the compressed file's that are recorded.
+#
+# Layout: a fixed header (magic, version, source mtime, source size, length
+# of the column directory), the marshalled column directory, then the column
+# data at the offsets the directory gives.
+class ColumnCache:
+    magic = 'PLCC'
+    version = 1
+    header = struct.Struct('<4sHdqI')
+
+    def __init__(self):
+        self.logger = logging.getLogger('pageload')
+
+    def getPath(self, sourcePath):
+        (directory, name) = os.path.split(sourcePath)
+        return os.path.join(directory, '.%s.columns' % (name))
+
+    def load(self, sourcePath):
+        try:
+            stat = os.stat( findData(sourcePath) or sourcePath )
+            fp = open(self.getPath(sourcePath), 'rb')
+        except (OSError, IOError):
+            return None
+
+        try:
+            buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError):
+            fp.close()
+            return None
+
+        try:
+            (magic, version, mtime, size, directoryLength) = self.header.unpack_from(buf, 0)
+            if magic != self.magic or version != self.version or mtime != stat.st_mtime or size != stat.st_size:
+                return None
+
+            start = self.header.size
+            (byteorder, itemsizes, names, rowCount, directory) = marshal.loads(buf[start:start + directoryLength])
+            if byteorder != sys.byteorder or itemsizes != self._itemsizes():
+                return None
+
+            start += directoryLength
+            columns = []
+            for (typecode, offset, length) in directory:
+                data = buf[start + offset:start + offset + length]
+                if typecode == 'o':
+                    columns.append( marshal.loads(data) )
+                else:
+                    values = array(typecode)
+                    values.fromstring(data)
+                    columns.append( values.tolist() )
+        except (struct.error, ValueError, EOFError, TypeError):
+            self.logger.debug('Ignoring corrupt column cache for %s' % (sourcePath))
+            return None
+        finally:
+            buf.close()
+            fp.close()
+
+        if not len(columns):
+            return (names, [])
+        return (names, zip(*columns))
+
+    def store(self, sourcePath, names, rows):
+        width = len(names)
+        # Only rectangular tables can be stored by column
+        if not width or [row for row in rows if len(row) != width]:
+            return False
+
+        columns = zip(*rows) if len(rows) else [()] * width
+        directory = []
+        blobs = []
+        offset = 0
+        for column in columns:
+            typecode = self._typecode(column)
+            if typecode == 'o':
+                blob = marshal.dumps(list(column))
+            else:
+                blob = array(typecode, column).tostring()
+            directory.append( (typecode, offset, len(blob)) )
+            blobs.append(blob)
+            offset += len(blob)
+
+        header = marshal.dumps( (sys.byteorder, self._itemsizes(), list(names), len(rows), directory) )
+        path = self.getPath(sourcePath)
+        try:
+            stat = os.stat( findData(sourcePath) or sourcePath )
+            fp = open(path + '.tmp', 'wb')
+            fp.write( self.header.pack(self.magic, self.version, stat.st_mtime, stat.st_size, len(header)) )
+            fp.write( header )
+            for blob in blobs:
+                fp.write( blob )
+            fp.close()
+            os.rename(path + '.tmp', path)
+        except (OSError, IOError) as error:
+            self.logger.debug('Could not write column cache %s: %s' % (path, error))
+            return False
+        return True
+
+    def _typecode(self, column):
+        if len(column) and all([type(value) is int for value in column]):
+            return 'l'
+        if len(column) and all([type(value) is float for value in column]):
+            return 'd'
+        return 'o'
+
+    def _itemsizes(self):
+        return (array('l').itemsize, array('d').itemsize)
@@ -0,0 +1,221 @@
+import os, zlib, errno
+
+# A run's raw data files (headers, pageData, requestsData, utilization and
+# PageSpeedData) and a result's summary.csv and detail.csv can be stored
+# compressed, under their usual name plus the suffix of the compression
+# (requestsData -> requestsData.gz).  Readers ask openData() for the file by
+# its usual name and get the uncompressed contents, whichever copy is there.
+#
+# gzip only needs zlib.  lzma is optional: it is part of Python 3, comes from
+# backports.lzma on Python 2 (pip install pageload[lzma]) and is imported the
+# first time it is needed.
+compressions = ['gzip', 'lzma']
+suffixes = {'gzip': '.gz', 'lzma': '.xz'}
+chunkSize = 64 * 1024
+
+# Files below a result directory that may be stored compressed
+resultFiles = ['summary.csv', 'detail.csv']
+viewFiles = ['headers', 'pageData', 'requestsData', 'utilization', 'PageSpeedData']
+views = ['firstView', 'repeatView']
+
+lzma = None
+lzmaLoaded = False
+
+def loadLzma():
+    global lzma, lzmaLoaded
+    if not lzmaLoaded:
+        try:
+            import lzma
+        except ImportError:
+            try:
+                from backports import lzma
+            except ImportError:
+                lzma = None
+        lzmaLoaded = True
+    return lzma
+
+def isAvailable(compression):
+    return compression != 'lzma' or loadLzma() is not None
+
+def getSuffix(compression):
+    return suffixes[compression] if compression else ''
+
+def getCompression(path):
+    for (compression, suffix) in suffixes.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+# The copy of a data file that exists, uncompressed first, or None
+def findData(path):
+    for suffix in [''] + [suffixes[compression] for compression in compressions]:
+        if os.path.isfile(path + suffix):
+            return path + suffix
+    return None
+
+def dataExists(path):
+    return findData(path) is not None
+
+# Opens whichever copy of a data file exists for reading.  Compressed copies
+# are decompressed as they are read.
+def openData(path):
+    found = findData(path)
+    if found is None:
+        raise IOError(errno.ENOENT, 'No such file or directory', path)
+    return openFile(found)
+
+def openFile(path):
+    compression = getCompression(path)
+    fp = open(path, 'rb')
+    if compression is None:
+        return fp
+    try:
+        return DecompressedFile(fp, compression)
+    except:
+        fp.close()
+        raise
+
+# Wraps fp, opened for writing, so that what is written to it is compressed.
+# With no compression fp is returned as it is.
+def compressedWriter(fp, compression, level=None):
+    if compression is None:
+        return fp
+    return CompressedFile(fp, compression, level)
+
+def _lzmaModule():
+    if loadLzma() is None:
+        raise IOError('lzma compression needs Python 3 or the backports.lzma module')
+    return lzma
+
+def _createCompressor(compression, level):
+    if compression == 'gzip':
+        return zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if compression == 'lzma':
+        module = _lzmaModule()
+        return module.LZMACompressor(preset=level) if level is not None else module.LZMACompressor()
+    raise ValueError('Unknown compression %s' % (compression))
+
+def _createDecompressor(compression):
+    if compression == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compression == 'lzma':
+        return _lzmaModule().LZMADecompressor()
+    raise ValueError('Unknown compression %s' % (compression))
+
+class CompressedFile:
+    def __init__(self, fp, compression, level=None):
+        self.fp = fp
+        self.compressor = _createCompressor(compression, level)
+    def write(self, data):
+        self.fp.write( self.compressor.compress(data) )
+    def close(self):
+        self.fp.write( self.compressor.flush() )
+        self.fp.close()
+
+# Reads a compressed file a chunk at a time.  Supports read() and iterating
+# over lines, which is all the parsers need.  Files made of several
+# concatenated streams (as from cat a.gz b.gz) are read as one.
+class DecompressedFile:
+    def __init__(self, fp, compression):
+        self.fp = fp
+        self.compression = compression
+        self.decompressor = _createDecompressor(compression)
+        self.buffer = b''
+
+    # Adds the next chunk of the file to the buffer.  False at the end.
+    def _more(self):
+        if self.decompressor is None:
+            return False
+        data = self.fp.read(chunkSize)
+        if not data:
+            if hasattr(self.decompressor, 'flush'):
+                self.buffer += self.decompressor.flush()
+            self.decompressor = None
+            return False
+        output = []
+        while data:
+            output.append( self.decompressor.decompress(data) )
+            data = self.decompressor.unused_data
+            if data:
+                self.decompressor = _createDecompressor(self.compression)
+        self.buffer += b''.join(output)
+        return True
+
+    def read(self, size=-1):
+        while (size < 0 or len(self.buffer) < size) and self._more():
+            pass
+        if size < 0:
+            size = len(self.buffer)
+        (data, self.buffer) = (self.buffer[:size], self.buffer[size:])
+        return data
+
+    def __iter__(self):
+        while True:
+            more = self._more()
+            lines = self.buffer.split(b'\n')
+            self.buffer = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+            if not more:
+                break
+        if self.buffer:
+            (line, self.buffer) = (self.buffer, b'')
+            yield line
+
+    def close(self):
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+# Every data file of a result, by its usual name, whether or not it exists
+def iterDataPaths(testDir):
+    for name in resultFiles:
+        yield os.path.join(testDir, name)
+    runDir = os.path.join(testDir, 'run')
+    for run in sorted([name for name in os.listdir(runDir) if name.isdigit()], key=int):
+        for view in views:
+            for name in viewFiles:
+                yield os.path.join(runDir, run, view, 'data', name)
+
+# Stores the data file at path with the given compression (None for
+# uncompressed) in place of the copy there now.  The new copy is written
+# under a temporary name and only then replaces the old one.  Returns the
+# sizes of the old and new copies.
+def convert(path, compression, level=None):
+    found = findData(path)
+    if found is None:
+        raise IOError(errno.ENOENT, 'No such file or directory', path)
+    target = path + getSuffix(compression)
+    before = os.path.getsize(found)
+    if found == target:
+        return (before, before)
+
+    source = openFile(found)
+    try:
+        writer = compressedWriter(open(target + '.tmp', 'wb'), compression, level)
+        try:
+            while True:
+                chunk = source.read(chunkSize)
+                if not chunk:
+                    break
+                writer.write(chunk)
+        finally:
+            writer.close()
+    except:
+        if os.path.isfile(target + '.tmp'):
+            os.remove(target + '.tmp')
+        raise
+    finally:
+        source.close()
+
+    os.rename(target + '.tmp', target)
+    # Stale copies left by an interrupted conversion go too
+    for copy in [path + getSuffix(other) for other in [None] + compressions]:
+        if copy != target and os.path.isfile(copy):
+            os.remove(copy)
+    return (before, os.path.getsize(target))
@@ -0,0 +1,106 @@
+import httplib, logging, threading, os
+from time import time, sleep
+from urlparse import urlparse
+from multiprocessing.pool import ThreadPool
+from pageload.HttpClient import Factory as HttpClientFactory, HttpError
+from pageload.Compression import getSuffix, compressedWriter
+from pageload import Trace
+
+class Factory:
+    def create(self, httpClient=None, workers=8, hostLimit=4, retries=3):
+        if httpClient is None:
+            httpClient = HttpClientFactory().create()
+        return Downloader(httpClient, workers, hostLimit, retries)
+
+# With a compression the file is stored compressed, as localPath plus the
+# compression's suffix
+class Download:
+    def __init__(self, url, localPath, compression=None):
+        self.__dict__.update(locals())
+        self.size = 0
+        self.elapsed = 0.0
+        self.attempts = 0
+        self.error = None
+    def succeeded(self):
+        return self.error is None and self.attempts > 0
+
+# Downloads files on a bounded pool of threads.  Each host gets its own
+# semaphore so that no more than hostLimit requests hit it at once, no matter
+# how many tests are downloading at the same time.
+class Downloader:
+    transientCodes = [408, 429, 500, 502, 503, 504]
+
+    def __init__(self, httpClient, workers=8, hostLimit=4, retries=3, backoff=1.0):
+        self.__dict__.update(locals())
+        self.logger = logging.getLogger('pageload')
+        self._lock = threading.Lock()
+        self._hostSemaphores = {}
+
+    def downloadAll(self, downloads):
+        if not len(downloads):
+            return downloads
+
+        start = time()
+        pool = ThreadPool(max(1, min(self.workers, len(downloads))))
+        try:
+            pool.map(self._download, downloads)
+        finally:
+            pool.close()
+            pool.join()
+
+        failed = [download for download in downloads if not download.succeeded()]
+        self.logger.info('Downloaded %d files (%d bytes) in %.2fs, %d failed' % (
+            len(downloads) - len(failed),
+            sum([download.size for download in downloads]),
+            time() - start,
+            len(failed)))
+        return downloads
+
+    def _hostSemaphore(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._hostSemaphores:
+                self._hostSemaphores[host] = threading.BoundedSemaphore(self.hostLimit)
+            return self._hostSemaphores[host]
+
+    def _download(self, download):
+        semaphore = self._hostSemaphore(download.url)
+        for attempt in range(1, self.retries + 1):
+            download.attempts = attempt
+            start = time()
+            try:
+                with semaphore:
+                    with Trace.span('download', 'http', {'url': download.url, 'attempt': attempt}) as args:
+                        download.size = self._fetch(download.url, download.localPath + getSuffix(download.compression), download.compression)
+                        args['bytes'] = download.size
+                download.elapsed = time() - start
+                download.error = None
+                self.logger.info('Downloaded %s (%d bytes in %.3fs)' % (download.url, download.size, download.elapsed))
+                return download
+            except HttpError as error:
+                download.error = error
+                if error.status not in self.transientCodes:
+                    break
+            except (IOError, httplib.HTTPException) as error:
+                download.error = error
+
+            if attempt < self.retries:
+                self.logger.warning('Retrying %s (attempt %d of %d): %s' % (download.url, attempt, self.retries, download.error))
+                sleep(self.backoff * (2 ** (attempt - 1)))
+
+        self.logger.error('Could not download %s: %s' % (download.url, download.error))
+        return download
+
+    # Written under a temporary name first, so a file that exists is complete
+    def _fetch(self, url, localPath, compression=None):
+        partPath = localPath + '.part'
+        fp = compressedWriter(open(partPath, 'wb'), compression)
+        try:
+            size = self.httpClient.download(url, fp)
+        except:
+            fp.close()
+            os.remove(partPath)
+            raise
+        fp.close()
+        os.rename(partPath, localPath)
+        return size
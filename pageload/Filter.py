@@ -1,18 +1,27 @@
 import os, json
 from itertools import izip
-from functools import reduce
+from pageload import Statistics
 from pageload.Colors import AnsiColors
+from pageload.FilterCache import CachedFilter
+from pageload.Trace import traced
 
 class CountFilter:
+    @traced('filter')
     def filter( self, testResult, runList ):
         rVal = list()
         for runIndex in runList:
-            requests = self.getRequests(testResult, runIndex - 1)
+            requests = self.getRequests(testResult, runIndex)
             rVal.append( FilterResultsDict(testResult, runIndex, self.getValues(requests)) )
         return rVal
 
     def getValues(self, requests):
-        values = {
+        values = self.newValues()
+        for index, request in enumerate(requests):
+            self.addRequest(values, index, request)
+        return values
+
+    def newValues(self):
+        return {
             'time_to_load': 0,
             'time_to_first_byte': 0,
             'ttl_minus_ttfb': 0,
@@ -23,36 +32,25 @@ class CountFilter:
             'css_size': 0,
             'image_size': 0
         }
-        for index, request in enumerate(requests):
-            if index == 0:
-                values['time_to_load'] = int(request['Time to Load (ms)'])
-                values['time_to_first_byte'] = int(request['Time to First Byte (ms)'])
-                values['ttl_minus_ttfb'] = values['time_to_load'] - values['time_to_first_byte']
-            if 'javascript' in request['Content Type']:
-                values['js_files'] += 1
-                values['js_size'] += int(request['Object Size'])
-            if 'css' in request['Content Type']:
-                values['css_files'] += 1
-                values['css_size'] += int(request['Object Size'])
-            if 'image/' in request['Content Type']:
-                values['image_files'] += 1
-                values['image_size'] += int(request['Object Size'])
-        return values
 
-    def _average(self, values):
-        def _sum(x, y):
-            r = dict()
-            for key in self.strings.keys():
-                r[key] = x[key] + y[key]
-            return r
-        reduced = reduce(_sum, values)
-        for k, v in reduced.items():
-            reduced[k] = int(v) / len(values)
-        return reduced
+    def addRequest(self, values, index, request):
+        if index == 0:
+            values['time_to_load'] = request['Time to Load (ms)']
+            values['time_to_first_byte'] = request['Time to First Byte (ms)']
+            values['ttl_minus_ttfb'] = values['time_to_load'] - values['time_to_first_byte']
+        if 'javascript' in request['Content Type']:
+            values['js_files'] += 1
+            values['js_size'] += request['Object Size']
+        if 'css' in request['Content Type']:
+            values['css_files'] += 1
+            values['css_size'] += request['Object Size']
+        if 'image/' in request['Content Type']:
+            values['image_files'] += 1
+            values['image_size'] += request['Object Size']
 
 class ViewCountFilter(CountFilter):
-    def getRequests(self, testResult, runIndex):
-        run = testResult.getRuns()[runIndex]
+    def getRequests(self, testResult, runId):
+        run = testResult.getRun(runId)
         return self.getView(run).getRequestData()
 
 class FirstViewCountFilter(ViewCountFilter):
@@ -63,35 +61,60 @@ class RepeatViewCountFilter(ViewCountFilter):
     def getView(self, run):
         return run.getRepeatView()
 
+# Counts from the test's detail.csv, which holds the requests of every run and
+# view.  The file is streamed, so only the running totals are kept in memory.
+class DetailCountFilter(CountFilter):
+    @traced('filter')
+    def filter(self, testResult, runList):
+        totals = dict()
+        for request in testResult.iterRequestDetails():
+            run = request['Run']
+            if request['Cached'] != self.cached or run not in runList:
+                continue
+            if run not in totals:
+                totals[run] = [self.newValues(), 0]
+            self.addRequest(totals[run][0], totals[run][1], request)
+            totals[run][1] += 1
+        return [FilterResultsDict(testResult, run, totals[run][0]) for run in runList if run in totals]
+
+class FirstViewDetailCountFilter(DetailCountFilter):
+    cached = 0
+
+class RepeatViewDetailCountFilter(DetailCountFilter):
+    cached = 1
+
 class UrlTimeToLoadFilter():
+    @traced('filter')
     def filter(self, testResult, runList):
         rVal = list()
         for runIndex in runList:
-            run = testResult.getRuns()[runIndex - 1]
+            run = testResult.getRun(runIndex)
             requests = run.getFirstView().getRequestData()
             filtered = list()
             for request in requests:
-                filtered.append( '%s\t%s' % (request['Time to Load (ms)'] + ' ms', request['Host'] + request['URL']) )
+                filtered.append( '%s ms\t%s%s' % (request['Time to Load (ms)'], request['Host'], request['URL']) )
             rVal.append(FilterResultsList(testResult, runIndex, filtered))
         return rVal
 
 class UrlTimeToFirstByteFilter():
+    @traced('filter')
     def filter(self, testResult, runList):
         rVal = list()
         for runIndex in runList:
-            run = testResult.getRuns()[runIndex - 1]
+            run = testResult.getRun(runIndex)
             requests = run.getFirstView().getRequestData()
             filtered = list()
             for request in requests:
-                filtered.append( '%s\t%s' % (request['Time to First Byte (ms)'] + ' ms', request['Host'] + request['URL']) )
+                filtered.append( '%s ms\t%s%s' % (request['Time to First Byte (ms)'], request['Host'], request['URL']) )
             rVal.append(FilterResultsList(testResult, runIndex, filtered))
         return rVal
 
 class StartAndEndTimeFilter():
+    @traced('filter')
     def filter(self, testResult, runList):
         rVal = list()
         for runIndex in runList:
-            run = testResult.getRuns()[runIndex - 1]
+            run = testResult.getRun(runIndex)
             requests = run.getFirstView().getRequestData()
             filtered = list()
             for request in requests:
@@ -99,15 +122,43 @@ class StartAndEndTimeFilter():
             rVal.append( FilterResultsList(testResult, runIndex, filtered) )
         return rVal
 
+# Results are displayed line by line through iterLines, so that writers can
+# stream them instead of building the whole text first
+def resultHeading(result, styler):
+    yield '[%s] run %d (%s)' % (styler.color(result.testResult.getSignature(), 'yellow'), result.run, result.testResult.getDateTime().strftime('%Y/%m/%d %H:%M:%S'))
+    yield 'Run directory: %s' % (styler.color(os.path.join(result.testResult.testDir, 'run/' + str(result.run)), 'red'))
+
 class FilterResultsList:
     def __init__(self, testResult, run, filteredList):
         self.__dict__.update(locals())
     def __str__(self):
-        styler = AnsiColors()
-        rVal = '[%s] run %d (%s)\n' % (styler.color(self.testResult.getSignature(), 'yellow'), self.run, self.testResult.getDateTime().strftime('%Y/%m/%d %H:%M:%S'))
-        rVal += 'Run directory: %s\n' % (styler.color(os.path.join(self.testResult.testDir, 'run/' + str(self.run)), 'red'))
-        rVal += '\n'.join([str(x) for x in self.filteredList])
-        return rVal
+        return '\n'.join(self.iterLines())
+
+    def iterLines(self):
+        for line in resultHeading(self, AnsiColors()):
+            yield line
+        for x in self.filteredList:
+            yield str(x)
+        if not len(self.filteredList):
+            yield ''
+
+    def asJson(self):
+        return json.dumps(self.filteredList)
+
+    def asRecord(self):
+        return {
+            'signature': self.testResult.getSignature(),
+            'run': self.run,
+            'date': self.testResult.getDateTime().strftime('%Y-%m-%dT%H:%M:%S'),
+            'values': self.filteredList
+        }
+
+    def asRows(self):
+        for x in self.filteredList:
+            yield list(x) if isinstance(x, tuple) else [x]
+
+    def getValue(self):
+        return self.filteredList
 
 class FilterResultsDict:
     strings = {
@@ -125,31 +176,50 @@ class FilterResultsDict:
     def __init__(self, testResult, run, dictionary):
         self.__dict__.update(locals())
     def __str__(self):
-        styler = AnsiColors()
-        rVal = '[%s] run %d (%s)\n' % (styler.color(self.testResult.getSignature(), 'yellow'), self.run, self.testResult.getDateTime().strftime('%Y/%m/%d %H:%M:%S'))
-        rVal += 'Run directory: %s\n' % (styler.color(os.path.join(self.testResult.testDir, 'run/' + str(self.run)), 'red'))
+        return '\n'.join(self.iterLines())
+
+    def iterLines(self):
+        for line in resultHeading(self, AnsiColors()):
+            yield line
         for k, v in self.dictionary.items():
-            rVal += '  %s: %s\n' % (self.strings[k], v)
-        return rVal
+            yield '  %s: %s' % (self.strings[k], v)
+        yield ''
 
     def asJson(self):
         return json.dumps(self.dictionary)
 
+    def asRecord(self):
+        return {
+            'signature': self.testResult.getSignature(),
+            'run': self.run,
+            'date': self.testResult.getDateTime().strftime('%Y-%m-%dT%H:%M:%S'),
+            'values': self.dictionary
+        }
+
+    def asRows(self, columns):
+        yield [self.dictionary.get(column) for column in columns]
+
+    def getValue(self):
+        return self.dictionary
+
 
 class FilterResultsDictComparator:
     def __init__(self, filteredResultsDicts):
         self.__dict__.update(locals())
     def __str__(self):
+        return '\n'.join(self.iterLines())
+
+    def iterLines(self):
         styler = AnsiColors()
         columnWidth = 15
         keys = self.filteredResultsDicts[0].dictionary.keys()
         longestKey = max(map(lambda x: len(x), keys))
         testHashes = list(map(lambda x: '%s:%d' % (x.testResult.getSignature()[:8], x.run), self.filteredResultsDicts))
-        rVal = '%s  %s\n' % (''.ljust(longestKey), styler.color(''.join([x.ljust(columnWidth) for x in testHashes]), 'yellow') )
+        yield '%s  %s' % (''.ljust(longestKey), styler.color(''.join([x.ljust(columnWidth) for x in testHashes]), 'yellow') )
         for key in keys:
             values = list(map(lambda x: x.dictionary[key], self.filteredResultsDicts))
-            rVal += '%s  %s\n' % (key.ljust(longestKey), ''.join([str(x).ljust(columnWidth) for x in values]))
-        return rVal
+            yield '%s  %s' % (key.ljust(longestKey), ''.join([str(x).ljust(columnWidth) for x in values]))
+        yield ''
 
 class FilterResultsDictCombinor:
     def __init__(self, filteredResultsDicts, method):
@@ -165,60 +235,74 @@ class FilterResultsDictCombinor:
             testRunMap[hash].append(run)
         return ' '.join(['%s:%s' % (hash, ','.join([str(x) for x in runs])) for hash, runs in testRunMap.items()])
 
+    # Every metric is combined in a single pass over a runs x metrics table
     def _compute(self):
-        self.combined = dict()
-        func = self._median if self.method == 'median' else self._mean
-        for key in self.filteredResultsDicts[0].dictionary.keys():
-            values = list(map(lambda x: x.dictionary[key], self.filteredResultsDicts))
-            combined = func(values)
-            self.combined[key] = combined
-
-    def _median(self, numericValues):
-      theValues = sorted(numericValues)
-      if len(theValues) % 2 == 1:
-        return theValues[(len(theValues)+1)/2-1]
-      else:
-        lower = theValues[len(theValues)/2-1]
-        upper = theValues[len(theValues)/2]
-        return (float(lower + upper)) / 2
-            
-    def _mean(self, numericValues):
-        summed = reduce(lambda x, y: x + y, numericValues)
-        mean = summed / len(numericValues)
-        return mean
+        keys = list(self.filteredResultsDicts[0].dictionary.keys())
+        rows = [[x.dictionary[key] for key in keys] for x in self.filteredResultsDicts]
+        self.combined = dict(zip(keys, Statistics.combine(self.method, rows)))
 
     def __str__(self):
+        return '\n'.join(self.iterLines())
+
+    def iterLines(self):
         styler = AnsiColors()
         keys = self.filteredResultsDicts[0].dictionary.keys()
         longestKey = max(map(lambda x: len(x), keys))
-        rVal = '%s using the %s (%d runs)\n' % (styler.color('Combined results', 'green'), self.method, len(self.filteredResultsDicts))
+        yield '%s using the %s (%d runs)' % (styler.color('Combined results', 'green'), self.method, len(self.filteredResultsDicts))
         for k, v in self.combined.items():
-            rVal += '%s  %s\n' % (k.ljust(longestKey), v)
-        return rVal
+            yield '%s  %s' % (k.ljust(longestKey), v)
+        yield ''
 
+# With a significance test, each metric also gets a bootstrap confidence
+# interval for the difference and a p-value, and only differences that are
+# significant at that confidence are colored
 class FilterResultsDictCombinorDiff:
-    def __init__(self, filterResultsDictCombinorLeft, filterResultsDictCombinorRight):
+    def __init__(self, filterResultsDictCombinorLeft, filterResultsDictCombinorRight, significance=None, confidence=0.95):
         self.__dict__.update(locals())
         self.filteredResultsDicts = [filterResultsDictCombinorLeft, filterResultsDictCombinorRight]
+        self.intervals = None
+        if significance:
+            self._computeSignificance()
 
-    def diff2str(self, diff, styler):
-      if diff < 0:
-        return styler.color(str(diff), 'red')
-      else:
-        return styler.color('+' + str(diff), 'green')
+    def _computeSignificance(self):
+        keys = list(self.filterResultsDictCombinorLeft.combined.keys())
+        (left, right) = [[[x.dictionary[key] for key in keys] for x in combinor.filteredResultsDicts] for combinor in self.filteredResultsDicts]
+        intervals = Statistics.bootstrap(self.filterResultsDictCombinorLeft.method, left, right, self.confidence)
+        if self.significance == 'mannwhitney':
+            intervals = [(lower, upper, p) for ((lower, upper, unused), p) in zip(intervals, Statistics.mannWhitney(left, right))]
+        self.intervals = dict(zip(keys, intervals))
+
+    def isSignificant(self, key):
+        return self.intervals is None or self.intervals[key][2] < 1 - self.confidence
+
+    def diff2str(self, diff, styler, significant=True, width=0):
+      string = (str(diff) if diff < 0 else '+' + str(diff)).ljust(width)
+      if not significant:
+        return string
+      return styler.color(string, 'red' if diff < 0 else 'green')
 
     def __str__(self):
+        return '\n'.join(self.iterLines())
+
+    def iterLines(self):
         styler = AnsiColors()
         columnWidth = 30
         keys = self.filteredResultsDicts[0].combined.keys()
         longestKey = max(map(lambda x: len(x), keys))
         testHashes = list(map(lambda x: x.getTestRunSignatures(), self.filteredResultsDicts))
-        rVal = '%s  %s%s\n' % (''.ljust(longestKey), styler.color(''.join([x.ljust(columnWidth) for x in testHashes]), 'yellow'), styler.color('diff'.ljust(columnWidth), 'yellow') )
+        headings = ''.join([x.ljust(columnWidth) for x in testHashes]) + 'diff'.ljust(columnWidth)
+        if self.intervals is not None:
+            headings += ('%d%% CI' % (round(self.confidence * 100))).ljust(columnWidth) + 'p (%s)' % (self.significance)
+        yield '%s  %s' % (''.ljust(longestKey), styler.color(headings, 'yellow'))
         for key in keys:
             values = list(map(lambda x: x.combined[key], self.filteredResultsDicts))
             diff = self.filterResultsDictCombinorRight.combined[key] - self.filterResultsDictCombinorLeft.combined[key]
-            rVal += '%s  %s%s\n' % (key.ljust(longestKey), ''.join([str(x).ljust(columnWidth) for x in values]), self.diff2str(diff, styler).ljust(columnWidth))
-        return rVal
+            line = '%s  %s%s' % (key.ljust(longestKey), ''.join([str(x).ljust(columnWidth) for x in values]), self.diff2str(diff, styler, self.isSignificant(key), columnWidth))
+            if self.intervals is not None:
+                (lower, upper, p) = self.intervals[key]
+                line += ('[%.1f, %.1f]' % (lower, upper)).ljust(columnWidth) + '%.3f' % (p)
+            yield line
+        yield ''
 
 class FilterResultsDictComparatorDiff:
     def __init__(self, filteredTestResultLeft, filteredTestResultRight):
@@ -230,46 +314,86 @@ class FilterResultsDictComparatorDiff:
       else:
         return styler.color('+' + str(diff), 'green')
     def __str__(self):
+        return '\n'.join(self.iterLines())
+
+    def iterLines(self):
         styler = AnsiColors()
         columnWidth = 15
         keys = self.filteredResultsDicts[0].dictionary.keys()
         longestKey = max(map(lambda x: len(x), keys))
         testHashes = list(map(lambda x: '%s:%d' % (x.testResult.getSignature()[:8], x.run), self.filteredResultsDicts))
-        rVal = '%s  %s%s\n' % (''.ljust(longestKey), styler.color(''.join([x.ljust(columnWidth) for x in testHashes]), 'yellow'), styler.color('diff'.ljust(columnWidth), 'yellow') )
+        yield '%s  %s%s' % (''.ljust(longestKey), styler.color(''.join([x.ljust(columnWidth) for x in testHashes]), 'yellow'), styler.color('diff'.ljust(columnWidth), 'yellow') )
         for key in keys:
             values = list(map(lambda x: x.dictionary[key], self.filteredResultsDicts))
             diff = self.filteredTestResultRight.dictionary[key] - self.filteredTestResultLeft.dictionary[key]
-            rVal += '%s  %s%s\n' % (key.ljust(longestKey), ''.join([str(x).ljust(columnWidth) for x in values]), self.diff2str(diff, styler).ljust(columnWidth))
-        return rVal
+            yield '%s  %s%s' % (key.ljust(longestKey), ''.join([str(x).ljust(columnWidth) for x in values]), self.diff2str(diff, styler).ljust(columnWidth))
+        yield ''
 
 class Factory:
     filterMap = {
         'fv_count': {
             'class': FirstViewCountFilter,
             'type': 'aggregate',
+            'result': FilterResultsDict,
+            'view': 'firstView',
+            'version': 1,
             'description': "Time to load, # of assets and their sizes (first view)"
         },
         'rv_count': {
             'class': RepeatViewCountFilter,
             'type': 'aggregate',
+            'result': FilterResultsDict,
+            'view': 'repeatView',
+            'version': 1,
             'description': "Time to load, # of assets and their sizes (repeat view)"
         },
+        'fv_detail_count': {
+            'class': FirstViewDetailCountFilter,
+            'type': 'aggregate',
+            'result': FilterResultsDict,
+            'view': 'firstView',
+            'version': 1,
+            'description': "Time to load, # of assets and their sizes, streamed from detail.csv (first view)"
+        },
+        'rv_detail_count': {
+            'class': RepeatViewDetailCountFilter,
+            'type': 'aggregate',
+            'result': FilterResultsDict,
+            'view': 'repeatView',
+            'version': 1,
+            'description': "Time to load, # of assets and their sizes, streamed from detail.csv (repeat view)"
+        },
         'fv_url_and_ttl': {
             'class': UrlTimeToLoadFilter,
             'type': 'normal',
+            'result': FilterResultsList,
+            'view': 'firstView',
+            'version': 1,
             'description': "Time to load for each resource (first view)"
         },
         'fv_url_and_ttfb': {
             'class': UrlTimeToFirstByteFilter,
             'type': 'normal',
+            'result': FilterResultsList,
+            'view': 'firstView',
+            'version': 1,
             'description': "Time to first byte for each resource (first view)"
         },
         'fv_start_end_time': {
             'class': StartAndEndTimeFilter,
             'type': 'normal',
+            'columns': ['url', 'start_time', 'end_time'],
+            'result': FilterResultsList,
+            'view': 'firstView',
+            'version': 1,
             'description': "Start time and end time for each resource (first view)"
         }
     }
 
-    def create(self, name):
-        return self.filterMap[name]['class']()
+    # Bump a filter's version whenever its output changes, so that outputs
+    # cached by earlier versions are no longer used
+    def create(self, name, cache=None):
+        filter = self.filterMap[name]['class']()
+        if cache is None:
+            return filter
+        return CachedFilter(filter, name, self.filterMap[name], cache)
@@ -0,0 +1,132 @@
+import os, time, marshal, sqlite3, logging
+from pageload.Trace import traced
+
+class Factory:
+    # None if the cache can't be opened, as in a read-only directory
+    def create(self, testsDir, maxSize=64 * 1024 * 1024):
+        path = os.path.join(testsDir, '.pageload', 'filters.db')
+        try:
+            return FilterCache(path, maxSize)
+        except sqlite3.Error as error:
+            logging.getLogger('pageload').debug('Could not open filter cache %s: %s' % (path, error))
+            return None
+
+# Filter outputs for one test directory, stored in a SQLite database under
+# .pageload.  Entries are keyed by (signature, run, view, filter, version) and
+# hold the marshalled output for a single run.  Every hit refreshes an entry's
+# last use; when the stored outputs grow past maxSize bytes the least recently
+# used entries are dropped.
+class FilterCache:
+    schema = [
+        'CREATE TABLE IF NOT EXISTS outputs (signature TEXT, run INTEGER, view TEXT, filter TEXT, version INTEGER, data BLOB, size INTEGER, used REAL, PRIMARY KEY (signature, run, view, filter, version))',
+        'CREATE INDEX IF NOT EXISTS outputs_used ON outputs (used)',
+        'CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)'
+    ]
+
+    def __init__(self, path, maxSize):
+        self.__dict__.update(locals())
+        self.logger = logging.getLogger('pageload')
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.connection = sqlite3.connect(path)
+        try:
+            self.connection.text_factory = str
+            for statement in self.schema:
+                self.connection.execute(statement)
+            self.connection.commit()
+        except:
+            self.connection.close()
+            raise
+
+    def get(self, signature, run, view, name, version):
+        row = self.connection.execute(
+            'SELECT data FROM outputs WHERE signature = ? AND run = ? AND view = ? AND filter = ? AND version = ?',
+            (signature, run, view, name, version)).fetchone()
+        if row is None:
+            self.misses += 1
+            return (False, None)
+        self.hits += 1
+        self.connection.execute(
+            'UPDATE outputs SET used = ? WHERE signature = ? AND run = ? AND view = ? AND filter = ? AND version = ?',
+            (time.time(), signature, run, view, name, version))
+        return (True, marshal.loads(bytes(row[0])))
+
+    def put(self, signature, run, view, name, version, value):
+        try:
+            data = marshal.dumps(value)
+        except ValueError as error:
+            self.logger.debug('Not caching output of %s for %s:%d: %s' % (name, signature[:8], run, error))
+            return False
+        self.connection.execute(
+            'INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (signature, run, view, name, version, sqlite3.Binary(data), len(data), time.time()))
+        self._evict()
+        return True
+
+    def getStats(self):
+        stats = dict(self.connection.execute('SELECT name, value FROM stats').fetchall())
+        (entries, size) = self.connection.execute('SELECT COUNT(*), SUM(size) FROM outputs').fetchone()
+        stats['entries'] = entries
+        stats['size'] = size if size else 0
+        for name in ['hits', 'misses', 'evictions']:
+            stats.setdefault(name, 0)
+        return stats
+
+    def clear(self):
+        self.connection.execute('DELETE FROM outputs')
+        self.connection.execute('DELETE FROM stats')
+        self.connection.commit()
+        self.connection.execute('VACUUM')
+
+    # Adds this session's counters to the stored totals and commits
+    def close(self):
+        for name in ['hits', 'misses', 'evictions']:
+            self.connection.execute('INSERT OR IGNORE INTO stats VALUES (?, 0)', (name,))
+            self.connection.execute('UPDATE stats SET value = value + ? WHERE name = ?', (getattr(self, name), name))
+        self.connection.commit()
+        self.connection.close()
+
+    def _evict(self):
+        (size,) = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM outputs').fetchone()
+        if size <= self.maxSize:
+            return
+        cursor = self.connection.execute('SELECT rowid, size FROM outputs ORDER BY used')
+        evicted = []
+        for (rowid, entrySize) in cursor:
+            if size <= self.maxSize:
+                break
+            evicted.append( (rowid,) )
+            size -= entrySize
+        cursor.close()
+        self.connection.executemany('DELETE FROM outputs WHERE rowid = ?', evicted)
+        self.evictions += len(evicted)
+
+# Wraps a filter so that runs with a cached output are answered from the
+# cache and only the remaining runs are handed to the filter
+class CachedFilter:
+    def __init__(self, wrapped, name, attributes, cache):
+        self.__dict__.update(locals())
+
+    @traced('filter')
+    def filter(self, testResult, runList):
+        (outputs, missing) = self.lookup(testResult, runList)
+        if len(missing):
+            outputs.update( self.store(testResult, self.wrapped.filter(testResult, missing)) )
+        return [outputs[run] for run in runList if run in outputs]
+
+    # Cached outputs by run, and the runs that still need filtering
+    def lookup(self, testResult, runList):
+        outputs = dict()
+        for run in runList:
+            (found, value) = self.cache.get(testResult.getSignature(), run, self.attributes['view'], self.name, self.attributes['version'])
+            if found:
+                outputs[run] = self.attributes['result'](testResult, run, value)
+        return (outputs, [run for run in runList if run not in outputs])
+
+    def store(self, testResult, results):
+        outputs = dict()
+        for result in results:
+            self.cache.put(testResult.getSignature(), result.run, self.attributes['view'], self.name, self.attributes['version'], result.getValue())
+            outputs[result.run] = result
+        return outputs
@@ -0,0 +1,67 @@
+import logging
+from multiprocessing import Pool
+from pageload.PageLoadTestResults import Factory as PageLoadTestResultsFactory
+from pageload.Filter import Factory as FilterFactory
+from pageload.FilterCache import CachedFilter
+from pageload.Index import Index
+
+class Factory:
+    def create(self, name, jobs=4, useColumnCache=True, indexPath=None):
+        return FilterPool(name, FilterFactory.filterMap[name], jobs, useColumnCache, indexPath)
+
+# Runs in a worker process.  Test results don't survive pickling, so the
+# worker opens the test again from its directory and sends back only the
+# filter output for each run.  The same goes for the index, if one is used.
+def filterTest(task):
+    (name, testDir, signature, runIds, useColumnCache, indexPath, runList) = task
+    index = Index(indexPath) if indexPath else None
+    try:
+        testResult = PageLoadTestResultsFactory(useColumnCache, index).create(testDir, signature, runIds)
+        return [(result.run, result.getValue()) for result in FilterFactory().create(name).filter(testResult, runList)]
+    finally:
+        if index is not None:
+            index.close()
+
+# Runs one filter over many tests in a pool of processes.  Cached outputs are
+# looked up and stored from this process, so the workers only ever see the
+# runs that actually need filtering.  Results are yielded in the order the
+# tests were given, one list per test as the filter itself would return them,
+# each as soon as it and those before it are done.
+class FilterPool:
+    def __init__(self, name, attributes, jobs, useColumnCache, indexPath):
+        self.__dict__.update(locals())
+        self.logger = logging.getLogger('pageload')
+
+    # tests is a list of (testResult, runList, filterCache) tuples, where the
+    # cache may be None
+    def run(self, tests):
+        pool = Pool(max(1, self.jobs))
+        pending = []
+        try:
+            for (testResult, runList, filterCache) in tests:
+                runList = list(runList)
+                if filterCache is not None:
+                    cachedFilter = CachedFilter(None, self.name, self.attributes, filterCache)
+                    (outputs, missing) = cachedFilter.lookup(testResult, runList)
+                else:
+                    (cachedFilter, outputs, missing) = (None, dict(), runList)
+                task = None
+                if len(missing):
+                    task = pool.apply_async(filterTest, ((self.name, testResult.testDir, testResult.getSignature(), testResult.getRunIds(), self.useColumnCache, self.indexPath, missing),))
+                pending.append( (testResult, runList, cachedFilter, outputs, task) )
+            pool.close()
+
+            for (testResult, runList, cachedFilter, outputs, task) in pending:
+                if task is not None:
+                    results = [self.attributes['result'](testResult, run, value) for (run, value) in task.get()]
+                    if cachedFilter is not None:
+                        outputs.update( cachedFilter.store(testResult, results) )
+                    else:
+                        outputs.update( [(result.run, result) for result in results] )
+                yield [outputs[run] for run in runList if run in outputs]
+            self.logger.debug('Filtered %d tests in %d processes' % (len(tests), self.jobs))
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
@@ -0,0 +1,184 @@
+import httplib, zlib, socket, logging, threading
+from time import time
+from urlparse import urlparse
+
+class Factory:
+    def create(self, maxIdle=8, timeout=60):
+        return HttpClient(maxIdle, timeout)
+
+class HttpError(Exception):
+    def __init__(self, url, status, reason):
+        Exception.__init__(self, 'HTTP %d %s (%s)' % (status, reason, url))
+        self.__dict__.update(locals())
+
+class HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.reused = 0
+        self.bytes = 0
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+    def record(self, elapsed, size, reused):
+        self.requests += 1
+        self.bytes += size
+        self.totalTime += elapsed
+        self.maxTime = max(self.maxTime, elapsed)
+        if reused:
+            self.reused += 1
+    def __str__(self):
+        average = (self.totalTime / self.requests) * 1000 if self.requests else 0
+        return '%d requests over %d connections (%d reused), %d bytes, avg %.1f ms, max %.1f ms' % (
+            self.requests, self.connections, self.reused, self.bytes, average, self.maxTime * 1000)
+
+class Decoder:
+    def __init__(self, encoding):
+        self.encoding = (encoding or '').lower()
+        if self.encoding == 'gzip':
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == 'deflate':
+            self.decompressor = None
+        else:
+            self.decompressor = False
+    def decode(self, chunk):
+        if self.decompressor is False:
+            return chunk
+        # Servers disagree on whether 'deflate' means zlib or raw deflate
+        if self.decompressor is None:
+            try:
+                self.decompressor = zlib.decompressobj()
+                return self.decompressor.decompress(chunk)
+            except zlib.error:
+                self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self.decompressor.decompress(chunk)
+    def flush(self):
+        if not self.decompressor:
+            return ''
+        return self.decompressor.flush()
+
+# Keeps idle connections per (scheme, host) and hands them out again for
+# later requests.  Safe to share between threads; each request checks a
+# connection out of the pool and puts it back once the response is read.
+class HttpClient:
+    chunkSize = 64 * 1024
+    maxRedirects = 5
+    redirectCodes = [301, 302, 303, 307]
+    idempotentMethods = ['GET', 'HEAD']
+
+    def __init__(self, maxIdle=8, timeout=60):
+        self.__dict__.update(locals())
+        self.logger = logging.getLogger('pageload')
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._stats = {}
+
+    def request(self, method, url, body=None, headers={}):
+        chunks = []
+        (response, size) = self._perform(method, url, body, headers, chunks.append)
+        return (response, ''.join(chunks))
+
+    def download(self, url, fp):
+        def write(chunk):
+            fp.write(chunk)
+        (response, size) = self._perform('GET', url, None, {}, write, True)
+        return size
+
+    def getStats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle = {}
+
+    def _perform(self, method, url, body, headers, write, requireOk=False):
+        for redirect in range(self.maxRedirects + 1):
+            (response, size, location) = self._attempt(method, url, body, headers, write, requireOk)
+            if location is None:
+                return (response, size)
+            url = location
+        raise HttpError(url, response.status, 'Too many redirects')
+
+    def _attempt(self, method, url, body, headers, write, requireOk):
+        parts = urlparse(url)
+        key = (parts.scheme or 'http', parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        requestHeaders = {'Accept-Encoding': 'gzip, deflate'}
+        requestHeaders.update(headers)
+
+        (connection, reused) = self._checkout(key)
+        start = time()
+        try:
+            connection.request(method, path, body, requestHeaders)
+            response = connection.getresponse()
+        except (socket.error, httplib.HTTPException):
+            connection.close()
+            # The server may have dropped an idle keep-alive connection
+            if not reused or method.upper() not in self.idempotentMethods:
+                raise
+            (connection, reused) = self._checkout(key, fresh=True)
+            connection.request(method, path, body, requestHeaders)
+            response = connection.getresponse()
+
+        location = None
+        if response.status in self.redirectCodes and response.getheader('location'):
+            location = response.getheader('location')
+            if location.startswith('/'):
+                location = '%s://%s%s' % (key[0], key[1], location)
+            write = lambda chunk: None
+        elif requireOk and response.status != 200:
+            write = lambda chunk: None
+
+        size = 0
+        try:
+            decoder = Decoder(response.getheader('content-encoding'))
+            while True:
+                chunk = response.read(self.chunkSize)
+                if not chunk:
+                    break
+                size += len(chunk)
+                write(decoder.decode(chunk))
+            write(decoder.flush())
+        except:
+            connection.close()
+            raise
+
+        elapsed = time() - start
+        with self._lock:
+            self._stats[key[1]].record(elapsed, size, reused)
+        self.logger.debug('%s %s %s (HTTP %s %s, %.1f ms)' % (method.upper(), key[1], path, response.status, response.reason, elapsed * 1000))
+        self._checkin(key, connection, response)
+
+        if location is None and requireOk and response.status != 200:
+            raise HttpError(url, response.status, response.reason)
+        return (response, size, location)
+
+    def _checkout(self, key, fresh=False):
+        with self._lock:
+            if key[1] not in self._stats:
+                self._stats[key[1]] = HostStats()
+            idle = self._idle.get(key, [])
+            if len(idle) and not fresh:
+                return (idle.pop(), True)
+            self._stats[key[1]].connections += 1
+
+        if key[0] == 'https':
+            return (httplib.HTTPSConnection(key[1], timeout=self.timeout), False)
+        return (httplib.HTTPConnection(key[1], timeout=self.timeout), False)
+
+    def _checkin(self, key, connection, response):
+        if response.will_close:
+            connection.close()
+            return
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxIdle:
+                idle.append(connection)
+                return
+        connection.close()
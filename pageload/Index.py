@@ -0,0 +1,159 @@
+import os, sqlite3, logging
+from pageload.PageLoadTestResults import Columns, PageData, RequestData
+
+class Factory:
+    fileName = '.pageload-index.db'
+
+    def create(self, baseDir):
+        return Index(os.path.join(baseDir, self.fileName))
+
+    # The index of a base directory, if one has been created with pageload
+    # index
+    def open(self, baseDir):
+        path = os.path.join(baseDir, self.fileName)
+        return Index(path) if os.path.isfile(path) else None
+
+    # The index of the base directory a test directory is in
+    def find(self, testsDir):
+        return self.open( os.path.dirname(os.path.normpath(testsDir)) )
+
+# pageData and requestsData of every run of every result under a base
+# directory, in a SQLite database next to the test directories.  The tables
+# take their columns from the WPT headers (columns are added as new headers
+# turn up), so they can be queried directly:
+#
+#   SELECT r.name, q.URL, q."Object Size" FROM requests q
+#     JOIN results r ON r.signature = q.signature
+#     WHERE q."Object Size" > 500000 AND r.time >= date('now', '-1 month')
+class Index:
+    keys = {
+        'page_data': ['signature', 'name', 'run', 'view'],
+        'requests': ['signature', 'name', 'run', 'view', 'seq']
+    }
+    schema = [
+        'CREATE TABLE IF NOT EXISTS results (signature TEXT PRIMARY KEY, name TEXT, time TEXT, directory TEXT, runs INTEGER)',
+        'CREATE INDEX IF NOT EXISTS results_time ON results (time)',
+        'CREATE TABLE IF NOT EXISTS page_data (signature TEXT, name TEXT, run INTEGER, view TEXT)',
+        'CREATE INDEX IF NOT EXISTS page_data_run ON page_data (signature, run, view)',
+        'CREATE TABLE IF NOT EXISTS requests (signature TEXT, name TEXT, run INTEGER, view TEXT, seq INTEGER)',
+        'CREATE INDEX IF NOT EXISTS requests_run ON requests (signature, run, view, seq)'
+    ]
+    views = ['firstView', 'repeatView']
+
+    def __init__(self, path):
+        self.__dict__.update(locals())
+        self.logger = logging.getLogger('pageload')
+        self.connection = sqlite3.connect(path)
+        try:
+            self.connection.text_factory = str
+            for statement in self.schema:
+                self.connection.execute(statement)
+        except:
+            self.connection.close()
+            raise
+        self.columns = dict()
+
+    def getSignatures(self):
+        return set([row[0] for row in self.connection.execute('SELECT signature FROM results')])
+
+    def add(self, name, result):
+        signature = result.getSignature()
+        self.remove(signature)
+        try:
+            for run in result.getRunIds():
+                for view in self.views:
+                    if not os.path.isdir( os.path.join(result.testDir, 'run', str(run), view) ):
+                        continue
+                    viewObject = result.getRun(run).getFirstView() if view == 'firstView' else result.getRun(run).getRepeatView()
+                    self._insert('page_data', [signature, name, run, view], [viewObject.getPageData()])
+                    self._insert('requests', [signature, name, run, view], viewObject.getRequestData(), True)
+            self.connection.execute('INSERT INTO results VALUES (?, ?, ?, ?, ?)',
+                (signature, name, result.getDateTime().strftime('%Y-%m-%d %H:%M:%S'), result.testDir, result.getRunCount()))
+        except:
+            # Adding a column commits, so some rows may already be stored
+            self.connection.rollback()
+            self.remove(signature)
+            raise
+        self.connection.commit()
+
+    def remove(self, signature):
+        for table in ['results', 'page_data', 'requests']:
+            self.connection.execute('DELETE FROM %s WHERE signature = ?' % (table), (signature,))
+        self.connection.commit()
+
+    # Brings the index in line with the given test directories: results that
+    # aren't indexed yet are added and results that are gone are removed.
+    # Returns the number added and removed.
+    def update(self, directories):
+        indexed = self.getSignatures()
+        present = set()
+        added = 0
+        for directory in directories:
+            for result in directory.getTestResults():
+                present.add(result.getSignature())
+                if result.getSignature() in indexed:
+                    continue
+                try:
+                    self.add(directory.getName(), result)
+                    added += 1
+                except (IOError, OSError, IndexError, KeyError, ValueError, StopIteration, sqlite3.Error) as error:
+                    self.logger.warning('Could not index %s: %s' % (result.getSignature()[:8], str(error) or error.__class__.__name__))
+        removed = indexed - present
+        for signature in removed:
+            self.remove(signature)
+        return (added, len(removed))
+
+    def getPageData(self, signature, run, view):
+        rows = self._select('page_data', PageData, signature, run, view)
+        return rows[0] if len(rows) else None
+
+    def getRequestData(self, signature, run, view):
+        return self._select('requests', RequestData, signature, run, view)
+
+    def query(self, sql):
+        return self.connection.execute(sql)
+
+    def close(self):
+        self.connection.close()
+
+    def _select(self, table, rowClass, signature, run, view):
+        cursor = self.connection.execute('SELECT * FROM %s WHERE signature = ? AND run = ? AND view = ? ORDER BY rowid' % (table), (signature, run, view))
+        skip = len(self.keys[table])
+        columns = Columns([description[0] for description in cursor.description][skip:])
+        return [rowClass(columns, row[skip:]) for row in cursor]
+
+    def _insert(self, table, prefix, rows, numbered=False):
+        if not len(rows):
+            return
+        # Column names are case-insensitive in SQLite.  Only the first of any
+        # repeated header is kept, and headers named like one of the key
+        # columns are left out.
+        keys = self.keys[table]
+        existing = self._getColumns(table)
+        seen = set([name.lower() for name in keys])
+        positions = []
+        names = []
+        for (position, name) in enumerate(rows[0].columns.names):
+            if not name or name.lower() in seen:
+                continue
+            seen.add(name.lower())
+            if name.lower() not in existing:
+                self.connection.execute('ALTER TABLE %s ADD COLUMN %s' % (table, self._quote(name)))
+                existing.add(name.lower())
+            positions.append(position)
+            names.append(name)
+
+        statement = 'INSERT INTO %s (%s) VALUES (%s)' % (table, ', '.join(keys + [self._quote(name) for name in names]), ', '.join(['?'] * (len(keys) + len(names))))
+        values = []
+        for (seq, row) in enumerate(rows):
+            cells = [row.row[position] if position < len(row.row) else None for position in positions]
+            values.append( prefix + ([seq] if numbered else []) + cells )
+        self.connection.executemany(statement, values)
+
+    def _getColumns(self, table):
+        if table not in self.columns:
+            self.columns[table] = set([row[1].lower() for row in self.connection.execute('PRAGMA table_info(%s)' % (table))])
+        return self.columns[table]
+
+    def _quote(self, name):
+        return '"%s"' % (name.replace('"', '""'))
@@ -0,0 +1,57 @@
+import os, json, logging, threading
+
+class Factory:
+    def create(self, testsDir):
+        return Journal(os.path.join(testsDir, '.pageload', 'journal'))
+
+# An append-only log per in-flight test, named after the test's timestamp
+# directory.  A test is pending for as long as its log exists; the log is
+# removed once the result is recorded in the manifest or the test is aborted.
+# Only these transitions are journaled.  Which files have been downloaded is
+# plain from the files themselves, which only get their final name once they
+# are complete.
+class Journal:
+    lock = threading.Lock()
+
+    def __init__(self, directory):
+        self.__dict__.update(locals())
+        self.logger = logging.getLogger('pageload')
+
+    def record(self, name, event, **fields):
+        fields['event'] = event
+        with self.lock:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fp = open(self._path(name), 'a')
+            fp.write(json.dumps(fields) + '\n')
+            fp.flush()
+            os.fsync(fp.fileno())
+            fp.close()
+
+    def load(self, name):
+        events = []
+        fp = open(self._path(name))
+        for line in fp:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                # The last line may be cut short if we were killed mid-write
+                self.logger.warning('Ignoring truncated journal entry in %s' % (self._path(name)))
+        fp.close()
+        return events
+
+    def isPending(self, name):
+        return os.path.isfile(self._path(name))
+
+    def getPending(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(os.listdir(self.directory))
+
+    def remove(self, name):
+        with self.lock:
+            if os.path.isfile(self._path(name)):
+                os.remove(self._path(name))
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
@@ -1,12 +1,6 @@
-import argparse, sys, json, os, logging
-from datetime import datetime
-from functools import reduce
-from pageload.PageLoadTestResults import Factory as PageLoadTestResultsFactory
-from pageload.PageLoadTest import Factory as PageLoadTestFactory
-from pageload.PageLoadTestDirectory import Factory as PageLoadTestDirectoryFactory
-from pageload.Colors import AnsiColors
-from pageload.Filter import Factory as FilterFactory
-from pageload.Filter import FilterResultsDictComparator, FilterResultsDict, FilterResultsDictCombinor, FilterResultsDictComparatorDiff, FilterResultsDictCombinorDiff
+import argparse, sys, os, errno, logging
+from pageload import Statistics
+from pageload.Output import Factory as OutputFactory
 
 def getLogger(level):
     logMap = {
@@ -31,27 +25,23 @@ def getLogger(level):
     logger.addHandler(ch)
     return logger
 
-def findResult(testHash, directories):
-    for directory in directories:
-        testResult = directory.getTestResultByHash(testHash)
-        if testResult:
-            return (directory, testResult)
-    return None
+def findResult(testHash, index):
+    return index.find(testHash)
 
-def parseTestHash(testHash, directories):
+def parseTestHash(testHash, index):
     try:
         (hashPart, runPart) = testHash.split(':')
     except ValueError:
         (hashPart, runPart) = (testHash, '*')
 
     try:
-        (directory, testResult) = findResult(hashPart, directories)
+        (directory, testResult) = findResult(hashPart, index)
     except TypeError:
         raise Exception('Invalid hash: %s' % (hashPart))
 
     def parseNum(num):
         if num == '*':
-            return list(range(1, len(testResult.getRuns())+1))
+            return testResult.getRunIds()
         y = num.split('-')
         if len(y) == 2:
             return list(range( int(y[0]), int(y[1])+1 ))
@@ -61,249 +51,745 @@ def parseTestHash(testHash, directories):
     runRange = set([item for sublist in runRange for item in sublist])
     return (testResult, directory, runRange)
 
-def Cli():
+def createTestFactory(cli, logger):
+    from pageload.HttpClient import Factory as HttpClientFactory
+    from pageload.Downloader import Factory as DownloaderFactory
+    from pageload.PageLoadTest import Factory as PageLoadTestFactory
+    from pageload import Compression
+    if not Compression.isAvailable(cli.compress):
+        logger.error('--compress %s needs Python 3 or the backports.lzma module' % (cli.compress))
+        sys.exit(-1)
+    httpClient = HttpClientFactory().create()
+    downloader = DownloaderFactory().create(httpClient, cli.download_jobs, cli.host_limit)
+    return (httpClient, PageLoadTestFactory(httpClient, downloader, cli.pretty_xml, cli.compress))
+
+def runTests(cli, logger, httpClient, pageloads):
+    from pageload.Scheduler import Factory as SchedulerFactory
+    from pageload.Poller import PollPolicy
+    pollPolicy = PollPolicy(cli.poll_interval, cli.max_poll_interval, cli.timeout)
+    scheduler = SchedulerFactory().create(pageloads, cli.jobs, pollPolicy)
+    results = scheduler.run()
+    httpClient.close()
+    for host, stats in httpClient.getStats().items():
+        logger.info('%s: %s' % (host, stats))
+    if len(results) < len(pageloads):
+        logger.warning('Could not acquire %d of %d test results' % (len(pageloads) - len(results), len(pageloads)))
+    return results
+
+# Every subcommand has a function that adds its arguments and a function
+# that runs it, and is listed in the commands table below.  Commands import
+# the modules they use when they run, so that starting pageload only costs
+# what the chosen command needs.
+
+def addTestRunArguments(parser):
+    parser.add_argument('-j', '--jobs',
+        type = int,
+        default = 4,
+        help = 'Number of finished tests to download concurrently')
+
+    parser.add_argument('--download-jobs',
+        type = int,
+        default = 8,
+        help = 'Number of files to download concurrently for each test')
+
+    parser.add_argument('--host-limit',
+        type = int,
+        default = 4,
+        help = 'Maximum number of concurrent downloads from any one host')
+
+    parser.add_argument('--poll-interval',
+        type = float,
+        default = 10,
+        help = 'Seconds between status requests while WPT gives no estimate of when a test will finish')
+
+    parser.add_argument('--max-poll-interval',
+        type = float,
+        default = 60,
+        help = 'Longest time to wait between status requests for a test')
+
+    parser.add_argument('--timeout',
+        type = float,
+        default = 900,
+        help = 'Seconds to wait for a test to finish before giving up on it')
+
+    parser.add_argument('--pretty-xml',
+        action = 'store_true',
+        help = 'Indent response.xml when it is saved, which means reading it into memory whole')
+
+    parser.add_argument('--compress',
+        choices = ['gzip', 'lzma'],
+        help = 'Store the raw data files and CSVs of each run compressed')
+
+def addRunArguments(parser):
+    parser.add_argument('-t', '--tests',
+        required=True,
+        help = 'Location of the test specification file')
 
-    ver = sys.version_info
+    parser.add_argument('-g', '--global-params',
+        help = 'Location JSON document with parameters that are to be attached to every request (e.g. API key)')
 
-    if ver.major < 2 or (ver.major == 3 and ver.minor < 2) or (ver.major == 2 and ver.minor < 7):
-        print("Python 2.7+ required. %d.%d.%d installed" %(ver.major, ver.minor, ver.micro))
+    parser.add_argument('-d', '--results-dir',
+        required = True,
+        default = './pageload_tests',
+        help = 'Directory to save test results to')
+
+    addTestRunArguments(parser)
+
+def runCommand(cli, logger):
+    import json
+    from pageload.PageLoadTestResults import Factory as PageLoadTestResultsFactory
+    from pageload.PageLoadTestDirectory import Factory as PageLoadTestDirectoryFactory
+
+    if not os.access(cli.results_dir, os.W_OK):
+        logger.error('Test results directory is not writable.')
         sys.exit(-1)
 
-    parser = argparse.ArgumentParser(
-        description = 'BSD Page Load Performance Monitor',
-        epilog = '(c) 2011 Blue State Digital')
+    if os.path.isfile( cli.tests ):
+        try:
+            tests = json.loads( open(cli.tests).read() )
+        except Exception as e:
+            logger.error('Unable to load tests file: %s' % (e))
+            sys.exit(-1)
+    else:
+        logger.error('argument to --tests is not a file')
+        sys.exit(-1)
 
-    parser.add_argument('-L', '--logging',
-        default='info',
-        help='Turn on debugging output')
+    globalParams = None
+    if cli.global_params:
+        if os.path.isfile( cli.global_params ):
+            try:
+                globalParams = json.loads( open(cli.global_params).read() )
+            except Exception as e:
+                logger.warning('Unable to load global parameters file: %s' % (e))
+        else:
+            logger.warning('Argument to --global-params is not a file')
+
+    (httpClient, testFactory) = createTestFactory(cli, logger)
+    directoryFactory = PageLoadTestDirectoryFactory(PageLoadTestResultsFactory())
+    testDirectories = dict()
+    pageloads = list()
+
+    for requestParams in tests:
+        if globalParams:
+            requestParams['params'] = dict(globalParams.items() + requestParams['params'].items())
+        requestParams['params']['url'] = requestParams['url']
+        if requestParams['name'] not in testDirectories:
+            testDirectories[requestParams['name']] = directoryFactory.load( os.path.join(cli.results_dir, requestParams['name']) )
+        testDirectory = testDirectories[requestParams['name']]
+        pageloads.append( testFactory.create(testDirectory, requestParams['url'], requestParams['params']) )
+
+    runTests(cli, logger, httpClient, pageloads)
+
+def addResumeArguments(parser):
+    parser.add_argument('-d', '--results-dir',
+        required = True,
+        help = 'Directory that test results were being saved to')
 
-    subparsers = parser.add_subparsers(help='Available actions', dest='sub_command')
+    addTestRunArguments(parser)
 
-    commands = {}
-    commands['run'] = subparsers.add_parser('run', help='Run a series of web page tests.')
-    commands['ls'] = subparsers.add_parser('ls', help='List contents of a directory containing test data.')
-    commands['rm'] = subparsers.add_parser('rm', help='Remove a test.')
-    commands['filter'] = subparsers.add_parser('filter', help='Display a subset of the information about the test data.')
-    commands['list-filters'] = subparsers.add_parser('list-filters', help='List currently available filters.')
-    commands['dev'] = subparsers.add_parser('dev', help='Developer land.')
+def resumeCommand(cli, logger):
+    from pageload.PageLoadTestResults import Factory as PageLoadTestResultsFactory
+    from pageload.PageLoadTestDirectory import Factory as PageLoadTestDirectoryFactory
+    from pageload.PageLoadTest import PageLoadTestException
 
-    commands['run'].add_argument('-t', '--tests',
-        required=True,
-        help = 'Location of the test specification file')
+    if not os.path.isdir( cli.results_dir ):
+        logger.error('%s is not a directory' % (cli.results_dir))
+        sys.exit(-1)
 
-    commands['run'].add_argument('-g', '--global-params',
-        help = 'Location JSON document with parameters that are to be attached to every request (e.g. API key)')
+    (httpClient, testFactory) = createTestFactory(cli, logger)
+    directoryFactory = PageLoadTestDirectoryFactory(PageLoadTestResultsFactory())
+    pageloads = list()
 
-    commands['run'].add_argument('-d', '--results-dir',
-        required = True,
-        default = './pageload_tests',
-        help = 'Directory to save test results to')
+    for directory in directoryFactory.discover( cli.results_dir ):
+        for name in directory.getJournal().getPending():
+            try:
+                pageload = testFactory.resume(directory, name)
+            except PageLoadTestException as error:
+                logger.warning(error)
+                pageload = None
+            if pageload is None:
+                logger.warning('Discarding %s, it cannot be resumed' % (os.path.join(directory.getDirectory(), name)))
+                directory.discardPending(name)
+                continue
+            pageloads.append(pageload)
+
+    if not len(pageloads):
+        logger.info('No pending tests to resume')
+        return
 
-    commands['ls'].add_argument('dir',
+    runTests(cli, logger, httpClient, pageloads)
+
+def addLsArguments(parser):
+    parser.add_argument('dir',
         metavar='DIRECTORY',
         nargs='?',
         default = '.',
         help = 'Directory to be listed.')
 
-    commands['dev'].add_argument('dir',
+def lsCommand(cli, logger):
+    from pageload.PageLoadTestResults import Factory as PageLoadTestResultsFactory
+    from pageload.PageLoadTestDirectory import Factory as PageLoadTestDirectoryFactory
+    from pageload.Colors import AnsiColors
+
+    if not os.path.isdir( cli.dir ):
+        logger.error('%s is not a directory' % (cli.dir))
+        sys.exit(-1)
+
+    directoryFactory = PageLoadTestDirectoryFactory( PageLoadTestResultsFactory() )
+    directories = directoryFactory.discover( cli.dir )
+
+    styler = AnsiColors()
+    for directory in directories:
+        print(directory.getName())
+        for result in directory.getTestResults():
+            print( '  [%s] %s' % (styler.color(result.getSignature()[:8], 'yellow'), result.getDateTime().strftime('%Y/%m/%d %H:%M:%S')) )
+        sys.stdout.write('\n')
+
+def addRmArguments(parser):
+    parser.add_argument('test',
+        metavar='TEST',
+        nargs='+',
+        help = 'Tests to remove, by hash value.')
+
+    parser.add_argument('dir',
         metavar='DIRECTORY',
-        default = '.',
         nargs='?',
-        help = 'Directory to be listed.')
+        default = '.',
+        help = 'Directory of tests.')
+
+def rmCommand(cli, logger):
+    from pageload.PageLoadTestResults import Factory as PageLoadTestResultsFactory
+    from pageload.PageLoadTestDirectory import Factory as PageLoadTestDirectoryFactory, ResultIndex
+    from pageload.Colors import AnsiColors
+
+    if not os.path.isdir( cli.dir ):
+        logger.error('%s is not a directory' % (cli.dir))
+        sys.exit(-1)
 
-    commands['filter'].add_argument('test',
+    directoryFactory = PageLoadTestDirectoryFactory( PageLoadTestResultsFactory() )
+    index = ResultIndex( directoryFactory.discover( cli.dir ) )
+
+    styler = AnsiColors()
+    for testHash in cli.test:
+        try:
+            (testResult, directory, runList) = parseTestHash( testHash, index )
+        except Exception as error:
+            logger.warning('Test hash %s doesn\'t point to a valid test result: %s' % (testHash, error))
+            continue
+        directory.removeResult( testResult )
+        print( '%s Removed' % (styler.color(testResult.getSignature(), 'yellow')) )
+
+def addFilterArguments(parser):
+    parser.add_argument('test',
         metavar='TEST',
         nargs='+',
         help = 'Test to filter, by hash value.')
 
-    commands['filter'].add_argument('-f', '--filter',
+    parser.add_argument('-f', '--filter',
         required = True,
         help = 'Filter function to run.')
 
-    commands['filter'].add_argument('-c', '--compare',
+    parser.add_argument('-c', '--compare',
         action='store_true',
         help = 'For an aggregate filter, compare results side-by-side instead of listing them one after the other.')
 
-    commands['filter'].add_argument('-o', '--output-format',
+    parser.add_argument('-o', '--output-format',
         action='store',
         default = 'text',
-        help = 'How to format the output, ie (json, text)')
+        choices = OutputFactory.formats,
+        help = 'How to format the output.  json writes the values of each run, ndjson adds its signature, run and date.')
 
-    commands['filter'].add_argument('-d', '--diff',
+    parser.add_argument('-d', '--diff',
         action='store_true',
         help = 'When used with --compare or --combine, the difference between the results is displayed.')
 
-    commands['filter'].add_argument('-b', '--combine',
-        help = 'For an aggregate filter, combines results using either mean or median.')
+    parser.add_argument('-s', '--significance',
+        choices = Statistics.significanceTests,
+        help = 'With --combine and --diff, give a confidence interval for each difference and the p-value of this test.')
 
-    commands['rm'].add_argument('test',
-        metavar='TEST',
-        nargs='+',
-        help = 'Tests to remove, by hash value.')
+    parser.add_argument('--confidence',
+        type = float,
+        default = 0.95,
+        help = 'Confidence level for --significance')
 
-    commands['rm'].add_argument('dir',
-        metavar='DIRECTORY',
-        nargs='?',
-        default = '.',
-        help = 'Directory of tests.')
+    parser.add_argument('-i', '--index',
+        action='store_true',
+        help = 'Read page and request data from the index created by pageload index instead of the test files.')
 
-    cli = parser.parse_args()
-    logger = getLogger(cli.logging)
+    parser.add_argument('--no-column-cache',
+        action='store_true',
+        help = 'Parse the raw data files instead of reading or writing their cached column form.')
 
-    logger.debug( 'CLI: %s' % (cli) )
+    parser.add_argument('--no-filter-cache',
+        action='store_true',
+        help = 'Run the filter on every run instead of reusing cached outputs.')
+
+    parser.add_argument('--filter-cache-size',
+        type = int,
+        default = 64,
+        help = 'Megabytes of filter outputs to keep cached for each directory of tests')
+
+    parser.add_argument('-j', '--jobs',
+        type = int,
+        default = 1,
+        help = 'Number of processes to filter tests in')
+
+    parser.add_argument('-b', '--combine',
+        help = 'For an aggregate filter, combines results using one of %s.' % (', '.join(Statistics.methods)))
+
+def filterCommand(cli, logger):
+    from pageload.PageLoadTestResults import Factory as PageLoadTestResultsFactory
+    from pageload.PageLoadTestDirectory import Factory as PageLoadTestDirectoryFactory, ResultIndex, AmbiguousHashError
+    from pageload.Filter import Factory as FilterFactory
+    from pageload.Filter import FilterResultsDictComparator, FilterResultsDict, FilterResultsDictCombinor, FilterResultsDictComparatorDiff, FilterResultsDictCombinorDiff
+    from pageload.FilterCache import Factory as FilterCacheFactory
+    from pageload.FilterPool import Factory as FilterPoolFactory
+    from pageload.Index import Factory as IndexFactory
+
+    if cli.compare and cli.combine:
+        logger.error('--compare and --combine are mutually exclusive')
+        sys.exit(-1)
 
-    if cli.sub_command == 'filter':
+    if (cli.compare or cli.combine) and cli.output_format != 'text':
+        logger.error('--compare and --combine can only be displayed as text')
+        sys.exit(-1)
 
-        if cli.compare and cli.combine:
-            logger.error('--compare and --combine are mutually exclusive')
-            sys.exit(-1)
+    if cli.significance and not (cli.combine and cli.diff):
+        logger.error('--significance needs the runs of each side, so it requires --combine and --diff')
+        sys.exit(-1)
 
-        directoryFactory = PageLoadTestDirectoryFactory( PageLoadTestResultsFactory() )
-        directories = directoryFactory.discover('.')
-        filterFactory = FilterFactory()
-        filteredTestResultsLists = list()
-
-        for testHash in cli.test:
-            (testResult, directory, runList) = parseTestHash( testHash, directories )
-            if testResult is None:
-                logger.error('Test hash %s doesn\'t point to a valid test result' % (testHash))
-                sys.exit(-1)
+    if not 0 < cli.confidence < 1:
+        logger.error('--confidence must be between 0 and 1')
+        sys.exit(-1)
 
-            f = filterFactory.create(cli.filter)
-            result = f.filter( testResult, runList )
-            filteredTestResultsLists.append(result)
+    resultsIndex = None
+    if cli.index:
+        resultsIndex = IndexFactory().open('.')
+        if resultsIndex is None:
+            logger.error('There is no index in this directory, create one with pageload index')
+            sys.exit(-1)
 
+    directoryFactory = PageLoadTestDirectoryFactory( PageLoadTestResultsFactory(not cli.no_column_cache, resultsIndex) )
+    index = ResultIndex( directoryFactory.discover('.') )
+    filterFactory = FilterFactory()
+    filterCaches = dict()
+    tests = list()
+
+    for testHash in cli.test:
+        try:
+            (testResult, directory, runList) = parseTestHash( testHash, index )
+        except AmbiguousHashError as error:
+            logger.error(error)
+            sys.exit(-1)
+        if testResult is None:
+            logger.error('Test hash %s doesn\'t point to a valid test result' % (testHash))
+            sys.exit(-1)
+        missing = runList - set(testResult.getRunIds())
+        if missing:
+            logger.error('Test %s has no run %s' % (testResult.getSignature()[:8], ', '.join([str(run) for run in sorted(missing)])))
+            sys.exit(-1)
 
+        filterCache = None
+        if not cli.no_filter_cache:
+            if directory.getDirectory() not in filterCaches:
+                filterCaches[directory.getDirectory()] = FilterCacheFactory().create(directory.getDirectory(), cli.filter_cache_size * 1024 * 1024)
+            filterCache = filterCaches[directory.getDirectory()]
+        tests.append( (testResult, runList, filterCache) )
+
+    if cli.jobs > 1:
+        filterPool = FilterPoolFactory().create(cli.filter, cli.jobs, not cli.no_column_cache, resultsIndex.path if resultsIndex else None)
+        filtered = filterPool.run(tests)
+    else:
+        filtered = (filterFactory.create(cli.filter, filterCache).filter(testResult, runList) for (testResult, runList, filterCache) in tests)
+
+    # Unless they are to be compared or combined, results are written out
+    # as each test is filtered rather than once they have all been
+    try:
+        if cli.compare or cli.combine:
+            filteredTestResultsLists = list(filtered)
+        else:
+            writer = OutputFactory().create(cli.output_format, sys.stdout, FilterFactory.filterMap[cli.filter].get('columns'))
+            for results in filtered:
+                for result in results:
+                    writer.write(result)
+    except IOError as error:
+        if error.errno != errno.EPIPE:
+            raise
+    finally:
+        for filterCache in [filterCache for filterCache in filterCaches.values() if filterCache is not None]:
+            logger.debug('Filter cache %s: %d hits, %d misses, %d evicted' % (filterCache.path, filterCache.hits, filterCache.misses, filterCache.evictions))
+            filterCache.close()
+
+    if cli.compare or cli.combine:
         filteredTestResults = [item for sublist in filteredTestResultsLists for item in sublist]
-        if cli.output_format == "json":
-            for result in filteredTestResults:
-                print(result.asJson())
-                sys.exit(0)
 
 
-        if cli.compare:
-            if not isinstance(filteredTestResults[0], FilterResultsDict):
-                logger.error('--compare is only allowed with aggregate filters (try pageload list-filters)')
+    if cli.compare:
+        if not isinstance(filteredTestResults[0], FilterResultsDict):
+            logger.error('--compare is only allowed with aggregate filters (try pageload list-filters)')
+            sys.exit(-1)
+
+        if cli.diff:
+            if len(filteredTestResults) != 2:
+                logger.error('Specifying --diff requires exactly two test hashes.  (e.g. pageload filter <hash1> <hash2> --compare --diff)')
                 sys.exit(-1)
 
-            if cli.diff:
-                if len(filteredTestResults) != 2:
-                    logger.error('Specifying --diff requires exactly two test hashes.  (e.g. pageload filter <hash1> <hash2> --compare --diff)')
-                    sys.exit(-1)
+            diffComparator = FilterResultsDictComparatorDiff( filteredTestResults[0], filteredTestResults[1] )
+            print(diffComparator)
+        else:
+            comparator = FilterResultsDictComparator( filteredTestResults )
+            print(comparator)
 
-                diffComparator = FilterResultsDictComparatorDiff( filteredTestResults[0], filteredTestResults[1] )
-                print(diffComparator)
-            else:
-                comparator = FilterResultsDictComparator( filteredTestResults )
-                print(comparator)
+    elif cli.combine:
+        if not isinstance(filteredTestResults[0], FilterResultsDict):
+            logger.error('--combine is only allowed with aggregate filters (try pageload list-filters)')
+            sys.exit(-1)
 
-        elif cli.combine:
-            if not isinstance(filteredTestResults[0], FilterResultsDict):
-                logger.error('--combine is only allowed with aggregate filters (try pageload list-filters)')
+        if cli.combine not in Statistics.methods:
+            logger.error('--combine must specify one of %s' % (', '.join(Statistics.methods)))
+            sys.exit(-1)
+
+        if cli.diff:
+            if len(filteredTestResultsLists) != 2:
+                logger.error('Specifying --diff requires exactly two test hash sets.  (e.g. pageload filter <hash1>:4-7 <hash2>:1-3 --compare --diff)')
                 sys.exit(-1)
 
-            if cli.combine not in ['median', 'mean']:
-                logger.error("--combine must specify either 'mean' or 'median'")
+            if cli.significance and min(len(filteredTestResultsLists[0]), len(filteredTestResultsLists[1])) < 2:
+                logger.error('--significance requires at least two runs on each side of the diff')
                 sys.exit(-1)
 
-            if cli.diff:
-                if len(filteredTestResultsLists) != 2:
-                    logger.error('Specifying --diff requires exactly two test hash sets.  (e.g. pageload filter <hash1>:4-7 <hash2>:1-3 --compare --diff)')
-                    sys.exit(-1)
+            combinor0 = FilterResultsDictCombinor( filteredTestResultsLists[0], cli.combine )
+            combinor1 = FilterResultsDictCombinor( filteredTestResultsLists[1], cli.combine )
+            combinor = FilterResultsDictCombinorDiff(combinor0, combinor1, cli.significance, cli.confidence)
+            print(combinor)
+        else:
+            combinor = FilterResultsDictCombinor( filteredTestResults, cli.combine )
+            print(combinor)
 
-                combinor0 = FilterResultsDictCombinor( filteredTestResultsLists[0], cli.combine )
-                combinor1 = FilterResultsDictCombinor( filteredTestResultsLists[1], cli.combine )
-                combinor = FilterResultsDictCombinorDiff(combinor0, combinor1)
-                print(combinor)
-            else:
-                combinor = FilterResultsDictCombinor( filteredTestResults, cli.combine )
-                print(combinor)
+def addListFiltersArguments(parser):
+    pass
 
-        else:
-            for result in filteredTestResults:
-                print(result)
+def listFiltersCommand(cli, logger):
+    from pageload.Filter import Factory as FilterFactory
 
-    if cli.sub_command == 'list-filters':
-        for filterName, filterAttributes in FilterFactory.filterMap.items():
-            print('%s - (type: %s) %s' % (filterName, filterAttributes['type'], filterAttributes['description']))
+    for filterName, filterAttributes in FilterFactory.filterMap.items():
+        print('%s - (type: %s) %s' % (filterName, filterAttributes['type'], filterAttributes['description']))
 
-    if cli.sub_command == 'rm':
-        if not os.path.isdir( cli.dir ):
-            logger.error('%s is not a directory' % (cli.dir))
-            sys.exit(-1)
+def addIndexArguments(parser):
+    parser.add_argument('dir',
+        metavar='DIRECTORY',
+        nargs='?',
+        default = '.',
+        help = 'Directory containing the test directories.')
 
-        directoryFactory = PageLoadTestDirectoryFactory( PageLoadTestResultsFactory() )
-        directories = directoryFactory.discover( cli.dir )
+    parser.add_argument('-q', '--query',
+        help = 'SQL to run against the index (tables: results, page_data, requests) instead of updating it.')
 
-        styler = AnsiColors()
-        for testHash in cli.test:
-            (directory, testResult, runList) = parseTestHash( testHash, directories )
-            if testResult is None:
-                logger.warning('Test hash %s doesn\'t point to a valid test result' % (testHash))
-                continue
-            testResult.remove()
-            directory.writeManifest()
-            print( '%s Removed' % (styler.color(testResult.getSignature(), 'yellow')) )
-                        
-    if cli.sub_command == 'ls':
-        if not os.path.isdir( cli.dir ):
-            logger.error('%s is not a directory' % (cli.dir))
+    parser.add_argument('--rebuild',
+        action='store_true',
+        help = 'Index every test again from scratch.')
+
+def indexCommand(cli, logger):
+    from pageload.PageLoadTestResults import Factory as PageLoadTestResultsFactory
+    from pageload.PageLoadTestDirectory import Factory as PageLoadTestDirectoryFactory
+    from pageload.Index import Factory as IndexFactory
+
+    if not os.path.isdir( cli.dir ):
+        logger.error('%s is not a directory' % (cli.dir))
+        sys.exit(-1)
+
+    path = os.path.join(cli.dir, IndexFactory.fileName)
+    if cli.query:
+        resultsIndex = IndexFactory().open(cli.dir)
+        if resultsIndex is None:
+            logger.error('%s has no index yet, create it with pageload index' % (cli.dir))
             sys.exit(-1)
+        try:
+            cursor = resultsIndex.query(cli.query)
+        except Exception as error:
+            logger.error('Query failed: %s' % (error))
+            sys.exit(-1)
+        if cursor.description:
+            print('\t'.join([description[0] for description in cursor.description]))
+            for row in cursor:
+                print('\t'.join([str(value) for value in row]))
+        resultsIndex.close()
+        return
+
+    if cli.rebuild and os.path.isfile(path):
+        os.remove(path)
+    directoryFactory = PageLoadTestDirectoryFactory( PageLoadTestResultsFactory() )
+    resultsIndex = IndexFactory().create(cli.dir)
+    (added, removed) = resultsIndex.update( directoryFactory.discover(cli.dir) )
+    print('Indexed %d new results and removed %d, %d results in %s' % (added, removed, len(resultsIndex.getSignatures()), path))
+    resultsIndex.close()
+
+def addTrendArguments(parser):
+    parser.add_argument('dir',
+        metavar='DIRECTORY',
+        nargs='?',
+        default = '.',
+        help = 'Directory of tests, or a directory containing several.')
+
+    parser.add_argument('-m', '--metric',
+        default = 'time_to_load',
+        help = 'Metric to show, one of the keys of the aggregate filters (e.g. time_to_load, time_to_first_byte, js_size).')
+
+    parser.add_argument('-b', '--combine',
+        default = 'median',
+        choices = Statistics.methods,
+        help = 'How to combine the runs of each test.')
+
+    parser.add_argument('-r', '--repeat-view',
+        action='store_true',
+        help = 'Show the repeat view instead of the first view.')
+
+    start = parser.add_mutually_exclusive_group()
+    start.add_argument('--days',
+        type = int,
+        help = 'Only show tests run in the last DAYS days.')
+
+    start.add_argument('--since',
+        help = 'Only show tests run on or after this date (YYYY-MM-DD).')
+
+    parser.add_argument('--until',
+        help = 'Only show tests run on or before this date (YYYY-MM-DD).')
+
+    parser.add_argument('--rebuild',
+        action='store_true',
+        help = 'Recompute the time series from the test results first, e.g. for tests run before it was kept.')
+
+def trendCommand(cli, logger):
+    from datetime import datetime, timedelta
+    from pageload.PageLoadTestResults import Factory as PageLoadTestResultsFactory
+    from pageload.PageLoadTestDirectory import Factory as PageLoadTestDirectoryFactory
+    from pageload.TimeSeries import Factory as TimeSeriesFactory
+    from pageload.Filter import FilterResultsDict
+    from pageload.Colors import AnsiColors
+
+    if not os.path.isdir( cli.dir ):
+        logger.error('%s is not a directory' % (cli.dir))
+        sys.exit(-1)
 
+    if cli.metric not in FilterResultsDict.strings:
+        logger.error('--metric must be one of %s' % (', '.join(sorted(FilterResultsDict.strings.keys()))))
+        sys.exit(-1)
+
+    try:
+        since = datetime.strptime(cli.since, '%Y-%m-%d') if cli.since else None
+        until = datetime.strptime(cli.until, '%Y-%m-%d') + timedelta(days=1, seconds=-1) if cli.until else None
+    except ValueError as error:
+        logger.error('Invalid date: %s' % (error))
+        sys.exit(-1)
+    if cli.days is not None:
+        since = datetime.now() - timedelta(days=cli.days)
+
+    if os.path.isdir( os.path.join(cli.dir, '.pageload') ):
+        testsDirs = [cli.dir]
+    else:
+        testsDirs = sorted([os.path.join(cli.dir, name) for name in os.listdir(cli.dir) if os.path.isdir( os.path.join(cli.dir, name, '.pageload') )])
+
+    if cli.rebuild:
         directoryFactory = PageLoadTestDirectoryFactory( PageLoadTestResultsFactory() )
-        directories = directoryFactory.discover( cli.dir )
+        for testsDir in testsDirs:
+            directory = directoryFactory.load(testsDir)
+            directory.getTimeSeries().rebuild( directory.getTestResults() )
+
+    view = 'repeatView' if cli.repeat_view else 'firstView'
+    styler = AnsiColors()
+    for testsDir in testsDirs:
+        timeSeries = TimeSeriesFactory().create(testsDir)
+        if not timeSeries.exists():
+            logger.warning('%s has no time series yet, run trend with --rebuild to create it' % (testsDir))
+            continue
+
+        tests = list()
+        values = dict()
+        for entry in timeSeries.query(since, until, view):
+            key = (entry['time'], entry['signature'])
+            if key not in values:
+                tests.append(key)
+                values[key] = list()
+            values[key].append( [entry['metrics'][cli.metric]] )
+
+        print('%s (%s, %s of %s runs)' % (os.path.basename(os.path.normpath(testsDir)), FilterResultsDict.strings[cli.metric], cli.combine, 'repeat view' if cli.repeat_view else 'first view'))
+        for (time, signature) in tests:
+            rows = values[(time, signature)]
+            combined = Statistics.combine(cli.combine, rows)[0]
+            date = datetime.strptime(time, '%Y%m%d%H%M%S').strftime('%Y/%m/%d %H:%M:%S')
+            print('  %s [%s] %s (%d runs)' % (date, styler.color(signature[:8], 'yellow'), combined, len(rows)))
+        sys.stdout.write('\n')
+
+def addCacheArguments(parser):
+    parser.add_argument('dir',
+        metavar='DIRECTORY',
+        nargs='?',
+        default = '.',
+        help = 'Directory of tests.')
+
+    parser.add_argument('--clear',
+        action='store_true',
+        help = 'Remove every cached filter output.')
 
-        styler = AnsiColors()
-        for directory in directories:
-            print(directory.getName())
-            for result in directory.getTestResults():
-                print( '  [%s] %s' % (styler.color(result.getSignature()[:8], 'yellow'), result.getDateTime().strftime('%Y/%m/%d %H:%M:%S')) )
+def cacheCommand(cli, logger):
+    from pageload.PageLoadTestResults import Factory as PageLoadTestResultsFactory
+    from pageload.PageLoadTestDirectory import Factory as PageLoadTestDirectoryFactory
+    from pageload.FilterCache import Factory as FilterCacheFactory
+
+    if not os.path.isdir( cli.dir ):
+        logger.error('%s is not a directory' % (cli.dir))
+        sys.exit(-1)
+
+    directoryFactory = PageLoadTestDirectoryFactory( PageLoadTestResultsFactory() )
+    for directory in directoryFactory.discover( cli.dir ):
+        filterCache = FilterCacheFactory().create(directory.getDirectory())
+        print(directory.getName())
+        if filterCache is None:
+            print('  no filter cache, it could not be opened')
             sys.stdout.write('\n')
+            continue
+        if cli.clear:
+            filterCache.clear()
+        stats = filterCache.getStats()
+        filterCache.close()
+        lookups = stats['hits'] + stats['misses']
+        print('  %d outputs, %d bytes' % (stats['entries'], stats['size']))
+        print('  %d hits, %d misses (%d%% hit rate), %d evicted' % (stats['hits'], stats['misses'], 100 * stats['hits'] / lookups if lookups else 0, stats['evictions']))
+        sys.stdout.write('\n')
+
+def addCompressArguments(parser):
+    parser.add_argument('dir',
+        metavar='DIRECTORY',
+        nargs='?',
+        default = '.',
+        help = 'Directory of tests, or a directory containing several.')
 
-    if cli.sub_command == 'dev':
-        directoryFactory = PageLoadTestDirectoryFactory( PageLoadTestResultsFactory() )
-        directories = directoryFactory.discover('.')
+    parser.add_argument('-c', '--compression',
+        default = 'gzip',
+        choices = ['gzip', 'lzma', 'none'],
+        help = 'How to store the raw data files and CSVs; none stores them uncompressed again.')
+
+    parser.add_argument('--level',
+        type = int,
+        help = 'Compression level, 1-9 for gzip and 0-9 for lzma (default 6 for both).')
+
+def compressCommand(cli, logger):
+    from pageload.PageLoadTestResults import Factory as PageLoadTestResultsFactory
+    from pageload.PageLoadTestDirectory import Factory as PageLoadTestDirectoryFactory
+    from pageload import Compression
+
+    if not os.path.isdir( cli.dir ):
+        logger.error('%s is not a directory' % (cli.dir))
+        sys.exit(-1)
+
+    compression = None if cli.compression == 'none' else cli.compression
+    if not Compression.isAvailable(compression):
+        logger.error('lzma compression needs Python 3 or the backports.lzma module')
+        sys.exit(-1)
+
+    # Tests still being downloaded are left alone; resume compresses the rest
+    # of their files if it is given --compress
+    directoryFactory = PageLoadTestDirectoryFactory( PageLoadTestResultsFactory(False) )
+    if os.path.isdir( os.path.join(cli.dir, '.pageload') ):
+        directories = [directoryFactory.load(cli.dir)]
+    else:
+        directories = sorted(directoryFactory.discover(cli.dir), key=lambda directory: directory.getName())
+
+    for directory in directories:
+        (files, before, after) = (0, 0, 0)
+        for result in directory.getTestResults():
+            try:
+                for path in Compression.iterDataPaths(result.testDir):
+                    if not Compression.dataExists(path):
+                        continue
+                    (oldSize, newSize) = Compression.convert(path, compression, cli.level)
+                    files += 1
+                    before += oldSize
+                    after += newSize
+            except Exception as error:
+                logger.warning('Could not convert %s: %s' % (result.testDir, error))
+        print(directory.getName())
+        print('  %d files, %d KB stored as %d KB (%d%%)' % (files, before / 1024, after / 1024, 100 * after / before if before else 100))
+
+def addDevArguments(parser):
+    parser.add_argument('dir',
+        metavar='DIRECTORY',
+        default = '.',
+        nargs='?',
+        help = 'Directory to be listed.')
+
+def devCommand(cli, logger):
+    from pageload.PageLoadTestResults import Factory as PageLoadTestResultsFactory
+    from pageload.PageLoadTestDirectory import Factory as PageLoadTestDirectoryFactory, ResultIndex
+
+    directoryFactory = PageLoadTestDirectoryFactory( PageLoadTestResultsFactory() )
+    index = ResultIndex( directoryFactory.discover('.') )
 
 #        try:
-        x = parseTestHash(cli.dir, directories)
-        print(x)
+    x = parseTestHash(cli.dir, index)
+    print(x)
 #        except Exception as e:
 #            print(e)
 #            sys.exit(-1)
 
-    if cli.sub_command == 'run':
-        if not os.access(cli.results_dir, os.W_OK):
-            logger.error('Test results directory is not writable.')
-            sys.exit(-1)
+commands = [
+    ('run', 'Run a series of web page tests.', addRunArguments, runCommand),
+    ('resume', 'Finish tests left pending by an interrupted run.', addResumeArguments, resumeCommand),
+    ('ls', 'List contents of a directory containing test data.', addLsArguments, lsCommand),
+    ('rm', 'Remove a test.', addRmArguments, rmCommand),
+    ('filter', 'Display a subset of the information about the test data.', addFilterArguments, filterCommand),
+    ('list-filters', 'List currently available filters.', addListFiltersArguments, listFiltersCommand),
+    ('index', 'Index the page and request data of every test, or query the index.', addIndexArguments, indexCommand),
+    ('trend', 'Show how a metric has changed across the tests in a directory.', addTrendArguments, trendCommand),
+    ('cache', 'Show or clear the cached filter outputs.', addCacheArguments, cacheCommand),
+    ('compress', 'Compress or decompress the stored data of every test in place.', addCompressArguments, compressCommand),
+    ('dev', 'Developer land.', addDevArguments, devCommand)
+]
 
-        if os.path.isfile( cli.tests ):
-            try:
-                tests = json.loads( open(cli.tests).read() )
-            except Exception as e:
-                logger.error('Unable to load tests file: %s' % (e))
-                sys.exit(-1)
-        else:
-            logger.error('argument to --tests is not a file')
-            sys.exit(-1)
+def Cli():
+
+    ver = sys.version_info
+
+    if ver.major < 2 or (ver.major == 3 and ver.minor < 2) or (ver.major == 2 and ver.minor < 7):
+        print("Python 2.7+ required. %d.%d.%d installed" %(ver.major, ver.minor, ver.micro))
+        sys.exit(-1)
+
+    parser = argparse.ArgumentParser(
+        description = 'BSD Page Load Performance Monitor',
+        epilog = '(c) 2011 Blue State Digital')
 
-        globalParams = None
-        if cli.global_params:
-            if os.path.isfile( cli.global_params ):
-                try:
-                    globalParams = json.loads( open(cli.global_params).read() )
-                except Exception as e:
-                    logger.warning('Unable to load global parameters file: %s' % (e))
-            else:
-                logger.warning('Argument to --global-params is not a file')
-
-        for requestParams in tests:
-            if globalParams:
-                requestParams['params'] = dict(globalParams.items() + requestParams['params'].items())
-            requestParams['params']['url'] = requestParams['url']
-            testFactory = PageLoadTestFactory()
-            directoryFactory = PageLoadTestDirectoryFactory(PageLoadTestResultsFactory())
-            testDirectory = directoryFactory.load( os.path.join(cli.results_dir, requestParams['name']) )
-            pageload = testFactory.create(testDirectory, requestParams['url'], requestParams['params'])
-            results = pageload.run()
-            if results is None:
-                logger.warning('Could not acquire test results')
+    parser.add_argument('-L', '--logging',
+        default='info',
+        help='Turn on debugging output')
+
+    parser.add_argument('--trace',
+        metavar='FILE',
+        help='Record how long each stage of the command takes, and its peak memory, to FILE in Chrome trace event format')
+
+    subparsers = parser.add_subparsers(help='Available actions', dest='sub_command')
+
+    for (name, help, addArguments, command) in commands:
+        subparser = subparsers.add_parser(name, help=help)
+        addArguments(subparser)
+        subparser.set_defaults(command=command)
+
+    cli = parser.parse_args()
+    logger = getLogger(cli.logging)
+
+    logger.debug( 'CLI: %s' % (cli) )
+
+    if 'command' not in cli:
+        parser.print_usage()
+        sys.exit(-1)
+
+    if not cli.trace:
+        cli.command(cli, logger)
+        return
+
+    from pageload import Trace
+    Trace.start()
+    try:
+        with Trace.span(cli.sub_command, 'command'):
+            cli.command(cli, logger)
+    finally:
+        Trace.stop(cli.trace)
@@ -0,0 +1,75 @@
+import csv, json
+
+class Factory:
+    formats = ['text', 'json', 'ndjson', 'csv']
+
+    def create(self, format, fp, columns=None):
+        if format == 'text':
+            return TextWriter(fp)
+        if format == 'json':
+            return JsonWriter(fp)
+        if format == 'ndjson':
+            return NdjsonWriter(fp)
+        if format == 'csv':
+            return CsvWriter(fp, columns)
+        raise ValueError('Unknown output format %s' % (format))
+
+# Writers take one filter result at a time and write it out straight away,
+# flushing after each, so that long outputs can be piped into other tools
+# as they are produced.
+
+# What the text output has always been, one line at a time
+class TextWriter:
+    def __init__(self, fp):
+        self.__dict__.update(locals())
+
+    def write(self, result):
+        for line in result.iterLines():
+            self.fp.write(line + '\n')
+        self.fp.flush()
+
+# What the json output has always been, the bare values of each result
+class JsonWriter:
+    def __init__(self, fp):
+        self.__dict__.update(locals())
+
+    def write(self, result):
+        self.fp.write(result.asJson() + '\n')
+        self.fp.flush()
+
+# One JSON object per result, holding its signature, run, date and values
+class NdjsonWriter:
+    def __init__(self, fp):
+        self.__dict__.update(locals())
+
+    def write(self, result):
+        self.fp.write(json.dumps(result.asRecord(), sort_keys=True) + '\n')
+        self.fp.flush()
+
+# One row per run for aggregate filters and one row per item for normal
+# filters, each prefixed with the result's signature, run and date.  The
+# header is written with the first result; aggregate filters take their
+# columns from its keys, normal filters from the columns given (a single
+# value column by default).
+class CsvWriter:
+    def __init__(self, fp, columns=None):
+        self.__dict__.update(locals())
+        self.writer = csv.writer(fp)
+        self.header = None
+
+    def write(self, result):
+        # Aggregate filters give a FilterResultsDict
+        aggregate = hasattr(result, 'dictionary')
+        if self.header is None:
+            if aggregate:
+                self.columns = sorted(result.dictionary.keys())
+            elif not self.columns:
+                self.columns = ['value']
+            self.header = ['signature', 'run', 'date'] + list(self.columns)
+            self.writer.writerow(self.header)
+
+        prefix = [result.testResult.getSignature(), result.run, result.testResult.getDateTime().strftime('%Y-%m-%dT%H:%M:%S')]
+        rows = result.asRows(self.columns) if aggregate else result.asRows()
+        for row in rows:
+            self.writer.writerow(prefix + row)
+        self.fp.flush()
@@ -1,28 +1,74 @@
 import httplib, urllib
 import StringIO, sys, os, json, logging, shutil
-from xml.etree.ElementTree import ElementTree
-from xml.dom.minidom import parseString as parseXmlString
+from xml.etree.ElementTree import ElementTree, iterparse
 from urlparse import urlparse
-from time import sleep
-from datetime import datetime
+from datetime import datetime, timedelta
 from pageload.PageLoadTestResults import Factory as PageLoadTestResultsFactory
+from pageload.Downloader import Factory as DownloaderFactory, Download
+from pageload.HttpClient import Factory as HttpClientFactory
+from pageload.Compression import dataExists
+from pageload.Poller import TestStatus
+from pageload import Trace
 
 class Factory:
+    def __init__(self, httpClient=None, downloader=None, prettyXml=False, compression=None):
+        self.httpClient = httpClient if httpClient else HttpClientFactory().create()
+        self.downloader = downloader if downloader else DownloaderFactory().create(self.httpClient)
+        self.prettyXml = prettyXml
+        self.compression = compression
     def create(self, testDirectory, url, config):
-        return PageLoadTest(testDirectory, url, config, PageLoadTestResultsFactory())
+        return PageLoadTest(testDirectory, url, config, PageLoadTestResultsFactory(), self.downloader, self.httpClient, self.prettyXml, self.compression)
+    def resume(self, testDirectory, name):
+        events = testDirectory.getJournal().load(name)
+        submitted = [event for event in events if event['event'] == 'submitted']
+        if not len(submitted):
+            return None
+        pageload = self.create(testDirectory, submitted[-1]['url'], submitted[-1]['config'])
+        pageload.attach(name, submitted[-1])
+        return pageload
 
 class PageLoadTestException(Exception):
     pass
 
+# Indents element and its descendants in place, for writing out a readable
+# document.  Text of elements without children is left alone.
+def indentXml(element, level=0):
+    padding = '\n' + level * '  '
+    if len(element):
+        if not element.text or not element.text.strip():
+            element.text = padding + '  '
+        for child in element:
+            indentXml(child, level + 1)
+            if not child.tail or not child.tail.strip():
+                child.tail = padding + '  '
+        if not child.tail or not child.tail.strip():
+            child.tail = padding
+    if level and (not element.tail or not element.tail.strip()):
+        element.tail = padding
+
 class PageLoadTest:
-    def __init__(self, testDirectory, url, config = {}, testResultsFactory = None):
+    def __init__(self, testDirectory, url, config = {}, testResultsFactory = None, downloader = None, httpClient = None, prettyXml = False, compression = None):
         self.__dict__.update(locals())
         self.logger = logging.getLogger('pageload')
+        self.testDir = None
+        self.testId = None
+        self.xmlUrl = None
+        self.downloads = []
         self.defaultHeaders = {
             "Content-type": "application/x-www-form-urlencoded"
         }
 
-    def run(self):
+    # Runs this test on its own, through the same Scheduler that runs many
+    def run(self, pollPolicy=None):
+        from pageload.Scheduler import Factory as SchedulerFactory
+        results = SchedulerFactory().create([self], 1, pollPolicy).run()
+        return results[0] if len(results) else None
+
+    def isSubmitted(self):
+        return self.xmlUrl is not None
+
+    @Trace.traced('test')
+    def submit(self):
         timestamp = datetime.today()
         baseDir = self.testDirectory.getDirectory()
 
@@ -30,158 +76,246 @@ class PageLoadTest:
         if not os.path.isdir(pldir):
             os.makedirs(pldir)
 
+        # Tests submitted back to back can land in the same second
         testDir = os.path.normpath( os.path.join(baseDir, timestamp.strftime('%Y%m%d%H%M%S')) )
-
-        assets = {
-            'parameters.json': os.path.join(testDir, 'parameters.json'),
-            'request.xml': os.path.join(testDir, 'request.xml'),
-            'response.xml': os.path.join(testDir, 'response.xml'),
-            'summary.csv': os.path.join(testDir, 'summary.csv'),
-            'detail.csv': os.path.join(testDir, 'detail.csv'),
-            'run': os.path.join(testDir, 'run')
-        }
+        while os.path.exists(testDir):
+            timestamp += timedelta(seconds=1)
+            testDir = os.path.normpath( os.path.join(baseDir, timestamp.strftime('%Y%m%d%H%M%S')) )
 
         try:
             os.makedirs(testDir)
             self.logger.info('Directory %s created' % (testDir))
         except OSError as error:
-            self.logger.error('Cannot create directory %s: %s' % (testDir, error))
-            sys.exit(-1)
+            raise PageLoadTestException('Cannot create directory %s: %s' % (testDir, error))
+
+        # Journal the directory before anything else, so that discovery
+        # ignores it until the test has been fully downloaded
+        self._setTestDir(testDir)
+        self.testDirectory.getJournal().record(self.name, 'created')
 
         try:
-            os.mkdir( assets['run'] )
-            self.logger.info('Directory %s created' % (assets['run']))
+            os.mkdir( self.assets['run'] )
+            self.logger.info('Directory %s created' % (self.assets['run']))
         except OSError as error:
-            self.logger.error('Cannot create directory ./%s: %s' % (assets['run'], error))
-            sys.exit(-1)
-        
+            raise PageLoadTestException('Cannot create directory ./%s: %s' % (self.assets['run'], error))
+
         testParameters = {
             'url': self.url,
             'config': self.config
         }
 
-        parameters = open( assets['parameters.json'], 'w' )
+        parameters = open( self.assets['parameters.json'], 'w' )
         parameters.write( json.dumps(testParameters, sort_keys=True, indent=4) )
         parameters.close()
 
         (response, data) = self._makeHttpRequest('POST', self.config['wptserver'], '/runtest.php', urllib.urlencode(self.config), self.defaultHeaders)
-        fp = open( assets['request.xml'], 'w' )
+        fp = open( self.assets['request.xml'], 'w' )
         fp.write(data)
         fp.close()
 
         self.logger.debug("Retrieved data\n %s" % data)
-        tree = self._getXmlTree(data)
-        xmlUrl = urlparse(tree.find('data/xmlUrl').text).path
-
-        self.logger.info('Waiting for results')
+        try:
+            self.requestTree = self._getXmlTree(data)
+        except SyntaxError as error:
+            raise PageLoadTestException('Test submission for %s was rejected: %s' % (self.url, error))
+        if self.requestTree.find('data/xmlUrl') is None:
+            raise PageLoadTestException('Test submission for %s was rejected: %s' % (self.url, data))
+
+        self.testId = self.requestTree.findtext('data/testId')
+        self.xmlUrl = urlparse(self.requestTree.find('data/xmlUrl').text).path
+        self.testDirectory.getJournal().record(self.name, 'submitted', url=self.url, config=self.config, testId=self.testId, xmlUrl=self.xmlUrl)
+        self.logger.info('Submitted %s (test %s)' % (self.url, self.testId))
+        return True
+
+    def attach(self, name, submitted):
+        self._setTestDir( os.path.join(self.testDirectory.getDirectory(), name) )
+        if not os.path.isfile( self.assets['request.xml'] ):
+            raise PageLoadTestException('Cannot resume test %s: %s is missing' % (submitted['testId'], self.assets['request.xml']))
+        fp = open( self.assets['request.xml'] )
+        self.requestTree = self._getXmlTree( fp.read() )
+        fp.close()
+        self.testId = submitted['testId']
+        self.xmlUrl = submitted['xmlUrl']
+        self.logger.info('Resuming %s (test %s)' % (self.url, self.testId))
 
-        slept = 0
-        cont = False
-        while True:
-            (response, statusData) = self._makeHttpRequest('GET', self.config['wptserver'], xmlUrl)
+    @Trace.traced('test')
+    def poll(self):
+        try:
+            (response, statusData) = self._makeHttpRequest('GET', self.config['wptserver'], self.xmlUrl)
             statusTree = self._getXmlTree(statusData)
-            statusCode = int(statusTree.find('statusCode').text)
-            if 100 <= statusCode < 200:
-                sleep(10)
-                slept += 10
-                if slept > 900:
-                    self.logger.error('Timed out waiting for response (900 seconds)')
-                    cont = True
-                    break
-                continue
-            elif 400 <= statusCode < 500:
-                self.logger.error('Could not retrieve response (HTTP status code %d)' % (statusCode))
-                cont = True
-                break
-            break
-
-        if cont:
-            shutil.rmtree(testDir)
-            return None
+            return TestStatus(
+                int(statusTree.find('statusCode').text),
+                statusTree.findtext('statusText', ''),
+                self._findInt(statusTree, ['data/behindCount', 'behindCount']),
+                self._findInt(statusTree, ['data/testsCompleted', 'testsCompleted']),
+                self._findInt(statusTree, ['data/testsExpected', 'testsExpected']))
+        except (IOError, httplib.HTTPException, SyntaxError, AttributeError, ValueError) as error:
+            raise PageLoadTestException('Could not get status of test %s: %s' % (self.testId, error))
+
+    def abort(self):
+        if self.testDir and os.path.isdir(self.testDir):
+            shutil.rmtree(self.testDir)
+        if self.testDir:
+            self.testDirectory.getJournal().remove(self.name)
+
+    @Trace.traced('test')
+    def finish(self, result):
+        self.testDirectory.addResult( result )
+        self.testDirectory.getJournal().remove(self.name)
+
+    @Trace.traced('test')
+    def fetchResults(self):
+        tree = self.requestTree
+        assets = self.assets
 
         self.logger.info('Results finished processing')
         self.logger.info('Downloading reports')
 
-        (response, data) = self._makeHttpRequest('GET', self.config['wptserver'], urlparse(tree.find('data/xmlUrl').text).path)
-        resultTree = self._getXmlTree(data)
-        tData = data
-
-        fp = open( assets['response.xml'], 'w' )
-        fp.write( parseXmlString(data).toprettyxml() )
-        fp.close()
-
+        # The reports are fetched with the same retries as the run data.  The
+        # test is done on WPT, so if they still can't be had it is left
+        # journaled for resume rather than thrown away.
+        reports = []
+        if not os.path.isfile( assets['response.xml'] ):
+            reports.append( Download(self._getUrl(self.config['wptserver'], self.xmlUrl), assets['response.xml']) )
         for asset, xmlElement in {'summary.csv': 'data/summaryCSV', 'detail.csv': 'data/detailCSV'}.items():
-            urlParts = urlparse( tree.find( xmlElement ).text )
-            (response, data) = self._makeHttpRequest('GET', self.config['wptserver'], urlParts.path)
-            fp = open( assets[asset], 'w' )
-            fp.write( data )
-            fp.close()
+            if dataExists( assets[asset] ):
+                continue
+            urlParts = urlparse( tree.findtext( xmlElement, '' ) )
+            reports.append( Download(self._getUrl(self.config['wptserver'], urlParts.path), assets[asset], self.compression) )
+
+        failed = [download for download in self.downloader.downloadAll(reports) if not download.succeeded()]
+        if len(failed):
+            raise PageLoadTestException('Could not download %s for test %s: %s' % (
+                ', '.join([os.path.basename(download.localPath) for download in failed]), self.testId, failed[0].error))
+        if self.prettyXml and len(reports) and reports[0].localPath == assets['response.xml']:
+            self._prettyPrint( assets['response.xml'] )
 
         images = ['waterfall', 'checklist', 'screenShot']
         rawData = ['headers', 'pageData', 'requestsData', 'utilization', 'PageSpeedData']
 
         self.logger.info('Downloading run data')
 
-        for run in resultTree.findall('data/run'):
-
-            id = run.find('id').text
-            runDir = os.path.join(assets['run'], id)
-
-            try:
-                os.mkdir(runDir)
-                self.logger.info('Directory %s created' % (runDir))
-            except OSError as error:
-                self.logger.error('Cannot create directory ./%s: %s' % (runDir, error))
-                sys.exit(-1)
-
-            for view in [run.find('firstView'), run.find('repeatView')]:
+        downloads = []
+        try:
+            for run in self._iterRuns( assets['response.xml'] ):
 
-                if view is None:
-                    self.logger.error('Malformed response from server:')
-                    self.logger.error(tData)
+                id = run.findtext('id', '').strip()
+                if not id.isdigit():
+                    self.logger.error('Malformed response from server: a run in %s has no id' % (assets['response.xml']))
                     continue
+                runDir = os.path.join(assets['run'], id)
+
+                self._makeDirectory(runDir)
+
+                for view in [run.find('firstView'), run.find('repeatView')]:
+
+                    if view is None:
+                        self.logger.error('Malformed response from server: run %s in %s has no firstView or repeatView' % (id, assets['response.xml']))
+                        continue
+
+                    viewDir = os.path.join(runDir, view.tag)
+                    imageDir = os.path.join(viewDir, 'images')
+                    dataDir = os.path.join(viewDir, 'data')
+
+                    for Dir in [viewDir, imageDir, dataDir]:
+                        self._makeDirectory(Dir)
+
+                    for imageName in images:
+                        imageUrl = view.findtext('images/' + imageName, '').strip()
+                        if not imageUrl:
+                            self.logger.error('Malformed response from server: run %s in %s has no %s image' % (id, assets['response.xml'], imageName))
+                            continue
+                        localFileName = os.path.join(imageDir, imageName + '.' + imageUrl[-3:])
+                        if not os.path.isfile(localFileName):
+                            downloads.append( Download(imageUrl, localFileName) )
+
+                    for rawDataName in rawData:
+                        rawDataUrl = view.findtext('rawData/' + rawDataName, '').strip()
+                        if not rawDataUrl:
+                            self.logger.error('Malformed response from server: run %s in %s has no %s' % (id, assets['response.xml'], rawDataName))
+                            continue
+                        localFileName = os.path.join(dataDir, rawDataName)
+                        if not dataExists(localFileName):
+                            downloads.append( Download(rawDataUrl, localFileName, self.compression) )
+        except SyntaxError as error:
+            # Fetched again by resume
+            os.remove( assets['response.xml'] )
+            raise PageLoadTestException('Malformed response from server in %s: %s' % (assets['response.xml'], error))
+
+        self.downloads = self.downloader.downloadAll(downloads)
+        return self.testResultsFactory.create( self.testDir )
+
+    def _setTestDir(self, testDir):
+        self.testDir = testDir
+        self.name = os.path.basename(testDir)
+        self.assets = {
+            'parameters.json': os.path.join(testDir, 'parameters.json'),
+            'request.xml': os.path.join(testDir, 'request.xml'),
+            'response.xml': os.path.join(testDir, 'response.xml'),
+            'summary.csv': os.path.join(testDir, 'summary.csv'),
+            'detail.csv': os.path.join(testDir, 'detail.csv'),
+            'run': os.path.join(testDir, 'run')
+        }
 
-                viewDir = os.path.join(runDir, view.tag)
-                imageDir = os.path.join(viewDir, 'images')
-                dataDir = os.path.join(viewDir, 'data')
-
-                for Dir in [viewDir, imageDir, dataDir]:
-                    try:
-                        os.mkdir( Dir )
-                        self.logger.info('Directory %s created' % ( Dir ))
-                    except OSError as error:
-                        self.logger.error('Cannot create directory ./%s: %s' % ( Dir, error ))
-                        sys.exit(-1)
-
-                for imageName in images:
-                    imageUrl = view.find('images/' + imageName).text
-                    localFileName = os.path.join(imageDir, imageName + '.' + imageUrl[-3:])
-                    self._downloadFile(imageUrl, localFileName)
-
-                for rawDataName in rawData:
-                    rawDataUrl = view.find('rawData/' + rawDataName).text
-                    localFileName = os.path.join(dataDir, rawDataName)
-                    self._downloadFile(rawDataUrl, localFileName)
-        result = self.testResultsFactory.create( testDir )
-        self.testDirectory.addResult( result )
-        return result
+    def _makeDirectory(self, path):
+        if os.path.isdir(path):
+            return
+        try:
+            os.mkdir( path )
+            self.logger.info('Directory %s created' % ( path ))
+        except OSError as error:
+            raise PageLoadTestException('Cannot create directory ./%s: %s' % ( path, error ))
 
+    # Rewritten under a temporary name, so the file is always complete
+    @Trace.traced('test', 'path')
+    def _prettyPrint(self, path):
+        try:
+            tree = ElementTree()
+            tree.parse(path)
+        except SyntaxError as error:
+            os.remove(path)
+            raise PageLoadTestException('Malformed response from server in %s: %s' % (path, error))
+        indentXml(tree.getroot())
+        tree.write(path + '.part', encoding='utf-8', xml_declaration=True)
+        os.rename(path + '.part', path)
+
+    def _getUrl(self, host, path):
+        return host.rstrip('/') + path if '://' in host else 'http://%s%s' % (host, path)
+
+    # Failed requests and error responses end the test rather than the run
     def _makeHttpRequest(self, method, host, path, params='', headers={}):
-        httpConnection = httplib.HTTPConnection(host)
-        httpConnection.request(method, path, params, headers)
-        response = httpConnection.getresponse()
-        data = response.read()
+        url = self._getUrl(host, path)
+        with Trace.span('HTTP %s' % (method.upper()), 'http', {'url': url}) as args:
+            try:
+                (response, data) = self.httpClient.request(method, url, params, headers)
+            except (IOError, httplib.HTTPException) as error:
+                raise PageLoadTestException('%s %s failed: %s' % (method.upper(), url, error))
+            args.update({'status': response.status, 'bytes': len(data)})
         self.logger.info('%s %s %s (HTTP %s %s)' % (method.upper(), host, path, response.status, response.reason))
-        httpConnection.close()
+        if response.status != 200:
+            raise PageLoadTestException('%s %s failed: HTTP %s %s' % (method.upper(), url, response.status, response.reason))
         return (response, data)
 
-    def _downloadFile(self, url, localPath):
-        try:
-            self.logger.info('Downloading %s' % (url))
-            value = urllib.urlretrieve(url, localPath)
-            return value
-        except IOError:
-            self.logger.error('Could not download %s' % (url))
+    def _findInt(self, tree, paths):
+        for path in paths:
+            value = tree.findtext(path)
+            if value is not None and value.strip().isdigit():
+                return int(value)
+        return None
+
+    # Yields each data/run element of a response document as soon as it has
+    # been read, and clears it once the caller moves on, so only one run is
+    # held in memory at a time
+    def _iterRuns(self, path):
+        tags = []
+        for (event, element) in iterparse(path, ('start', 'end')):
+            if event == 'start':
+                tags.append(element.tag)
+                continue
+            if tags[1:] == ['data', 'run']:
+                yield element
+                element.clear()
+            tags.pop()
 
     def _getXmlTree( self, xmlString ):
         dataIO = StringIO.StringIO(xmlString)
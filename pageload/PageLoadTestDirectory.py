@@ -1,24 +1,76 @@
-import os, json
+import os, json, shutil, logging
+from bisect import bisect_left
 from datetime import datetime
+from pageload.Journal import Factory as JournalFactory
+from pageload.TimeSeries import Factory as TimeSeriesFactory
 
 class TestDirectoryInvalidError(Exception):
     pass
 
+class AmbiguousHashError(Exception):
+    pass
+
 class Factory:
     def __init__(self, testResultsFactory):
         self.__dict__.update(locals())
+        self.logger = logging.getLogger('pageload')
 
+    # The manifest indexes each result by its timestamp directory.  An entry
+    # is trusted as long as request.xml has the same size and modification
+    # time it had when the entry was written, so only new or changed results
+    # need to be read and hashed.
     def _load(self, testsDir):
         results = []
+        manifest = self._readManifest(testsDir)
+        journal = JournalFactory().create(testsDir)
+        stale = False
         for resultDir in sorted(os.listdir(testsDir)):
             try:
                 date = datetime.strptime( resultDir, '%Y%m%d%H%M%S' )
             except ValueError:
                 continue
+            if journal.isPending(resultDir):
+                continue
             path = os.path.join(testsDir, resultDir)
-            if os.path.isfile( os.path.join(path, 'request.xml') ):
-                results.append( self.testResultsFactory.create(path))
-        return results
+            try:
+                stat = os.stat( os.path.join(path, 'request.xml') )
+            except OSError:
+                continue
+            entry = manifest.pop(resultDir, None)
+            if entry and entry.get('mtime') == stat.st_mtime and entry.get('size') == stat.st_size:
+                results.append( self.testResultsFactory.create(path, entry['signature'], entry.get('runIds')) )
+                # Manifests written before run ids were recorded only had a count
+                stale = stale or 'runIds' not in entry
+            else:
+                results.append( self.testResultsFactory.create(path) )
+                stale = True
+        return (results, stale or len(manifest) > 0)
+
+    def _readManifest(self, testsDir):
+        try:
+            fp = open( os.path.join(testsDir, '.pageload', 'manifest') )
+            contents = json.loads( fp.read() )
+            fp.close()
+        except (IOError, ValueError):
+            return {}
+
+        manifest = dict()
+        for sig, entry in contents.items():
+            # Older manifests only recorded the timestamp, so they can't be validated
+            if isinstance(entry, dict) and 'timestamp' in entry:
+                entry['signature'] = sig
+                manifest[ entry['timestamp'] ] = entry
+        return manifest
+
+    def _create(self, testsDir):
+        (results, stale) = self._load(testsDir)
+        directory = PageLoadTestDirectory(testsDir, results)
+        if stale:
+            try:
+                directory.writeManifest()
+            except IOError as error:
+                self.logger.debug('Could not update manifest for %s: %s' % (testsDir, error))
+        return directory
 
     def load(self, testsDir):
         if not os.path.isdir(testsDir):
@@ -26,8 +78,8 @@ class Factory:
 
         if not os.path.isdir( os.path.join(testsDir, '.pageload') ):
             os.makedirs(os.path.join(testsDir, '.pageload'))
-            
-        return PageLoadTestDirectory(testsDir, self._load(testsDir))
+
+        return self._create(testsDir)
 
     def discover(self, baseDir):
         if not os.path.isdir( baseDir ):
@@ -38,22 +90,75 @@ class Factory:
         for name in os.listdir( baseDir ):
             testsDir = os.path.join(baseDir, name)
             if os.path.isdir(testsDir) and os.path.isdir( os.path.join(testsDir, '.pageload') ):
-                results = self._load(testsDir)
-                directories.append( PageLoadTestDirectory(testsDir, results) )
+                directories.append( self._create(testsDir) )
         return directories
 
 class PageLoadTestDirectory:
     def __init__(self, directory, results):
         self.__dict__.update(locals())
+        self.journal = JournalFactory().create(directory)
+        self.timeSeries = TimeSeriesFactory().create(directory)
+        self.index = None
+        self.logger = logging.getLogger('pageload')
     def getTestResults(self):
         return self.results
     def getDirectory(self):
         return self.directory
     def getName(self):
         return os.path.basename(self.directory)
+    def getJournal(self):
+        return self.journal
+    def getTimeSeries(self):
+        return self.timeSeries
+    def discardPending(self, name):
+        path = os.path.join(self.directory, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        self.journal.remove(name)
     def addResult(self, result):
         self.results.append( result )
+        self.index = None
+        self.writeManifest()
+        try:
+            self.timeSeries.append( result )
+        except (IOError, OSError, KeyError, ValueError) as error:
+            self.logger.warning('Could not add %s to the time series: %s' % (result.getSignature()[:8], error))
+        index = self._findIndex()
+        if index is not None:
+            # Already loaded by Index
+            from sqlite3 import Error as SqliteError
+            try:
+                index.add(self.getName(), result)
+            except (IOError, OSError, IndexError, KeyError, ValueError, StopIteration, SqliteError) as error:
+                self.logger.warning('Could not add %s to the index: %s' % (result.getSignature()[:8], str(error) or error.__class__.__name__))
+            finally:
+                index.close()
+    def removeResult(self, result):
+        result.remove()
+        self.results.remove( result )
+        self.index = None
         self.writeManifest()
+        self.timeSeries.remove( result.getSignature() )
+        index = self._findIndex()
+        if index is not None:
+            from sqlite3 import Error as SqliteError
+            try:
+                index.remove( result.getSignature() )
+            except SqliteError as error:
+                self.logger.warning('Could not remove %s from the index: %s' % (result.getSignature()[:8], error))
+            finally:
+                index.close()
+    # The index of the base directory, if there is one.  Index is only
+    # imported when results are added or removed.  None if it can't be
+    # opened either.
+    def _findIndex(self):
+        from pageload.Index import Factory as IndexFactory
+        from sqlite3 import Error as SqliteError
+        try:
+            return IndexFactory().find(self.directory)
+        except SqliteError as error:
+            self.logger.warning('Could not open the index for %s: %s' % (self.directory, error))
+            return None
     def getManifest(self):
         manifest = dict()
         for result in self.results:
@@ -62,15 +167,52 @@ class PageLoadTestDirectory:
     def writeManifest(self):
         path = os.path.join(self.directory, '.pageload')
         path = os.path.join(path, 'manifest')
-        manifest = self.getManifest()
-        for sig, result in manifest.items():
-            manifest[sig] = result.getDateTime().strftime('%Y%m%d%H%M%S')
-        fp = open(path, 'w')
-        fp.write( json.dumps(manifest, indent=4) )
+        manifest = dict()
+        for sig, result in self.getManifest().items():
+            try:
+                stat = os.stat( os.path.join(result.testDir, 'request.xml') )
+                runIds = result.getRunIds()
+            except OSError:
+                continue
+            manifest[sig] = {
+                'timestamp': result.getDateTime().strftime('%Y%m%d%H%M%S'),
+                'runIds': runIds,
+                'mtime': stat.st_mtime,
+                'size': stat.st_size
+            }
+        fp = open(path + '.tmp', 'w')
+        fp.write( json.dumps(manifest, indent=4, sort_keys=True) )
         fp.close()
+        os.rename(path + '.tmp', path)
     def getTestResultByHash(self, hash):
-        manifest = self.getManifest()
-        for sig, result in manifest.items():
-            if sig.lower().startswith(hash.lower()):
-                return result
-        return None
+        if self.index is None:
+            self.index = ResultIndex([self])
+        found = self.index.find(hash)
+        return found[1] if found else None
+
+# Signatures of every result in a set of directories, kept sorted so that a
+# hash prefix can be found with a binary search
+class ResultIndex:
+    def __init__(self, directories):
+        entries = []
+        for directory in directories:
+            for result in directory.getTestResults():
+                entries.append( (result.getSignature().lower(), directory, result) )
+        entries.sort(key=lambda entry: entry[0])
+        self.signatures = [entry[0] for entry in entries]
+        self.entries = entries
+
+    def find(self, prefix):
+        prefix = prefix.lower()
+        matches = []
+        index = bisect_left(self.signatures, prefix)
+        while index < len(self.signatures) and self.signatures[index].startswith(prefix):
+            matches.append( self.entries[index] )
+            index += 1
+
+        if not len(matches):
+            return None
+        signatures = sorted(set([match[0] for match in matches]))
+        if len(signatures) > 1:
+            raise AmbiguousHashError('Hash %s is ambiguous, it matches %s' % (prefix, ', '.join([sig[:12] for sig in signatures])))
+        return (matches[0][1], matches[0][2])
@@ -1,37 +1,78 @@
 import csv, os, json, re, hashlib, shutil
 from itertools import izip
 from datetime import datetime
+from pageload.ColumnCache import Factory as ColumnCacheFactory
+from pageload.Compression import openData
+from pageload.Trace import traced
+
+# Any method that this decorator caches its return value so subsequent calls are faster
+def cached(key):
+    def wrapper(func):
+        def cachedResults(*args, **kwargs):
+            self = args[0]
+            if key in self._cache:
+                return self._cache[key]
+
+            result = func(*args, **kwargs)
+            self._cache[key] = result
+            return result
+        return cachedResults
+    return wrapper
+
+# Numbers in the WPT tables are converted once, when the table is parsed
+def typedValue(value):
+    if value and value[0] in '-0123456789.':
+        try:
+            return int(value)
+        except ValueError:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    return value
 
 class Factory:
-    def create(self, testDir):
-        assetFactory = AssetFactory()
+    def __init__(self, useColumnCache=True, index=None):
+        self.columnCache = ColumnCacheFactory().create() if useColumnCache else None
+        self.index = index
+    def create(self, testDir, signature=None, runIds=None):
+        if signature is None:
+            signature = self._generateSignature(testDir)
+        if self.index is not None:
+            assetFactory = IndexedAssetFactory(self.index, signature, self.columnCache)
+        else:
+            assetFactory = AssetFactory(self.columnCache)
         runFactory = RunFactory(ViewFactory(assetFactory))
-        return PageLoadTestResults(self._generateSignature(testDir), testDir, assetFactory, runFactory)
+        return PageLoadTestResults(signature, testDir, assetFactory, runFactory, runIds)
     def _generateSignature(self, testDir):
         fp = open( os.path.join(testDir, 'request.xml') )
         contents = fp.read()
         fp.close()
         return hashlib.md5(contents).hexdigest()
 
+# Views are only created when they are first asked for
 class Run:
-    def __init__(self, firstView, repeatView):
+    def __init__(self, runId, runDir, viewFactory):
         self.__dict__.update(locals())
+        self._cache = {}
+    def getId(self):
+        return self.runId
+    @cached('first_view')
     def getFirstView(self):
-        return self.firstView
+        return self.viewFactory.create( os.path.join(self.runDir, 'firstView') )
+    @cached('repeat_view')
     def getRepeatView(self):
-        return self.repeatView
+        return self.viewFactory.create( os.path.join(self.runDir, 'repeatView') )
     def __str__(self):
-        return str(self.firstView.getHeaders())
+        return str(self.getFirstView().getHeaders())
 
 class RunFactory:
     def __init__(self, viewFactory):
         self.__dict__.update(locals())
     def create(self, runDir):
-        firstView = self.viewFactory.create( os.path.join(runDir, 'firstView') )
-        repeatView = self.viewFactory.create( os.path.join(runDir, 'repeatView') )
-        return Run(firstView, repeatView)
+        return Run(int(os.path.basename(runDir)), runDir, self.viewFactory)
 
-class Asset:
+class Asset(object):
     pass
 
 class DictionaryAsset(Asset):
@@ -61,22 +102,98 @@ class DictionaryAsset(Asset):
 class ListAsset(DictionaryAsset):
     pass
 
+# Column names shared by every row of a table, and their positions
+class Columns(object):
+    __slots__ = ('names', 'positions')
+    def __init__(self, names):
+        self.names = list(names)
+        self.positions = dict([(name, position) for (position, name) in enumerate(self.names)])
+    def __len__(self):
+        return len(self.names)
+
+# One row of a table.  Rows only hold a tuple of values and share a Columns
+# object with the rest of their table, but still read like a dictionary
+class RowAsset(Asset):
+    __slots__ = ('columns', 'row')
+    def __init__(self, columns, row):
+        self.columns = columns
+        self.row = row
+    def __len__(self):
+        return len(self.row)
+    def __getitem__(self, key):
+        try:
+            return self.row[self.columns.positions[key]]
+        except IndexError:
+            raise KeyError(key)
+    def __setitem__(self, key, value):
+        row = list(self.row)
+        row[self.columns.positions[key]] = value
+        self.row = tuple(row)
+    def __iter__(self):
+        return iter(self.columns.names[:len(self.row)])
+    def __reversed__(self):
+        return reversed(self.columns.names[:len(self.row)])
+    def __contains__(self, key):
+        return self.columns.positions.get(key, len(self.row)) < len(self.row)
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    def keys(self):
+        return list(self)
+    def items(self):
+        return list(izip(self.columns.names, self.row))
+    @property
+    def dictionary(self):
+        return dict(self.items())
+    def __str__(self):
+        return json.dumps(self.dictionary, indent=4)
+    def __repr__(self):
+        return repr(self.dictionary)
+
 ###
 # These assets for each Run's View objects
 ###
 
-class PageData(DictionaryAsset):
-    pass
+class PageData(RowAsset):
+    __slots__ = ()
 
-class RequestData(DictionaryAsset):
-    pass
+class RequestData(RowAsset):
+    __slots__ = ()
 
-class Utilization(DictionaryAsset):
-    pass
+class Utilization(RowAsset):
+    __slots__ = ()
 
 class PageSpeedData(ListAsset):
     pass
 
+# Header names are matched case-insensitively; repeated headers are joined
+# with commas as RFC 2616 allows
+class HeaderMap(DictionaryAsset):
+    def __init__(self, lines):
+        self.dictionary = dict()
+        for line in lines:
+            (name, separator, value) = line.partition(':')
+            if not separator:
+                continue
+            key = name.strip().lower()
+            value = value.strip()
+            if key in self.dictionary:
+                self.dictionary[key] += ', ' + value
+            else:
+                self.dictionary[key] = value
+    def __getitem__(self, key):
+        return self.dictionary[key.lower()]
+    def __setitem__(self, key, value):
+        self.dictionary[key.lower()] = value
+    def __delitem__(self, key):
+        del self.dictionary[key.lower()]
+    def __contains__(self, key):
+        return key.lower() in self.dictionary
+    def get(self, key, default=None):
+        return self.dictionary.get(key.lower(), default)
+
 class Headers(Asset):
     def __init__(self, requestHeaders, responseHeaders):
         self.__dict__.update(locals())
@@ -84,6 +201,11 @@ class Headers(Asset):
         return self.requestHeaders
     def getResponseHeaders(self):
         return self.responseHeaders
+    # The first line is the request line or status line, not a header
+    def getRequestHeaderMap(self):
+        return HeaderMap(self.requestHeaders[1:])
+    def getResponseHeaderMap(self):
+        return HeaderMap(self.responseHeaders[1:])
     def __str__(self):
         return json.dumps({'request': self.requestHeaders, 'response': self.responseHeaders}, indent=4)
 
@@ -91,140 +213,178 @@ class Headers(Asset):
 # These are top level assets
 ###
 
-class RequestDetails(DictionaryAsset):
-    pass
+class RequestDetails(RowAsset):
+    __slots__ = ()
 
-class RequestSummary(DictionaryAsset):
-    pass
+class RequestSummary(RowAsset):
+    __slots__ = ()
 
+# Data files are read through Compression.openData, so they may be stored
+# compressed
 class AssetFactory:
+    requestPattern = re.compile('Request \d+:')
+
+    def __init__(self, columnCache=None):
+        self.columnCache = columnCache
+
+    @traced('parse', 'path')
     def createPageSpeedData(self, pageSpeedDataFile):
-        fp = open(pageSpeedDataFile)
+        fp = openData(pageSpeedDataFile)
         contents = fp.read()
         fp.close()
         obj = json.loads(contents)
         return PageSpeedData(obj)
 
+    @traced('parse', 'path')
     def createPageData(self, pageDataCsv):
-        csvReader = csv.reader(open(pageDataCsv, 'rb'), delimiter='\t')
-        header = next(csvReader)
-        body = next(csvReader)
-        return PageData(dict(izip(header, body)))
+        return self._readTable(pageDataCsv, PageData, delimiter='\t')[0]
 
+    @traced('parse', 'path')
     def createRequestsData(self, requestsDataCsvFile):
-        csvReader = csv.reader(open(requestsDataCsvFile, 'rb'), delimiter='\t')
-        header = next(csvReader)
-        requests = []
-        for row in csvReader:
-            requests.append( RequestData(dict(izip(header, row))) )
-        return requests
+        return self._readTable(requestsDataCsvFile, RequestData, delimiter='\t')
 
+    @traced('parse', 'path')
     def createUtilization(self, utilizationCsv):
-        csvReader = csv.reader(open(utilizationCsv, 'rb'), delimiter=',')
-        header = next(csvReader)
-        utilization = []
-        for row in csvReader:
-            utilization.append( Utilization(dict(izip(header, row))) )
-        return utilization
+        return self._readTable(utilizationCsv, Utilization, delimiter=',')
 
+    @traced('parse', 'path')
     def createRequestDetails(self, detailsCsvFile):
-        requestCsvReader = csv.reader(open(detailsCsvFile, 'rb'), delimiter=',', quotechar='"')
-        header = next(requestCsvReader)
-        requests = []
-        for row in requestCsvReader:
-            requests.append( RequestDetails(dict(izip(header, row))) )
-        return requests
+        return self._readTable(detailsCsvFile, RequestDetails, delimiter=',', quotechar='"')
 
+    @traced('parse', 'path')
     def createRequestSummary(self, summaryCsvFile):
-        requestCsvReader = csv.reader(open(summaryCsvFile, 'rb'), delimiter=',', quotechar='"')
-        header = next(requestCsvReader)
-        requests = []
-        for row in requestCsvReader:
-            requests.append( RequestSummary(dict(izip(header, row))) )
-        return requests
+        return self._readTable(summaryCsvFile, RequestSummary, delimiter=',', quotechar='"')
+
+    # Rows are parsed as they are read and nothing is kept, so scanning a file
+    # of any size takes constant memory
+    def iterRequestDetails(self, detailsCsvFile):
+        return self._iterTable(detailsCsvFile, RequestDetails, delimiter=',', quotechar='"')
+
+    def iterRequestSummary(self, summaryCsvFile):
+        return self._iterTable(summaryCsvFile, RequestSummary, delimiter=',', quotechar='"')
+
+    def _iterTable(self, path, rowClass, **dialect):
+        fp = openData(path)
+        try:
+            csvReader = csv.reader(fp, **dialect)
+            columns = Columns(next(csvReader))
+            width = len(columns)
+            for row in csvReader:
+                yield rowClass(columns, tuple(map(typedValue, row[:width])))
+        finally:
+            fp.close()
+
+    def _readTable(self, path, rowClass, **dialect):
+        if self.columnCache:
+            table = self.columnCache.load(path)
+            if table is not None:
+                columns = Columns(table[0])
+                return [rowClass(columns, row) for row in table[1]]
+
+        fp = openData(path)
+        csvReader = csv.reader(fp, **dialect)
+        columns = Columns(next(csvReader))
+        width = len(columns)
+        rows = [tuple(map(typedValue, row[:width])) for row in csvReader]
+        fp.close()
+
+        if self.columnCache:
+            self.columnCache.store(path, columns.names, rows)
+        return [rowClass(columns, row) for row in rows]
 
+    # Single pass over the file: header lines are collected into the
+    # request or response list of the current request as they are read
+    @traced('parse', 'path')
     def createHeaders(self, headersFile):
-        headerFileLines = open( headersFile ).readlines() 
-        for index, line in enumerate(headerFileLines):
-            if line.startswith('Request details'):
-                break
-
-        headerFileLines = headerFileLines[index + 1:]
-        headerFileLines = list(map(lambda x: x.strip(), headerFileLines))
-        headerFileLines = list(filter(lambda x: len(x), headerFileLines))
-        headerFileLines.append('EOT')
-
-        buf = '['
-        while len(headerFileLines):
-            (advance, string) = self._jsonifyHeaders(headerFileLines[0], headerFileLines)
-            headerFileLines = headerFileLines[advance:]
-            buf += string
-        buf = buf.replace(',]', ']')
-        buf += ']'
-        headers = json.loads(buf)
-        return list(map(lambda x: Headers(x['request'], x['response']), headers))
-
-    def _jsonifyHeaders(self, line, lines):
-        advance = 1
-        if re.match('Request 1:', line):
-            string = '{'
-            advance = lines.index('Request Headers:')
-        elif re.match('Request (\d+):', line):
-            string = ']},{'
-            advance = lines.index('Request Headers:')
-        elif re.match('EOT', line):
-            string = ']}'
-        elif re.match('Request Headers:', line):
-            string = '"request": ['
-        elif re.match('Response Headers:', line):
-            string = '], "response": ['
-        else:
-            string = '"%s",' % (line.replace('"', '\\"'))
-        return (advance, string)
+        headers = []
+        requestHeaders = None
+        responseHeaders = None
+        current = None
+        started = False
+
+        fp = openData( headersFile )
+        for line in fp:
+            line = line.strip()
+            if not started:
+                started = line.startswith('Request details')
+                continue
+            if not len(line):
+                continue
+
+            if self.requestPattern.match(line):
+                if requestHeaders is not None:
+                    headers.append( Headers(requestHeaders, responseHeaders) )
+                requestHeaders = []
+                responseHeaders = []
+                current = None
+            elif line.startswith('Request Headers:'):
+                current = requestHeaders
+            elif line.startswith('Response Headers:'):
+                current = responseHeaders
+            elif current is not None:
+                current.append(line)
+        fp.close()
+
+        if requestHeaders is not None:
+            headers.append( Headers(requestHeaders, responseHeaders) )
+        return headers
+
+# Reads pageData and requestsData from the index instead of the run's files,
+# falling back to the files for runs the index doesn't have
+class IndexedAssetFactory(AssetFactory):
+    def __init__(self, index, signature, columnCache=None):
+        AssetFactory.__init__(self, columnCache)
+        self.index = index
+        self.signature = signature
+
+    @traced('index', 'path')
+    def createPageData(self, pageDataFile):
+        row = self.index.getPageData(self.signature, *self._locate(pageDataFile))
+        return row if row is not None else AssetFactory.createPageData(self, pageDataFile)
+
+    @traced('index', 'path')
+    def createRequestsData(self, requestsDataFile):
+        rows = self.index.getRequestData(self.signature, *self._locate(requestsDataFile))
+        return rows if len(rows) else AssetFactory.createRequestsData(self, requestsDataFile)
+
+    # Data files are at <testDir>/run/<run>/<view>/data/<name>
+    def _locate(self, path):
+        (viewDir, data) = os.path.split(os.path.dirname(path))
+        (runDir, view) = os.path.split(viewDir)
+        return (int(os.path.basename(runDir)), view)
 
 class View:
-    def __init__(self, headers, pageData, pageSpeedData, requestData, utilizationData):
+    def __init__(self, viewDir, assetFactory):
         self.__dict__.update(locals())
+        self._cache = {}
+    @cached('headers')
     def getHeaders(self):
-        return self.headers
+        return self.assetFactory.createHeaders(os.path.join(self.viewDir, 'data/headers'))
+    @cached('page_data')
     def getPageData(self):
-        return self.pageData
+        return self.assetFactory.createPageData(os.path.join(self.viewDir, 'data/pageData'))
+    @cached('page_speed_data')
     def getPageSpeedData(self):
-        return self.pageSpeedData
+        return self.assetFactory.createPageSpeedData(os.path.join(self.viewDir, 'data/PageSpeedData'))
+    @cached('request_data')
     def getRequestData(self):
-        return self.requestData
+        return self.assetFactory.createRequestsData(os.path.join(self.viewDir, 'data/requestsData'))
+    @cached('utilization_data')
     def getUtilizationData(self):
-        return self.utilizationData
+        return self.assetFactory.createUtilization(os.path.join(self.viewDir, 'data/utilization'))
 
 class ViewFactory:
     def __init__(self, viewAssetFactory):
         self.__dict__.update(locals())
     def create(self, viewDir):
-        headers = self.viewAssetFactory.createHeaders(os.path.join(viewDir, 'data/headers'))
-        pageData = self.viewAssetFactory.createPageData(os.path.join(viewDir, 'data/pageData'))
-        pageSpeedData = self.viewAssetFactory.createPageSpeedData(os.path.join(viewDir, 'data/PageSpeedData'))
-        requestData = self.viewAssetFactory.createRequestsData(os.path.join(viewDir, 'data/requestsData'))
-        utilizationData = self.viewAssetFactory.createUtilization(os.path.join(viewDir, 'data/utilization'))
-        return View( headers, pageData, pageSpeedData, requestData, utilizationData )
+        return View( viewDir, self.viewAssetFactory )
 
 class PageLoadTestResults:
-    def __init__(self, md5signature, testDir, assetFactory, runFactory):
+    # runIds, if known (from the manifest), saves listing the run directory
+    def __init__(self, md5signature, testDir, assetFactory, runFactory, runIds=None):
         self.__dict__.update(locals())
         self._cache = {}
-
-    # Any method that this decorator caches its return value so subsequent calls are faster
-    def cached(key):
-        def wrapper(func):
-            def cachedResults(*args, **kwargs):
-                self = args[0]
-                if key in self._cache and self._cache[key]:
-                    return self._cache[key]
-
-                result = func(*args, **kwargs)
-                self._cache[key] = result
-                return result
-            return cachedResults
-        return wrapper
+        self._runs = {}
 
     @cached('request_details')
     def getRequestDetails(self):
@@ -234,16 +394,32 @@ class PageLoadTestResults:
     def getRequestSummary(self):
         return self.assetFactory.createRequestSummary(os.path.join(self.testDir, 'summary.csv'))
 
-    @cached('runs')
+    def iterRequestDetails(self):
+        return self.assetFactory.iterRequestDetails(os.path.join(self.testDir, 'detail.csv'))
+
+    def iterRequestSummary(self):
+        return self.assetFactory.iterRequestSummary(os.path.join(self.testDir, 'summary.csv'))
+
+    # Run directories are named after the WPT run number, and runs that
+    # couldn't be downloaded have none, so the ids can have gaps
+    def getRunIds(self):
+        if self.runIds is None:
+            runDir = os.path.join(self.testDir, 'run')
+            self.runIds = sorted([int(name) for name in os.listdir(runDir) if name.isdigit()])
+        return self.runIds
+
+    def getRun(self, runId):
+        if runId not in self._runs:
+            if runId not in self.getRunIds():
+                raise IndexError('Run %s does not exist in %s' % (runId, self.testDir))
+            self._runs[runId] = self.runFactory.create( os.path.join(self.testDir, 'run', str(runId)) )
+        return self._runs[runId]
+
     def getRuns(self):
-        runDir = os.path.join(self.testDir, 'run')
-        dirs = os.listdir(runDir)
-        runs = []
-        for directory in dirs:
-            path = os.path.join( runDir, directory )
-            run = self.runFactory.create( path )
-            runs.append(run)
-        return runs
+        return [self.getRun(runId) for runId in self.getRunIds()]
+
+    def getRunCount(self):
+        return len(self.getRunIds())
 
     def getSignature(self):
         return self.md5signature
@@ -0,0 +1,80 @@
+import random
+
+class TestStatus:
+    def __init__(self, statusCode, statusText='', behindCount=None, testsCompleted=None, testsExpected=None):
+        self.__dict__.update(locals())
+    def isPending(self):
+        return 100 <= self.statusCode < 200
+    def isFailed(self):
+        return 400 <= self.statusCode < 500
+    def isQueued(self):
+        return self.statusCode == 101
+    def isRunning(self):
+        return self.statusCode == 100
+    def getProgress(self):
+        return (self.statusCode, self.behindCount, self.testsCompleted)
+    def __str__(self):
+        if self.isQueued() and self.behindCount is not None:
+            return 'queued behind %d tests' % (self.behindCount)
+        if self.isRunning() and self.testsExpected:
+            return 'running, %d of %d runs complete' % (self.testsCompleted or 0, self.testsExpected)
+        return self.statusText or 'status %d' % (self.statusCode)
+
+class PollState:
+    def __init__(self, submitted):
+        self.submitted = submitted
+        self.due = submitted
+        self.polls = 0
+        self.unchanged = 0
+        self.lastStatus = None
+        self.lastChange = submitted
+        self.queueRate = None
+        self.runStarted = None
+        self.eta = None
+
+# Decides when a pending test should be polled next.  The queue position and
+# run progress that WPT reports for 1xx statuses are turned into an estimate
+# of when the test will finish; without one, the delay backs off
+# exponentially while the status stays the same.  Every delay is jittered so
+# that tests submitted together don't keep polling in lock step.
+class PollPolicy:
+    def __init__(self, interval=10, maxInterval=60, timeout=900, minInterval=2, backoff=1.5, jitter=0.25):
+        self.__dict__.update(locals())
+
+    def expired(self, state, now):
+        return now - state.submitted > self.timeout
+
+    def update(self, state, status, now):
+        state.polls += 1
+        last = state.lastStatus
+
+        if last is not None and last.getProgress() == status.getProgress():
+            state.unchanged += 1
+        else:
+            if last is not None and last.isQueued() and status.isQueued() and None not in (last.behindCount, status.behindCount) and last.behindCount > status.behindCount:
+                rate = float(last.behindCount - status.behindCount) / max(now - state.lastChange, 1)
+                state.queueRate = rate if state.queueRate is None else (state.queueRate + rate) / 2
+            state.unchanged = 0
+            state.lastChange = now
+
+        if status.isRunning() and state.runStarted is None:
+            state.runStarted = now
+
+        state.eta = None
+        if status.isQueued() and status.behindCount is not None and state.queueRate:
+            state.eta = status.behindCount / state.queueRate
+        elif status.isRunning() and status.testsCompleted and status.testsExpected:
+            perRun = (now - state.runStarted) / status.testsCompleted
+            state.eta = max(status.testsExpected - status.testsCompleted, 0) * perRun
+
+        state.lastStatus = status
+        state.due = now + self.nextDelay(state)
+        return state
+
+    def nextDelay(self, state):
+        if state.eta is not None:
+            delay = state.eta
+        else:
+            delay = self.interval * (self.backoff ** state.unchanged)
+        delay = min(max(delay, self.minInterval), self.maxInterval)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
@@ -0,0 +1,115 @@
+import logging
+from time import sleep, time
+from multiprocessing.pool import ThreadPool
+from pageload.PageLoadTest import PageLoadTestException
+from pageload.Poller import PollPolicy, PollState, TestStatus
+from pageload import Trace
+
+class Factory:
+    def create(self, tests, workers=4, pollPolicy=None):
+        return Scheduler(tests, workers, pollPolicy if pollPolicy else PollPolicy())
+
+# Submits every test up front, then polls all of the outstanding tests from a
+# single loop, each one when the poll policy says it is next due.  Finished
+# tests are handed to a bounded pool of download workers so that a slow
+# download never holds up the polling of the other tests.
+class Scheduler:
+    def __init__(self, tests, workers, pollPolicy):
+        self.__dict__.update(locals())
+        self.logger = logging.getLogger('pageload')
+
+    def run(self):
+        outstanding = self._submit()
+        downloads = []
+        polls = 0
+        pool = ThreadPool(max(1, self.workers))
+
+        try:
+            with Trace.span('polling', 'scheduler', {'tests': len(outstanding)}) as args:
+                while len(outstanding):
+                    for entry in list(outstanding):
+                        (test, state) = entry
+                        if state.due > time():
+                            continue
+
+                        polls += 1
+                        try:
+                            status = test.poll()
+                        except PageLoadTestException as error:
+                            self.logger.warning(error)
+                            status = state.lastStatus if state.lastStatus else TestStatus(100)
+
+                        if status.isPending():
+                            if self.pollPolicy.expired(state, time()):
+                                self.logger.error('Timed out waiting for test %s (%d seconds)' % (test.testId, self.pollPolicy.timeout))
+                                outstanding.remove(entry)
+                                test.abort()
+                                continue
+                            changed = state.lastStatus is None or state.lastStatus.getProgress() != status.getProgress()
+                            self.pollPolicy.update(state, status, time())
+                            if changed:
+                                self._logProgress(test, status, state)
+                            continue
+
+                        outstanding.remove(entry)
+                        if status.isFailed():
+                            self.logger.error('Could not retrieve response for test %s (HTTP status code %d)' % (test.testId, status.statusCode))
+                            test.abort()
+                            continue
+
+                        self.logger.info('Test %s finished, %d still outstanding' % (test.testId, len(outstanding)))
+                        downloads.append( (test, pool.apply_async(test.fetchResults)) )
+
+                    if len(outstanding):
+                        nextDue = min([state.due for (test, state) in outstanding])
+                        with Trace.span('wait', 'scheduler', {'outstanding': len(outstanding)}):
+                            sleep(max(nextDue - time(), 0))
+
+                args['polls'] = polls
+            self.logger.info('Made %d status requests for %d tests' % (polls, len(self.tests)))
+            with Trace.span('collect', 'scheduler', {'tests': len(downloads)}):
+                return self._collect(downloads)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _logProgress(self, test, status, state):
+        if state.eta is not None:
+            self.logger.info('Test %s %s, ETA %ds' % (test.testId, status, state.eta))
+        else:
+            self.logger.info('Test %s %s' % (test.testId, status))
+
+    def _submit(self):
+        outstanding = []
+        for test in self.tests:
+            try:
+                if test.isSubmitted() or test.submit():
+                    outstanding.append( (test, PollState(time())) )
+            except PageLoadTestException as error:
+                self.logger.error(error)
+                test.abort()
+        self.logger.info('Submitted %d of %d tests, waiting for results' % (len(outstanding), len(self.tests)))
+        return outstanding
+
+    # Results are recorded from this thread only, so directories shared by
+    # several tests never see concurrent manifest writes.  The tests are done
+    # on WPT, so one that can't be downloaded or recorded stays journaled for
+    # resume instead of being aborted, and only costs itself.
+    def _collect(self, downloads):
+        results = []
+        for (test, download) in downloads:
+            try:
+                result = download.get()
+            except PageLoadTestException as error:
+                self.logger.error('%s; resume can try again' % (error))
+                continue
+            except Exception as error:
+                self.logger.error('Could not download test %s, resume can try again: %s: %s' % (test.testId, error.__class__.__name__, error))
+                continue
+            try:
+                test.finish( result )
+            except Exception as error:
+                self.logger.error('Could not record test %s, resume can try again: %s: %s' % (test.testId, error.__class__.__name__, error))
+                continue
+            results.append( result )
+        return results
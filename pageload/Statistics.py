@@ -0,0 +1,154 @@
+import math, random
+
+# NumPy is optional.  Without it the same statistics are computed column by
+# column in plain Python, with the same results.  It is imported the first
+# time it is needed rather than with this module, as it is slow to load.
+numpy = None
+numpyLoaded = False
+
+def loadNumpy():
+    global numpy, numpyLoaded
+    if not numpyLoaded:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        numpyLoaded = True
+    return numpy
+
+methods = ['mean', 'median', 'p75', 'p90', 'p95', 'p99', 'stddev', 'iqr', 'trimmed']
+
+# Fraction of the values dropped from each end by the trimmed mean
+trimFraction = 0.1
+
+# rows holds one list of metric values per run, every list in the same key
+# order.  Returns one combined value per metric, computed over all of the
+# metrics at once.
+def combine(method, rows):
+    if method not in methods:
+        raise ValueError('Unknown combine method %s' % (method))
+    if not len(rows):
+        return []
+    if loadNumpy() is not None:
+        return [float(value) for value in _combineArray(method, numpy.array(rows, dtype=float))]
+    return [_combineColumn(method, sorted([float(value) for value in column])) for column in zip(*rows)]
+
+# Combines along the runs axis, which is 0 for a runs x metrics table and 1
+# for a stack of bootstrap samples
+def _combineArray(method, values, axis=0):
+    runs = values.shape[axis]
+    if method == 'mean':
+        return values.mean(axis=axis)
+    if method == 'median':
+        return numpy.percentile(values, 50, axis=axis)
+    if method[0] == 'p':
+        return numpy.percentile(values, int(method[1:]), axis=axis)
+    if method == 'stddev':
+        if runs < 2:
+            return numpy.zeros(values.sum(axis=axis).shape)
+        return values.std(axis=axis, ddof=1)
+    if method == 'iqr':
+        (lower, upper) = numpy.percentile(values, [25, 75], axis=axis)
+        return upper - lower
+    trim = int(runs * trimFraction)
+    return numpy.take(numpy.sort(values, axis=axis), range(trim, runs - trim), axis=axis).mean(axis=axis)
+
+def _combineColumn(method, values):
+    runs = len(values)
+    if method == 'mean':
+        return sum(values) / runs
+    if method == 'median':
+        return percentile(values, 50)
+    if method[0] == 'p':
+        return percentile(values, int(method[1:]))
+    if method == 'stddev':
+        if runs < 2:
+            return 0.0
+        mean = sum(values) / runs
+        return math.sqrt(sum([(value - mean) ** 2 for value in values]) / (runs - 1))
+    if method == 'iqr':
+        return percentile(values, 75) - percentile(values, 25)
+    trim = int(runs * trimFraction)
+    kept = values[trim:runs - trim]
+    return sum(kept) / len(kept)
+
+# Percentile of already sorted values, interpolating linearly between the two
+# nearest ranks (NumPy's default)
+def percentile(values, q):
+    position = (len(values) - 1) * q / 100.0
+    lower = int(math.floor(position))
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+significanceTests = ['bootstrap', 'mannwhitney']
+
+# Confidence interval of the change in a combined metric (right minus left)
+# from resampling the runs of each side, and the two-sided bootstrap p-value
+# of there being no change.  left and right are runs x metrics tables; one
+# (lower, upper, p) tuple is returned per metric.  The resampling is seeded so
+# that the same runs always give the same answer.
+def bootstrap(method, left, right, confidence=0.95, resamples=2000, seed=0):
+    tail = (1 - confidence) * 50
+    if loadNumpy() is not None:
+        generator = numpy.random.RandomState(seed)
+        (left, right) = (numpy.array(left, dtype=float), numpy.array(right, dtype=float))
+        leftSamples = left[generator.randint(0, len(left), (resamples, len(left)))]
+        rightSamples = right[generator.randint(0, len(right), (resamples, len(right)))]
+        diffs = _combineArray(method, rightSamples, 1) - _combineArray(method, leftSamples, 1)
+        (lower, upper) = numpy.percentile(diffs, [tail, 100 - tail], axis=0)
+        pvalues = numpy.minimum(1, 2 * numpy.minimum((diffs <= 0).mean(axis=0), (diffs >= 0).mean(axis=0)))
+        return [(float(l), float(u), float(p)) for (l, u, p) in zip(lower, upper, pvalues)]
+
+    generator = random.Random(seed)
+    columns = [[] for value in left[0]]
+    for sample in range(resamples):
+        leftSample = [left[generator.randrange(len(left))] for row in left]
+        rightSample = [right[generator.randrange(len(right))] for row in right]
+        for (column, l, r) in zip(columns, combine(method, leftSample), combine(method, rightSample)):
+            column.append(r - l)
+    intervals = []
+    for diffs in columns:
+        diffs.sort()
+        below = len([diff for diff in diffs if diff <= 0]) / float(resamples)
+        above = len([diff for diff in diffs if diff >= 0]) / float(resamples)
+        intervals.append( (percentile(diffs, tail), percentile(diffs, 100 - tail), min(1.0, 2 * min(below, above))) )
+    return intervals
+
+# Two-sided Mann-Whitney U test of each metric, using the normal
+# approximation with a correction for ties.  Returns one p-value per metric.
+def mannWhitney(left, right):
+    (n1, n2) = (len(left), len(right))
+    total = n1 + n2
+    if loadNumpy() is not None:
+        values = numpy.array(list(left) + list(right), dtype=float)
+        # Midranks from pairwise comparisons, for every metric at once
+        less = (values[None, :, :] < values[:, None, :]).sum(axis=1)
+        equal = (values[None, :, :] == values[:, None, :]).sum(axis=1)
+        ranks = less + (equal + 1) / 2.0
+        ties = (equal ** 2 - 1).sum(axis=0)
+        rankSums = ranks[:n1].sum(axis=0)
+    else:
+        ties = []
+        rankSums = []
+        for column in zip(*(list(left) + list(right))):
+            counts = dict()
+            for value in column:
+                counts[value] = counts.get(value, 0) + 1
+            midranks = dict()
+            below = 0
+            for value in sorted(counts.keys()):
+                midranks[value] = below + (counts[value] + 1) / 2.0
+                below += counts[value]
+            ties.append( sum([count ** 3 - count for count in counts.values()]) )
+            rankSums.append( sum([midranks[value] for value in column[:n1]]) )
+
+    pvalues = []
+    for (rankSum, tie) in zip(rankSums, ties):
+        u = rankSum - n1 * (n1 + 1) / 2.0
+        variance = n1 * n2 / 12.0 * ((total + 1) - tie / float(total * (total - 1)))
+        if variance <= 0:
+            pvalues.append(1.0)
+            continue
+        z = max(abs(u - n1 * n2 / 2.0) - 0.5, 0) / math.sqrt(variance)
+        pvalues.append( float(math.erfc(z / math.sqrt(2))) )
+    return pvalues
@@ -0,0 +1,107 @@
+import os, json, logging
+
+class Factory:
+    def create(self, testsDir):
+        return TimeSeries(os.path.join(testsDir, '.pageload', 'timeseries'))
+
+# The aggregate metrics of every run of every result in a test directory, one
+# JSON line per run and view, appended as results are added.  Trend queries
+# read only this file, never the run data it was computed from.
+class TimeSeries:
+    views = ['firstView', 'repeatView']
+
+    def __init__(self, path):
+        self.__dict__.update(locals())
+        self.logger = logging.getLogger('pageload')
+
+    def append(self, result):
+        signature = result.getSignature()
+        entries = self._entries(result)
+        if self._contains(signature):
+            # Added again, as when resume finishes a test that was
+            # interrupted after its result was added
+            self._write('w', [entry for entry in self.query() if entry['signature'] != signature] + entries)
+        else:
+            self._write('a', entries)
+
+    def remove(self, signature):
+        self._write('w', [entry for entry in self.query() if entry['signature'] != signature])
+
+    def rebuild(self, results):
+        entries = []
+        for result in results:
+            entries.extend( self._entries(result) )
+        self._write('w', entries)
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    # Entries for one view, or all views, taken at or between the given
+    # times (datetime objects), oldest first
+    def query(self, since=None, until=None, view=None):
+        since = since.strftime('%Y%m%d%H%M%S') if since else None
+        until = until.strftime('%Y%m%d%H%M%S') if until else None
+        entries = []
+        if not self.exists():
+            return entries
+        fp = open(self.path)
+        for line in fp:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                self.logger.warning('Ignoring truncated time series entry in %s' % (self.path))
+                continue
+            if view and entry['view'] != view:
+                continue
+            if (since and entry['time'] < since) or (until and entry['time'] > until):
+                continue
+            entries.append(entry)
+        fp.close()
+        entries.sort(key=lambda entry: (entry['time'], entry['run']))
+        return entries
+
+    # Whether the file has entries for the signature, without parsing it
+    def _contains(self, signature):
+        if not self.exists():
+            return False
+        fp = open(self.path)
+        try:
+            return any(signature in line for line in fp)
+        finally:
+            fp.close()
+
+    def _entries(self, result):
+        # Imported here so that listing and trending tests doesn't load the
+        # filters
+        from pageload.Filter import FirstViewCountFilter, RepeatViewCountFilter
+        filterClasses = {'firstView': FirstViewCountFilter, 'repeatView': RepeatViewCountFilter}
+        entries = []
+        time = result.getDateTime().strftime('%Y%m%d%H%M%S')
+        for run in result.getRunIds():
+            for view in self.views:
+                countFilter = filterClasses[view]()
+                try:
+                    metrics = countFilter.getValues( countFilter.getRequests(result, run) )
+                except (IOError, OSError):
+                    # Tests can be run without a repeat view
+                    continue
+                entries.append({
+                    'signature': result.getSignature(),
+                    'time': time,
+                    'run': run,
+                    'view': view,
+                    'metrics': metrics
+                })
+        return entries
+
+    def _write(self, mode, entries):
+        contents = ''.join([json.dumps(entry, sort_keys=True) + '\n' for entry in entries])
+        if mode == 'a':
+            fp = open(self.path, 'a')
+            fp.write(contents)
+            fp.close()
+        else:
+            fp = open(self.path + '.tmp', 'w')
+            fp.write(contents)
+            fp.close()
+            os.rename(self.path + '.tmp', self.path)
@@ -0,0 +1,178 @@
+import os, sys, json, logging, threading
+from time import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Timed spans around the stages of a run or a filter, written out in Chrome's
+# trace event format (load the file in chrome://tracing or Perfetto).
+# Tracing is off unless start() has been called, in which case span() costs
+# no more than a function call.
+#
+# Each span also records the resident memory of the process when it ends and
+# how much it grew while the span was open, where /proc gives the current
+# figure (Linux).  Memory is per process, so the growth of spans in
+# concurrent threads can't be told apart.  The peak resident memory of the
+# process so far is recorded too, labelled as such: it only ever rises, so
+# it says nothing about a stage that runs after a larger one.
+tracer = None
+
+def start():
+    global tracer
+    tracer = Tracer()
+    return tracer
+
+# Writes the trace to path and turns tracing off again.  Returns the tracer,
+# or None if tracing wasn't on.
+def stop(path):
+    global tracer
+    (finished, tracer) = (tracer, None)
+    if finished is not None:
+        finished.write(path)
+    return finished
+
+# Use as "with span(...) as args:"; anything added to args is recorded with
+# the span
+def span(name, category, args=None):
+    if tracer is None:
+        return NoSpan(args)
+    return Span(tracer, name, category, args)
+
+# Traces every call of the decorated method, named after the class of the
+# object it is called on.  If argument is given, the first argument of the
+# call is recorded under that name.
+def traced(category, argument=None):
+    def wrapper(func):
+        def tracedCall(self, *args, **kwargs):
+            if tracer is None:
+                return func(self, *args, **kwargs)
+            spanArgs = {argument: args[0]} if argument and len(args) else None
+            with Span(tracer, '%s.%s' % (self.__class__.__name__, func.__name__), category, spanArgs):
+                return func(self, *args, **kwargs)
+        tracedCall.__name__ = func.__name__
+        tracedCall.__doc__ = func.__doc__
+        return tracedCall
+    return wrapper
+
+# Peak resident memory over the life of the process, in kilobytes
+def peakMemory():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on OS X
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+# Resident memory right now, in kilobytes, or None without /proc
+def currentMemory():
+    try:
+        fp = open('/proc/self/statm')
+        try:
+            resident = int(fp.read().split()[1])
+        finally:
+            fp.close()
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    return resident * pageSize // 1024
+
+pageSize = resource.getpagesize() if resource is not None else 4096
+
+class NoSpan:
+    def __init__(self, args):
+        self.args = dict(args) if args else {}
+    def __enter__(self):
+        return self.args
+    def __exit__(self, *exc):
+        return False
+
+class Span:
+    def __init__(self, tracer, name, category, args):
+        self.__dict__.update(locals())
+        self.args = dict(args) if args else {}
+    def __enter__(self):
+        self.memory = currentMemory()
+        self.start = time()
+        return self.args
+    def __exit__(self, excType, excValue, traceback):
+        end = time()
+        memory = currentMemory()
+        if memory is not None:
+            self.args['rss_kb'] = memory
+            if self.memory is not None:
+                self.args['rss_growth_kb'] = memory - self.memory
+        peak = peakMemory()
+        if peak is not None:
+            self.args['process_peak_rss_kb'] = peak
+        if excType is not None:
+            self.args['error'] = '%s: %s' % (excType.__name__, excValue)
+        self.tracer.record(self.name, self.category, self.start, end, self.args)
+        return False
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+        self.memoryGrowth = 0
+    def record(self, duration, memoryGrowth):
+        self.count += 1
+        self.total += duration
+        self.longest = max(self.longest, duration)
+        self.memoryGrowth = max(self.memoryGrowth, memoryGrowth or 0)
+    def asRecord(self):
+        return {'count': self.count, 'total_ms': self.total * 1000, 'longest_ms': self.longest * 1000, 'max_rss_growth_kb': self.memoryGrowth}
+
+class Tracer:
+    def __init__(self):
+        self.logger = logging.getLogger('pageload')
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.started = time()
+        self.events = []
+        self.threads = dict()
+        self.stages = dict()
+
+    def record(self, name, category, start, end, args):
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': (start - self.started) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': self.pid,
+            'tid': thread.ident,
+            'args': args
+        }
+        with self.lock:
+            self.events.append(event)
+            self.threads[thread.ident] = thread.name
+            if 'rss_kb' in args:
+                self.events.append({'name': 'memory', 'ph': 'C', 'ts': event['ts'] + event['dur'], 'pid': self.pid, 'args': {'rss_kb': args['rss_kb']}})
+            if name not in self.stages:
+                self.stages[name] = StageStats()
+            self.stages[name].record(end - start, args.get('rss_growth_kb'))
+
+    def getStages(self):
+        with self.lock:
+            return dict([(name, stats.asRecord()) for (name, stats) in self.stages.items()])
+
+    def write(self, path):
+        with self.lock:
+            events = list(self.events)
+            events += [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': ident, 'args': {'name': name}} for (ident, name) in self.threads.items()]
+        trace = {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'command': ' '.join(sys.argv), 'process_peak_rss_kb': peakMemory()},
+            'stages': self.getStages()
+        }
+        fp = open(path + '.tmp', 'w')
+        fp.write( json.dumps(trace) )
+        fp.close()
+        os.rename(path + '.tmp', path)
+
+        for (name, stats) in sorted(self.getStages().items(), key=lambda item: -item[1]['total_ms']):
+            self.logger.info('%s: %d calls, %.1f ms in all, longest %.1f ms, resident memory grew by up to %d KB' % (name, stats['count'], stats['total_ms'], stats['longest_ms'], stats['max_rss_growth_kb']))
+        self.logger.info('Wrote %d trace events to %s (peak resident memory of the process %s KB)' % (len(events), path, peakMemory()))
@@ -13,6 +13,10 @@ setup(
     author_email='sfrazer@bluestatedigital.com',
     packages=['pageload'],
     package_dir={'pageload': 'pageload'},
+    extras_require={
+      'numpy': ['numpy'],
+      'lzma': ['backports.lzma']
+      },
     entry_points={
       'console_scripts': [
             'pageload = pageload.Main:Cli'